@@ -1,5 +1,7 @@
 # https://www.rdocumentation.org/packages/nlme/versions/3.1-152/topics/gls
 
+# The same model is implemented in Python (without R), see `gls_car1.py`.
+
 library(nlme)
 
 # Read CSV into R
@@ -19,9 +19,12 @@ import os
 
 import pandas as pd
 import seaborn as sns
-from datetime import datetime, timedelta, time
 
-from read_csv_data import read_csv_data
+from py_air_quality.analysis.external_data import load_aqicn
+from py_air_quality.analysis.filter_effect import internal_daily, merge_external
+from py_air_quality.crud.data_quality import exclude_flagged
+from py_air_quality.crud.read_csv_data import read_csv_data
+from py_air_quality.internal import profiling
 
 
 # ------------------------------------------------------------------------------
@@ -45,50 +48,36 @@ path_out = '/home/john/PhD/GitHub/py-air-quality/py_air_quality/data/'
 pollutant = 'pm25'
 
 
+# Profile the script if requested (see `py_air_quality.internal.profiling`):
+profiling.start('analysis_filter_effect_aqicn', path_out)
+
+
 # ------------------------------------------------------------------------------
 # *** Read data from external data source
 
+profiling.mark('read_external')
+
 # Read and process data from external source (official outdoor measurement
-# station).
-df_external = pd.read_csv(path_csv_external, sep=',', comment='#')
-
-# Select relevant data:
-df_external = df_external.loc[df_external['City'] == 'Berlin']
-# df_external = df_external.loc[df_external['Specie'].isin(['pm25', 'pm10'])]
-df_external = df_external.loc[df_external['Specie'] == pollutant]
-
-date_format = '%Y-%m-%d'
-df_external['Date'] = \
-    [datetime.strptime(x, date_format) for x in df_external['Date'].tolist()]
-
-# The data from aqicn.org has one data point per day. The datetime defaults to
-# midnight (e.g. `2021-03-26 00:00:00`), but the corresponding measurement is
-# average for the entrie day (and the original data is without time, e.g.
-# '2021-03-26'). Add 12 hours, so that the epoch timestamp will correspond to
-# the (temporal) centre of the measurement period.
-df_external['Date'] = \
-    [(x + timedelta(hours=12.0)) for x in df_external['Date'].tolist()]
-
-# Datetime comparisons are error-prone with pandas; rather use epoch timestamp.
-df_external['timestamp'] = \
-    [round(x.timestamp()) for x in df_external['Date'].tolist()]
-
-df_external = df_external[['Date', 'timestamp', 'median']]
-df_external = df_external.rename(
-    columns={'median': (pollutant + '_external'),
-             'Date': 'date'}
-    )
+# station). Only the data of one city and pollutant is kept while reading, and
+# the result is cached (see `py_air_quality.analysis.external_data`).
+# The data from aqicn.org has one data point per day (average for the entire
+# day); the epoch timestamp corresponds to noon, the (temporal) centre of the
+# measurement period.
+df_external = load_aqicn(path_csv_external, city='Berlin', species=[pollutant])
 
-# Remove hours, minutes, and seconds from date:
-df_external['date'] = [x.date() for x in df_external['date'].tolist()]
+df_external = df_external[['timestamp', 'median']]
+df_external = df_external.rename(columns={'median': (pollutant + '_external')})
 
 
 # ------------------------------------------------------------------------------
 # *** Read data from internal data source
 
-# Read internal measurement data from csv file:
-df_baseline = read_csv_data(path_csv_indoor_baseline)
-df_filter = read_csv_data(path_csv_indoor_filter)
+profiling.mark('read_internal')
+
+# Read internal measurement data from csv file (without readings flagged as
+# spikes, stuck or out of range, see `py_air_quality.crud.data_quality`):
+df_baseline = exclude_flagged(read_csv_data(path_csv_indoor_baseline))
+df_filter = exclude_flagged(read_csv_data(path_csv_indoor_filter))
 
 # Concatenate data from internal source (i.e. both control condition without
 # filter, and experimental condition with filter:
@@ -96,43 +85,30 @@ df_baseline['filter'] = False
 df_filter['filter'] = True
 df_internal = pd.concat([df_baseline, df_filter], axis=0, ignore_index=True)
 
-df_internal = \
-    df_internal[['timestamp', 'datetime', pollutant, 'filter', 'weekend']]
+# The sampling interval is kept for time-weighted means (see
+# `py_air_quality.analysis.filter_effect`):
+df_internal = df_internal[
+    ['timestamp', 'datetime', pollutant, 'filter', 'weekend', 'interval']]
 df_internal = df_internal.rename(columns={pollutant: (pollutant + '_internal')})
 
 
 # ------------------------------------------------------------------------------
 # ***
 
-# Get date without hours, minutes, and seconds, so that we can calculate mean
-# pollutant concentration per day:
-df_internal['date'] = [x.date() for x in df_internal['datetime'].tolist()]
+profiling.mark('merge_daily')
 
 # The external data (from aqicn.org) only has a temporal resolution of one
 # measurement per day (median pollutant concentration per day). For comparison,
-# take the mean across each day for the internal data.
-df_internal_daily = df_internal.groupby(['date']).mean()
-df_internal_daily = df_internal_daily.reset_index(level=0, drop=False)
-
-# Remove day where condition changed from no filter to filter:
-df_internal_daily = \
-    df_internal_daily.loc[df_internal_daily['filter'].isin([0.0, 1.0])]
-
-# Set the epoch timestamp to noon of the corresponding day, so as to be able to
-# match internal and external data:
-df_internal_daily['date'] = \
-    [datetime.combine(x, time(12)) for x in df_internal_daily['date'].tolist()]
-df_internal_daily['timestamp'] = \
-    [round(x.timestamp()) for x in df_internal_daily['date'].tolist()]
+# take the mean across each day for the internal data (days where the condition
+# changed from no filter to filter are removed). The epoch timestamp of each day
+# is noon, so as to be able to match internal and external data:
+df_internal_daily = internal_daily(df_internal)
 
 # Merge internal and external data (with daily temporal resolution):
-df_internal_daily = df_internal_daily.sort_values('timestamp')
-df_external = df_external.sort_values('timestamp')
-df_daily = pd.merge_asof(
-    df_internal_daily,
-    df_external[['timestamp', 'pm25_external']],
-    on='timestamp',
-    direction='nearest',
+df_daily = merge_external(
+    df_internal=df_internal_daily,
+    df_external=df_external,
+    pollutant=pollutant,
     )
 
 # External and internal data are not on the same scale; divide each by its
@@ -167,6 +143,8 @@ df_daily = pd.concat([df_tmp_ext, df_tmp_int], axis=0, ignore_index=True)
 # ------------------------------------------------------------------------------
 # ***
 
+profiling.mark('bar_graph')
+
 colours = [
     [float(x) / 255.0 for x in [255, 0, 102, 255]],
     [float(x) / 255.0 for x in [44, 178, 252, 255]],
@@ -194,10 +172,10 @@ graph.axes[0][0].tick_params(labelsize=16)
 graph.legend.set_title('Filter', prop={'size': 16})
 for i in range(2):
     legend_text = graph.legend.texts[i].get_text()
-    if legend_text == '0.0':
+    if legend_text == 'False':
         graph.legend.texts[i].set_text('Off')
         graph.legend.texts[i].set_fontsize(16)
-    elif legend_text == '1.0':
+    elif legend_text == 'True':
         graph.legend.texts[i].set_text('On')
         graph.legend.texts[i].set_fontsize(16)
 
@@ -214,6 +192,8 @@ graph.savefig(os.path.join(path_out, 'filter_bar_plot.png'),
 # ------------------------------------------------------------------------------
 # *** Merge data from external & internal data source
 
+profiling.mark('merge_export')
+
 df_internal = df_internal.sort_values('timestamp')
 df_external = df_external.sort_values('timestamp')
 
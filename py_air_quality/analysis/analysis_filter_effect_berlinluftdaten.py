@@ -21,9 +21,16 @@ from copy import deepcopy
 
 import pandas as pd
 import seaborn as sns
-from datetime import datetime, timedelta
 
+from py_air_quality.analysis.external_data import load_luftdaten
+from py_air_quality.analysis.filter_effect import (
+    condition_changes,
+    internal_hourly,
+    merge_external,
+    )
+from py_air_quality.crud.data_quality import exclude_flagged
 from py_air_quality.crud.read_csv_data import read_csv_data
+from py_air_quality.internal import profiling
 
 
 # ------------------------------------------------------------------------------
@@ -47,27 +54,20 @@ path_out = '/home/john/PhD/GitHub/py-air-quality/py_air_quality/data/'
 pollutant = 'pm25'
 
 
+# Profile the script if requested (see `py_air_quality.internal.profiling`):
+profiling.start('analysis_filter_effect_berlinluftdaten', path_out)
+
+
 # ------------------------------------------------------------------------------
 # *** Read data from external data source
 
-# Read and process data from external source (official outdoor measurement
-# station).
-df_external = pd.read_csv(path_csv_external, sep=';', skiprows=3)
-
-df_external = df_external.rename(
-    columns={'Messzeit (Angaben in MESZ bzw. MEZ)': 'time_string',
-             'Stundenwerte': 'pm10',
-             'Stundenwerte.1': 'pm25',
-             }
-    )
+profiling.mark('read_external')
 
-date_format = '%d.%m.%Y %H:%M'
-df_external['datetime'] = [datetime.strptime(x, date_format)
-                           for x in df_external['time_string'].tolist()]
-
-# Datetime comparisons are error-prone with pandas; rather use epoch timestamp.
-df_external['timestamp'] = \
-    [round(x.timestamp()) for x in df_external['datetime'].tolist()]
+# Read and process data from external source (official outdoor measurement
+# station). Datetime comparisons are error-prone with pandas; rather use epoch
+# timestamp. The parsed data is cached (see
+# `py_air_quality.analysis.external_data`).
+df_external = load_luftdaten(path_csv_external)
 
 # Only keep the pollutant to be analysed ('pm25' or 'pm10'):
 df_external = df_external[['timestamp', pollutant]]
@@ -77,9 +77,12 @@ df_external = df_external.rename(columns={pollutant: (pollutant + '_external')})
 # ------------------------------------------------------------------------------
 # *** Read data from internal data source
 
-# Read internal measurement data from csv file:
-df_baseline = read_csv_data(path_csv_indoor_baseline)
-df_filter = read_csv_data(path_csv_indoor_filter)
+profiling.mark('read_internal')
+
+# Read internal measurement data from csv file (without readings flagged as
+# spikes, stuck or out of range, see `py_air_quality.crud.data_quality`):
+df_baseline = exclude_flagged(read_csv_data(path_csv_indoor_baseline))
+df_filter = exclude_flagged(read_csv_data(path_csv_indoor_filter))
 
 # Concatenate data from internal source (i.e. both control condition without
 # filter, and experimental condition with filter:
@@ -87,49 +90,28 @@ df_baseline['filter'] = False
 df_filter['filter'] = True
 df_internal = pd.concat([df_baseline, df_filter], axis=0, ignore_index=True)
 
+# The sampling interval is kept for time-weighted means (see
+# `py_air_quality.analysis.filter_effect`):
 df_internal = \
-    df_internal[['timestamp', 'datetime', pollutant, 'filter']]
+    df_internal[['timestamp', 'datetime', pollutant, 'filter', 'interval']]
 df_internal = df_internal.rename(columns={pollutant: (pollutant + '_internal')})
 
 
 # ------------------------------------------------------------------------------
 # *** Merge internal & external data
 
-# Round date to hours, so that we can calculate mean pollutant concentration per
-# hour; solution from https://stackoverflow.com/a/48938464/13386040
-def _hour_rounder(t):
-    # Rounds to nearest hour by adding a timedelta hour if minute >= 30
-    r = (t.replace(second=0, microsecond=0, minute=0, hour=t.hour)
-         +timedelta(hours=t.minute//30)
-         )
-    return r
-
-df_internal['datetime_hour'] = [
-    _hour_rounder(x) for x in df_internal['datetime'].tolist()
-    ]
+profiling.mark('merge')
 
 # The external data only has a temporal resolution of one measurement per hour.
-# For comparison, take the mean across each hour for the internal data.
-df_internal_hourly = df_internal.groupby(['datetime_hour']).mean()
-df_internal_hourly = df_internal_hourly.reset_index(level=0, drop=False)
-
-# Remove datapoint where condition changed from no filter to filter:
-df_internal_hourly = \
-    df_internal_hourly.loc[df_internal_hourly['filter'].isin([0.0, 1.0])]
-
-# Reset the timestamp to integer to be able to merge internal & external data on
-# timestamp:
-df_internal_hourly['timestamp'] = \
-    [round(x.timestamp()) for x in df_internal_hourly['datetime_hour'].tolist()]
+# For comparison, take the mean across each hour for the internal data (hours
+# where the condition changed from no filter to filter are removed):
+df_internal_hourly = internal_hourly(df_internal)
 
 # Merge internal and external data (with hourly temporal resolution):
-df_internal_hourly = df_internal_hourly.sort_values('timestamp')
-df_external = df_external.sort_values('timestamp')
-df_hourly = pd.merge_asof(
-    df_internal_hourly,
-    df_external[['timestamp', 'pm25_external']],
-    on='timestamp',
-    direction='nearest',
+df_hourly = merge_external(
+    df_internal=df_internal_hourly,
+    df_external=df_external,
+    pollutant=pollutant,
     )
 
 # We need to retain a version in wide format (to export for analysis in R):
@@ -152,6 +134,8 @@ df_hourly = pd.concat([df_tmp_ext, df_tmp_int], axis=0, ignore_index=True)
 # ------------------------------------------------------------------------------
 # *** Bar graph
 
+profiling.mark('bar_graph')
+
 colours = [
     [float(x) / 255.0 for x in [255, 0, 102, 255]],
     [float(x) / 255.0 for x in [68, 138, 255, 255]],
@@ -197,17 +181,13 @@ figure.clf()
 # ------------------------------------------------------------------------------
 # *** Plot pollution over time
 
+profiling.mark('time_plot')
+
 # Calculate rolling average, separately for internal & external measurements
 # (otherwise the rolling average would spread form one condition into the
 # other).
-
-df_hourly.loc[df_hourly['source'] == 'internal', pollutant] = \
-    df_hourly.loc[df_hourly['source'] == 'internal', pollutant
-                  ].rolling(24, center=True).mean()
-
-df_hourly.loc[df_hourly['source'] == 'external', pollutant] = \
-    df_hourly.loc[df_hourly['source'] == 'external', pollutant
-                  ].rolling(24, center=True).mean()
+df_hourly[pollutant] = df_hourly.groupby('source')[pollutant].transform(
+    lambda x: x.rolling(24, center=True).mean())
 
 # Exclude nan:
 # df_hourly = df_hourly[df_hourly[pollutant].notna()]
@@ -224,18 +204,10 @@ graph = sns.lineplot(
 
 # We would like to plot a vertical line at the time point when condition changed
 # from no filter to filter. Get the datetime of the condition changes.
-condition_changes = []
-for idx in df_hourly.loc[df_hourly['source'] == 'internal'].index:
-    try:
-        filter_t = df_hourly.iloc[idx]['filter']
-        filter_t_plus_one = df_hourly.iloc[(idx + 1)]['filter']
-        if filter_t != filter_t_plus_one:
-            condition_changes.append(df_hourly.iloc[(idx + 1)]['datetime_hour'])
-
-    except IndexError:
-        break
-
-for condition_change in condition_changes:
+df_tmp_int = df_hourly.loc[df_hourly['source'] == 'internal']
+idx_changes = condition_changes(df_tmp_int['filter'].to_numpy())
+
+for condition_change in df_tmp_int['datetime_hour'].iloc[idx_changes]:
     graph.axvline(x=condition_change,
                   ymin=0,
                   ymax=1,
@@ -284,6 +256,8 @@ figure.clf()
 # ------------------------------------------------------------------------------
 # *** Export data for analysis in R
 
+profiling.mark('export')
+
 df_hourly_wide = df_hourly_wide.sort_values('timestamp')
 
 # Exclude nan:
@@ -0,0 +1,355 @@
+"""
+Loaders for external reference data (outdoor measurement stations).
+
+Supported sources (see `py_air_quality/data/external_data_sources.md`):
+- luftdaten.berlin.de: hourly values of one station (`load_luftdaten`)
+- aqicn.org: daily statistics per city, for all cities world wide
+  (`load_aqicn`)
+- EEA air quality export: time series of one station (`load_eea`)
+
+The csv files are read in chunks, and only the rows of the requested city,
+species, or station are kept, so that memory use does not depend on the size of
+the (global) source file. The parsed data is cached as columnar `.npz` file
+(one array per column), keyed by the hash of the source file and the loader
+arguments. The hash of each source file is stored together with its size and
+modification time, so that repeated loads only need one `os.stat` and reading
+the cached arrays.
+
+All loaders return a dataframe with an epoch `timestamp` column (int64,
+seconds), sorted by timestamp.
+
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from dateutil import tz
+
+from py_air_quality.crud.time_features import epoch_from_wall_clock
+from py_air_quality.internal.content_hash import file_hash, job_key
+
+# Default cache directory (can be changed with `PY_AIR_QUALITY_CACHE`):
+cache_directory_default = os.environ.get(
+    "PY_AIR_QUALITY_CACHE",
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+        "py_air_quality",
+        "external_data",
+    ),
+)
+
+# Increase when the output of a loader changes, to invalidate cached results:
+cache_version = 1
+
+# Rows per chunk when reading the source files:
+chunksize = 200_000
+
+# Names of the pollutants in the EEA data:
+eea_pollutants = {"pm25": "PM2.5", "pm10": "PM10", "no2": "NO2", "o3": "O3"}
+
+
+# ------------------------------------------------------------------------------
+# *** Cache
+
+
+def _source_hash(path: str, cache_directory: str) -> str:
+    """
+    Hash of the source file content. Reuses the hash from the index of the
+    cache directory if size and modification time of the file are unchanged.
+    """
+    stat = os.stat(path)
+    path_index = os.path.join(cache_directory, "index.json")
+    try:
+        with open(path_index, "r") as json_file:
+            index = json.load(json_file)
+    except (OSError, ValueError):
+        index = {}
+
+    entry = index.get(os.path.abspath(path))
+    if (
+        (entry is not None)
+        and (entry["size"] == stat.st_size)
+        and (entry["mtime_ns"] == stat.st_mtime_ns)
+    ):
+        return entry["sha256"]
+
+    sha256 = file_hash(path)
+    index[os.path.abspath(path)] = {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": sha256,
+    }
+    path_tmp = path_index + ".{}.tmp".format(os.getpid())
+    with open(path_tmp, "w") as json_file:
+        json.dump(index, json_file, indent=1, sort_keys=True)
+    os.replace(path_tmp, path_index)
+    return sha256
+
+
+def _load_npz(path_cache: str) -> pd.DataFrame:
+    with np.load(path_cache, allow_pickle=False) as npz:
+        columns = [str(x) for x in npz["__columns__"]]
+        return pd.DataFrame({x: npz[x] for x in columns})
+
+
+def _save_npz(path_cache: str, df: pd.DataFrame):
+    """Save dataframe (numeric & string columns) atomically."""
+    arrays = {"__columns__": np.array([str(x) for x in df.columns])}
+    for column in df.columns:
+        values = df[column].to_numpy()
+        if values.dtype == object:
+            values = values.astype(str)
+        arrays[column] = values
+    path_tmp = path_cache + ".{}.tmp".format(os.getpid())
+    with open(path_tmp, "wb") as file:
+        np.savez(file, **arrays)
+    os.replace(path_tmp, path_cache)
+
+
+def cached(loader, path: str, *, cache_directory=None, **arguments) -> pd.DataFrame:
+    """
+    Result of `loader(path, **arguments)`, from the cache if the source file
+    and arguments are unchanged. No caching if `cache_directory` is False.
+    """
+    if cache_directory is False:
+        return loader(path, **arguments)
+    if cache_directory is None:
+        cache_directory = cache_directory_default
+    os.makedirs(cache_directory, exist_ok=True)
+
+    key = job_key(
+        loader=loader.__name__,
+        version=cache_version,
+        source=_source_hash(path, cache_directory),
+        arguments=arguments,
+    )
+    path_cache = os.path.join(cache_directory, key + ".npz")
+    if os.path.isfile(path_cache):
+        try:
+            return _load_npz(path_cache)
+        except (OSError, ValueError, KeyError):
+            # Incomplete or corrupt cache file, parse again.
+            pass
+
+    df = loader(path, **arguments)
+    _save_npz(path_cache, df)
+    return df
+
+
+def _read_filtered(path: str, *, filters: dict, **read_csv_arguments) -> pd.DataFrame:
+    """
+    Read csv file in chunks, keeping only rows where each column in `filters`
+    has one of the given values.
+    """
+    chunks = []
+    reader = pd.read_csv(path, chunksize=chunksize, **read_csv_arguments)
+    with reader:
+        for chunk in reader:
+            selected = np.ones(len(chunk), dtype=bool)
+            for column, values in filters.items():
+                selected &= chunk[column].isin(values).to_numpy()
+            # Keep the first chunk (even if empty) for the column names:
+            if selected.any() or (not chunks):
+                chunks.append(chunk.loc[selected])
+    if not chunks:
+        raise ValueError("No data in file: {}".format(path))
+    return pd.concat(chunks, axis=0, ignore_index=True)
+
+
+def _time_zone(zone_name):
+    """Time zone of an IANA name (e.g. 'Europe/Berlin'), or the local one."""
+    if zone_name is None:
+        return tz.gettz()
+    zone = tz.gettz(zone_name)
+    if zone is None:
+        raise ValueError("Unknown time zone: {}".format(zone_name))
+    return zone
+
+
+def _zone_key(zone_name) -> str:
+    """Identifier of a time zone for the cache key (also for local time)."""
+    if zone_name is None:
+        return "local:" + "/".join(time.tzname)
+    return zone_name
+
+
+# ------------------------------------------------------------------------------
+# *** luftdaten.berlin.de
+
+
+def _parse_luftdaten(path: str, *, local_time_zone: str) -> pd.DataFrame:
+    # One file per station (and only two value columns), no need to filter.
+    df = pd.read_csv(path, sep=";", skiprows=3)
+    df = df.rename(
+        columns={
+            "Messzeit (Angaben in MESZ bzw. MEZ)": "time_string",
+            "Stundenwerte": "pm10",
+            "Stundenwerte.1": "pm25",
+        }
+    )
+    wall_clock = pd.to_datetime(df["time_string"], format="%d.%m.%Y %H:%M")
+    df = pd.DataFrame(
+        {
+            "timestamp": epoch_from_wall_clock(wall_clock, _time_zone(local_time_zone)),
+            "pm10": pd.to_numeric(df["pm10"], errors="coerce").to_numpy(),
+            "pm25": pd.to_numeric(df["pm25"], errors="coerce").to_numpy(),
+        }
+    )
+    return df.sort_values("timestamp", ignore_index=True)
+
+
+def load_luftdaten(
+    path: str, *, local_time_zone: str = "Europe/Berlin", cache_directory=None
+) -> pd.DataFrame:
+    """
+    Hourly values of a luftdaten.berlin.de station (csv export, e.g.
+    `ber_mc042_20210414-20210712.csv`). The times in the file are Berlin time
+    (MESZ / MEZ). Returns `timestamp`, `pm10` and `pm25` (μg/m3).
+    """
+    return cached(
+        _parse_luftdaten,
+        path,
+        cache_directory=cache_directory,
+        local_time_zone=local_time_zone,
+    )
+
+
+# ------------------------------------------------------------------------------
+# *** aqicn.org
+
+
+def _parse_aqicn(
+    path: str, *, city: str, species: list, local_time_zone, zone_key: str
+) -> pd.DataFrame:
+    df = _read_filtered(
+        path,
+        filters={"City": [city], "Specie": species},
+        sep=",",
+        comment="#",
+        usecols=["Date", "City", "Specie", "count", "min", "max", "median"],
+    )
+    # One data point per day, averaged over the entire day; the timestamp is
+    # noon (local time), the temporal centre of the measurement period.
+    wall_clock = pd.to_datetime(df["Date"], format="%Y-%m-%d") + pd.Timedelta(hours=12)
+    df = pd.DataFrame(
+        {
+            "timestamp": epoch_from_wall_clock(wall_clock, _time_zone(local_time_zone)),
+            "specie": df["Specie"].to_numpy(dtype=str),
+            "count": df["count"].to_numpy(dtype=np.float64),
+            "min": df["min"].to_numpy(dtype=np.float64),
+            "max": df["max"].to_numpy(dtype=np.float64),
+            "median": df["median"].to_numpy(dtype=np.float64),
+        }
+    )
+    return df.sort_values(["timestamp", "specie"], ignore_index=True)
+
+
+def load_aqicn(
+    path: str,
+    *,
+    city: str = "Berlin",
+    species=("pm25",),
+    local_time_zone=None,
+    cache_directory=None,
+) -> pd.DataFrame:
+    """
+    Daily statistics of one city from the aqicn.org data platform (e.g.
+    `waqi-covid19-airqualitydata-2020.csv`), for the given species (e.g. 'pm25',
+    'pm10'). The timestamp of each day is noon in `local_time_zone` (IANA name,
+    default: local time zone of the system). Returns `timestamp`, `specie`, `count`,
+    `min`, `max` and `median` (long format, one row per day and specie).
+    """
+    return cached(
+        _parse_aqicn,
+        path,
+        cache_directory=cache_directory,
+        city=city,
+        species=sorted(species),
+        local_time_zone=local_time_zone,
+        zone_key=_zone_key(local_time_zone),
+    )
+
+
+# ------------------------------------------------------------------------------
+# *** European Environment Agency
+
+
+def _parse_eea(
+    path: str, *, pollutants: list, station, averaging_time: str, valid_only: bool
+) -> pd.DataFrame:
+    filters = {
+        "AirPollutant": [eea_pollutants[x] for x in pollutants],
+        "AveragingTime": [averaging_time],
+    }
+    if station is not None:
+        filters["AirQualityStationEoICode"] = [station]
+    df = _read_filtered(
+        path,
+        filters=filters,
+        encoding="utf-8-sig",
+        usecols=[
+            "AirQualityStationEoICode",
+            "AirPollutant",
+            "AveragingTime",
+            "Concentration",
+            "DatetimeEnd",
+            "Validity",
+        ],
+    )
+    if valid_only:
+        # Validity: 1 valid, 2 & 3 valid but below detection limit, negative
+        # values not valid.
+        df = df.loc[1 <= df["Validity"]]
+
+    # Times include the UTC offset, e.g. '2021-01-01 01:00:00 +01:00'. The
+    # timestamp is the end of the averaging period (as for luftdaten.berlin.de).
+    timestamp = (
+        pd.to_datetime(df["DatetimeEnd"], utc=True)
+        .dt.tz_localize(None)
+        .to_numpy(dtype="datetime64[s]")
+        .astype(np.int64)
+    )
+    df_long = pd.DataFrame(
+        {
+            "timestamp": timestamp,
+            "pollutant": df["AirPollutant"].to_numpy(),
+            "concentration": df["Concentration"].to_numpy(dtype=np.float64),
+        }
+    )
+    df_wide = df_long.pivot_table(
+        index="timestamp", columns="pollutant", values="concentration"
+    )
+    df_wide = df_wide.rename(columns={v: k for k, v in eea_pollutants.items()})
+    df_wide = df_wide.reindex(columns=pollutants)
+    df_wide.columns.name = None
+    return df_wide.reset_index()
+
+
+def load_eea(
+    path: str,
+    *,
+    pollutants=("pm25", "pm10"),
+    station=None,
+    averaging_time: str = "hour",
+    valid_only: bool = True,
+    cache_directory=None,
+) -> pd.DataFrame:
+    """
+    Time series of an EEA air quality station (e.g.
+    `DE_6001_71705_2021_timeseries.csv`), optionally only of one station (EoI
+    code, e.g. 'DEBE125'). Values that are not valid are removed unless
+    `valid_only` is False. Returns `timestamp` and one column per pollutant
+    (μg/m3), e.g. `pm25` and `pm10`.
+    """
+    return cached(
+        _parse_eea,
+        path,
+        cache_directory=cache_directory,
+        pollutants=list(pollutants),
+        station=station,
+        averaging_time=averaging_time,
+        valid_only=valid_only,
+    )
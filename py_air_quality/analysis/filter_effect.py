@@ -0,0 +1,236 @@
+"""
+Combine indoor & outdoor measurements to assess the effect of an air filter.
+
+The internal data (SDS011 sensor, with and without filter) is averaged per hour
+(or per day) and merged with the external data (outdoor measurement station),
+see `analysis_filter_effect_berlinluftdaten.py` and
+`analysis_filter_effect_aqicn.py`.
+
+Resampling works on integer epoch timestamps: each measurement is assigned to a
+bucket (local hour or local day), and the means are computed with one pass over
+the sorted buckets (no per-row Python calls), so that years of 1 Hz data can be
+processed in seconds.
+
+If the internal data has an `interval` column (sampling interval, see
+`py_air_quality/measurement/adaptive_sampling.py`), the means are weighted by
+time, so that densely sampled periods (e.g. pollution events) are not
+overrepresented.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+from py_air_quality.crud.read_csv_data import interval_weights
+from py_air_quality.crud.time_features import (
+    epoch_from_wall_clock,
+    local_datetime,
+    resolve_time_zone,
+    wall_clock_seconds,
+)
+
+# ------------------------------------------------------------------------------
+# *** Resampling
+
+
+def _data_time_zone(df: pd.DataFrame, local_time_zone=None):
+    """
+    Time zone for resampling: the given one, else the time zone of the
+    `datetime` column (if time zone aware), else the local time zone.
+    """
+    if local_time_zone is not None:
+        return local_time_zone
+    if "datetime" in df.columns:
+        zone = getattr(df["datetime"].dtype, "tz", None)
+        if zone is not None:
+            return zone
+    return resolve_time_zone(None)
+
+
+def local_bucket(
+    timestamp, *, bucket_seconds: int, local_time_zone=None, nearest: bool = False
+) -> np.ndarray:
+    """
+    Epoch timestamp (in seconds) of the local time bucket (e.g. hour: 3600, or
+    day: 86400) of each timestamp. The start of the bucket, or the nearest
+    bucket boundary if `nearest` (e.g. rounding to the nearest hour). Buckets
+    are aligned to local wall-clock time; when the clock is set back, the
+    repeated hour is a separate bucket.
+    """
+    timestamp = np.asarray(timestamp, dtype=np.int64)
+    wall = wall_clock_seconds(local_datetime(timestamp, local_time_zone))
+    if nearest:
+        wall_bucket = np.floor_divide(wall + bucket_seconds // 2, bucket_seconds)
+    else:
+        wall_bucket = np.floor_divide(wall, bucket_seconds)
+    return timestamp + (wall_bucket * bucket_seconds - wall)
+
+
+def resample_mean(df: pd.DataFrame, *, bucket, columns, weights=None) -> pd.DataFrame:
+    """
+    Mean of `columns` of `df` per bucket (integer array, one value per row,
+    e.g. from `local_bucket`), optionally weighted (one weight per row).
+    Missing values are ignored. Returns one row per bucket (sorted), with the
+    bucket in the `timestamp` column.
+    """
+    if weights is None:
+        weights = np.ones(len(df))
+    weights = np.asarray(weights, dtype=np.float64)
+    bucket = np.asarray(bucket, dtype=np.int64)
+    if 1 < len(bucket) and np.any(bucket[1:] < bucket[:-1]):
+        order = np.argsort(bucket, kind="stable")
+    else:
+        order = None
+    if order is not None:
+        bucket = bucket[order]
+        weights = weights[order]
+
+    # First row of each bucket:
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket)) + 1))
+    if len(bucket) == 0:
+        starts = starts[:0]
+
+    data = {"timestamp": bucket[starts]}
+    for column in columns:
+        values = df[column].to_numpy(dtype=np.float64)
+        if order is not None:
+            values = values[order]
+        valid = ~np.isnan(values)
+        sums = np.add.reduceat(np.where(valid, values * weights, 0.0), starts)
+        counts = np.add.reduceat(np.where(valid, weights, 0.0), starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            data[column] = sums / counts
+    return pd.DataFrame(data)
+
+
+def _value_columns(df: pd.DataFrame):
+    """Columns that can be averaged (numeric or boolean, except time)."""
+    return [
+        x
+        for x in df.columns
+        if (x not in ("timestamp", "datetime", "interval"))
+        and (pd.api.types.is_numeric_dtype(df[x]) or pd.api.types.is_bool_dtype(df[x]))
+    ]
+
+
+def _weights(df: pd.DataFrame):
+    """Time weights of the rows (None if the sampling interval is unknown)."""
+    if "interval" not in df.columns:
+        return None
+    return interval_weights(
+        df["interval"].to_numpy(dtype=np.float64),
+        df["timestamp"].to_numpy(dtype=np.int64),
+    )
+
+
+def _remove_condition_changes(df: pd.DataFrame, condition: str) -> pd.DataFrame:
+    """Remove buckets during which the condition changed (mean not 0 or 1)."""
+    df = df.loc[df[condition].isin([0.0, 1.0])].copy()
+    df[condition] = df[condition].astype(bool)
+    return df.reset_index(drop=True)
+
+
+def internal_hourly(
+    df_internal: pd.DataFrame, *, local_time_zone=None, condition: str = "filter"
+) -> pd.DataFrame:
+    """
+    Mean of the internal measurements per hour (rounded to the nearest local
+    hour).
+
+    `df_internal` needs an epoch `timestamp` column and a `condition` column
+    (e.g. filter on / off). Hours during which the condition changed (from no
+    filter to filter) are removed. Returns one row per hour, with
+    `datetime_hour` (naive local time) and epoch `timestamp` of the hour.
+    """
+    local_time_zone = _data_time_zone(df_internal, local_time_zone)
+    bucket = local_bucket(
+        df_internal["timestamp"].to_numpy(),
+        bucket_seconds=3600,
+        local_time_zone=local_time_zone,
+        nearest=True,
+    )
+    df_hourly = resample_mean(
+        df_internal,
+        bucket=bucket,
+        columns=_value_columns(df_internal),
+        weights=_weights(df_internal),
+    )
+    df_hourly = _remove_condition_changes(df_hourly, condition)
+    df_hourly.insert(
+        0,
+        "datetime_hour",
+        local_datetime(df_hourly["timestamp"].to_numpy(), local_time_zone)
+        .tz_localize(None)
+        .to_numpy(),
+    )
+    return df_hourly
+
+
+def internal_daily(
+    df_internal: pd.DataFrame, *, local_time_zone=None, condition: str = "filter"
+) -> pd.DataFrame:
+    """
+    Mean of the internal measurements per local calendar day.
+
+    As `internal_hourly`, but the epoch `timestamp` of each day is noon (local
+    time), the temporal centre of daily external data; `date` is noon as naive
+    local time.
+    """
+    local_time_zone = _data_time_zone(df_internal, local_time_zone)
+    bucket = local_bucket(
+        df_internal["timestamp"].to_numpy(),
+        bucket_seconds=86400,
+        local_time_zone=local_time_zone,
+    )
+    df_daily = resample_mean(
+        df_internal,
+        bucket=bucket,
+        columns=_value_columns(df_internal),
+        weights=_weights(df_internal),
+    )
+    df_daily = _remove_condition_changes(df_daily, condition)
+
+    # Noon of each day (the bucket is the start of the local day):
+    wall_noon = (
+        wall_clock_seconds(
+            local_datetime(df_daily["timestamp"].to_numpy(), local_time_zone)
+        )
+        + 43200
+    )
+    df_daily["timestamp"] = epoch_from_wall_clock(wall_noon, local_time_zone)
+    df_daily.insert(0, "date", pd.to_datetime(wall_noon, unit="s"))
+    return df_daily
+
+
+def condition_changes(condition) -> np.ndarray:
+    """
+    Indices of the elements where the condition differs from the preceding
+    element (e.g. the first hour with filter after hours without filter).
+    """
+    condition = np.asarray(condition)
+    return np.flatnonzero(condition[1:] != condition[:-1]) + 1
+
+
+# ------------------------------------------------------------------------------
+# *** Merge with external data
+
+
+def merge_external(
+    *, df_internal: pd.DataFrame, df_external: pd.DataFrame, pollutant: str
+) -> pd.DataFrame:
+    """
+    Merge resampled internal data with the nearest external datapoint.
+
+    `df_external` needs an epoch `timestamp` and a `<pollutant>_external`
+    column. Returns the merged data in wide format.
+    """
+    column_external = pollutant + "_external"
+    df_internal = df_internal.sort_values("timestamp")
+    df_external = df_external.sort_values("timestamp")
+    df_merged = pd.merge_asof(
+        df_internal,
+        df_external[["timestamp", column_external]],
+        on="timestamp",
+        direction="nearest",
+    )
+    return df_merged
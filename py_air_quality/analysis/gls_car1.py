@@ -0,0 +1,380 @@
+"""
+Generalised least squares with continuous-time AR(1) errors.
+
+Python implementation of the model fitted in `analysis.r` with
+`nlme::gls(y ~ x, correlation=corCAR1(form=~timestamp))`: the correlation
+between the errors of two observations is `phi ** abs(t_i - t_j)`, for
+irregularly spaced timestamps.
+
+The inverse of a CAR(1) correlation matrix is tridiagonal (the errors are a
+Markov process), so instead of building the n × n matrix, the data is
+"whitened" in a single pass over consecutive observations, and the (restricted)
+likelihood is computed in O(n) time and memory. `phi` is estimated by maximising
+the REML (or ML) profile likelihood with a golden-section search. This scales to
+minute-resolution data with millions of rows.
+
+Note on `gls_summary.md`: the timestamps are in seconds, so for hourly data the
+correlation between consecutive hours is `phi ** 3600`, which is zero for any
+`phi` not very close to 1. The likelihood is flat around the initial value of
+`corCAR1` (0.2), where nlme stopped, so the published fit is equivalent to
+independent errors. It is reproduced exactly with `phi=0.2`; the estimated
+`phi` accounts for the correlation between consecutive hours.
+
+Usage (same data and model as `analysis.r`):
+```
+python py_air_quality/analysis/gls_car1.py
+python py_air_quality/analysis/gls_car1.py --phi 0.2
+```
+
+"""
+
+import argparse
+import math
+import os
+
+import numpy as np
+
+# Default data file (exported by `analysis_filter_effect_berlinluftdaten.py`):
+path_csv = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "data", "preprocessed.csv"
+)
+
+# Search interval of the golden-section search, for the correlation between
+# observations that are one median time step apart:
+correlation_bounds = (0.0, 0.9999)
+
+# Golden ratio conjugate:
+_inv_phi = (math.sqrt(5.0) - 1.0) / 2.0
+
+
+# ------------------------------------------------------------------------------
+# *** Likelihood
+
+
+def car1_correlation(timestamp: np.ndarray, phi: float) -> np.ndarray:
+    """Correlation between consecutive observations, `phi ** time difference`."""
+    time_diff = np.diff(timestamp.astype(np.float64))
+    if np.any(time_diff <= 0.0):
+        raise ValueError("Timestamps must be strictly increasing.")
+    return np.power(phi, time_diff)
+
+
+def car1_whiten(values: np.ndarray, rho: np.ndarray):
+    """
+    Transform values with CAR(1) correlated errors into values with independent
+    errors (multiplication with the inverse Cholesky factor of the correlation
+    matrix). `values` has shape (n,) or (n, k), `rho` is the correlation between
+    consecutive observations (see `car1_correlation`). Returns the whitened
+    values and the log-determinant of the correlation matrix.
+    """
+    one_minus_rho_squared = 1.0 - np.square(rho)
+    scale = 1.0 / np.sqrt(one_minus_rho_squared)
+    if values.ndim == 2:
+        rho = rho[:, np.newaxis]
+        scale = scale[:, np.newaxis]
+    whitened = np.empty_like(values, dtype=np.float64)
+    whitened[0] = values[0]
+    whitened[1:] = (values[1:] - rho * values[:-1]) * scale
+    log_det = float(np.sum(np.log(one_minus_rho_squared)))
+    return whitened, log_det
+
+
+def profile_likelihood(
+    y: np.ndarray, X: np.ndarray, timestamp: np.ndarray, phi: float, method="REML"
+) -> dict:
+    """
+    Fit the coefficients for a given `phi`, with the residual variance profiled
+    out. Returns a dictionary with the coefficients (`beta`), residual variance
+    (`sigma2`), `(X' R^-1 X)^-1` (`xtx_inv`) and log-likelihood (`log_lik`, on
+    the same scale as nlme).
+    """
+    n, p = X.shape
+    rho = car1_correlation(timestamp, phi)
+    y_white, log_det = car1_whiten(y, rho)
+    X_white, _ = car1_whiten(X, rho)
+
+    # Least squares on the whitened data (via QR, for numerical stability):
+    q, r = np.linalg.qr(X_white)
+    beta = np.linalg.solve(r, q.T @ y_white)
+    residuals = y_white - X_white @ beta
+    rss = float(residuals @ residuals)
+
+    r_inv = np.linalg.inv(r)
+    xtx_inv = r_inv @ r_inv.T
+
+    if method == "REML":
+        n_eff = n - p
+        log_det_xtx = 2.0 * float(np.sum(np.log(np.abs(np.diag(r)))))
+    elif method == "ML":
+        n_eff = n
+        log_det_xtx = 0.0
+    else:
+        raise ValueError("Unknown method: {}".format(method))
+
+    sigma2 = rss / n_eff
+    log_lik = (
+        -0.5 * n_eff * (math.log(2.0 * math.pi) + 1.0 + math.log(sigma2))
+        - 0.5 * log_det
+        - 0.5 * log_det_xtx
+    )
+    return {
+        "beta": beta,
+        "sigma2": sigma2,
+        "xtx_inv": xtx_inv,
+        "log_lik": log_lik,
+    }
+
+
+def golden_section_max(function, lower: float, upper: float, tol: float = 1e-8):
+    """Maximise a unimodal function of one variable on `[lower, upper]`."""
+    c = upper - _inv_phi * (upper - lower)
+    d = lower + _inv_phi * (upper - lower)
+    f_c = function(c)
+    f_d = function(d)
+    while tol < (upper - lower):
+        if f_d < f_c:
+            upper, d, f_d = d, c, f_c
+            c = upper - _inv_phi * (upper - lower)
+            f_c = function(c)
+        else:
+            lower, c, f_c = c, d, f_d
+            d = lower + _inv_phi * (upper - lower)
+            f_d = function(d)
+    return (c, f_c) if f_d < f_c else (d, f_d)
+
+
+# ------------------------------------------------------------------------------
+# *** Student's t distribution
+
+
+def _beta_continued_fraction(a: float, b: float, x: float) -> float:
+    """Continued fraction of the incomplete beta function (modified Lentz)."""
+    tiny = 1e-300
+    qab = a + b
+    qap = a + 1.0
+    qam = a - 1.0
+    c = 1.0
+    d = 1.0 - qab * x / qap
+    d = 1.0 / (d if tiny < abs(d) else tiny)
+    h = d
+    for m in range(1, 10000):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1.0 + aa * d
+        d = 1.0 / (d if tiny < abs(d) else tiny)
+        c = 1.0 + aa / c
+        c = c if tiny < abs(c) else tiny
+        h *= d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1.0 + aa * d
+        d = 1.0 / (d if tiny < abs(d) else tiny)
+        c = 1.0 + aa / c
+        c = c if tiny < abs(c) else tiny
+        delta = d * c
+        h *= delta
+        if abs(delta - 1.0) < 1e-15:
+            break
+    return h
+
+
+def regularized_incomplete_beta(a: float, b: float, x: float) -> float:
+    """Regularised incomplete beta function I_x(a, b)."""
+    if x <= 0.0:
+        return 0.0
+    if 1.0 <= x:
+        return 1.0
+    log_front = (
+        math.lgamma(a + b)
+        - math.lgamma(a)
+        - math.lgamma(b)
+        + a * math.log(x)
+        + b * math.log1p(-x)
+    )
+    # The continued fraction converges quickly for x < (a + 1) / (a + b + 2):
+    if x < (a + 1.0) / (a + b + 2.0):
+        return math.exp(log_front) * _beta_continued_fraction(a, b, x) / a
+    return 1.0 - math.exp(log_front) * _beta_continued_fraction(b, a, 1.0 - x) / b
+
+
+def t_test_p_value(t: float, df: float) -> float:
+    """Two-sided p-value of a t statistic with `df` degrees of freedom."""
+    return regularized_incomplete_beta(0.5 * df, 0.5, df / (df + t * t))
+
+
+# ------------------------------------------------------------------------------
+# *** Model
+
+
+def fit_gls_car1(
+    *,
+    y: np.ndarray,
+    X: np.ndarray,
+    timestamp: np.ndarray,
+    names=None,
+    phi=None,
+    method: str = "REML",
+) -> dict:
+    """
+    Fit a linear model with CAR(1) errors (like `nlme::gls` with `corCAR1`).
+
+    `X` is the design matrix (including the intercept column), `timestamp` the
+    time of each observation (e.g. epoch seconds; the unit of `phi`). If `phi`
+    is None, it is estimated. The correlation parameter is counted in AIC & BIC
+    (also if `phi` is given, as nlme does when it estimates it). Returns a
+    dictionary with the estimates and test statistics (see `summary`).
+    """
+    y = np.asarray(y, dtype=np.float64)
+    X = np.asarray(X, dtype=np.float64)
+    timestamp = np.asarray(timestamp, dtype=np.float64)
+    n, p = X.shape
+    if names is None:
+        names = ["x{}".format(idx) for idx in range(p)]
+
+    order = np.argsort(timestamp, kind="stable")
+    y = y[order]
+    X = X[order]
+    timestamp = timestamp[order]
+
+    if phi is None:
+        # Search on the correlation between observations that are one median
+        # time step apart (phi itself is often very close to 1):
+        time_step = float(np.median(np.diff(timestamp)))
+
+        def objective(correlation):
+            phi_candidate = correlation ** (1.0 / time_step)
+            return profile_likelihood(y, X, timestamp, phi_candidate, method)["log_lik"]
+
+        correlation, log_lik = golden_section_max(objective, *correlation_bounds)
+        # The golden-section search does not evaluate the bounds:
+        if log_lik < objective(0.0):
+            correlation = 0.0
+        phi = correlation ** (1.0 / time_step)
+
+    fit = profile_likelihood(y, X, timestamp, phi, method)
+    beta = fit["beta"]
+    sigma = math.sqrt(fit["sigma2"])
+    covariance = fit["sigma2"] * fit["xtx_inv"]
+    std_error = np.sqrt(np.diag(covariance))
+    t_value = beta / std_error
+    df_residual = n - p
+    p_value = np.array([t_test_p_value(float(x), df_residual) for x in t_value])
+
+    # Number of parameters: coefficients, residual variance & phi.
+    n_params = p + 2
+    n_bic = (n - p) if method == "REML" else n
+    log_lik = fit["log_lik"]
+
+    residuals = np.empty(n)
+    residuals[order] = y - X @ beta
+
+    return {
+        "names": list(names),
+        "method": method,
+        "phi": phi,
+        "coefficients": beta,
+        "std_error": std_error,
+        "t_value": t_value,
+        "p_value": p_value,
+        "correlation": covariance / np.outer(std_error, std_error),
+        "sigma": sigma,
+        "residuals": residuals,
+        "log_lik": log_lik,
+        "aic": -2.0 * log_lik + 2.0 * n_params,
+        "bic": -2.0 * log_lik + math.log(n_bic) * n_params,
+        "n": n,
+        "df_residual": df_residual,
+    }
+
+
+def summary(result: dict) -> str:
+    """Summary of a fit, in the layout of `summary(gls(...))` in R."""
+    lines = [
+        "Generalized least squares fit by {}".format(result["method"]),
+        "{:>10} {:>10} {:>10}".format("AIC", "BIC", "logLik"),
+        "{:>10.3f} {:>10.3f} {:>10.3f}".format(
+            result["aic"], result["bic"], result["log_lik"]
+        ),
+        "",
+        "Correlation Structure: Continuous AR(1)",
+        " Parameter estimate(s):",
+        "Phi ",
+        "{:.10g}".format(result["phi"]),
+        "",
+        "Coefficients:",
+    ]
+    width = max(len(x) for x in result["names"]) + 2
+    lines.append(
+        "{:<{}}{:>12}{:>12}{:>12}{:>12}".format(
+            "", width, "Value", "Std.Error", "t-value", "p-value"
+        )
+    )
+    for idx, name in enumerate(result["names"]):
+        lines.append(
+            "{:<{}}{:>12.7g}{:>12.7g}{:>12.7g}{:>12.4g}".format(
+                name,
+                width,
+                result["coefficients"][idx],
+                result["std_error"][idx],
+                result["t_value"][idx],
+                result["p_value"][idx],
+            )
+        )
+
+    lines += ["", " Correlation: "]
+    for idx in range(1, len(result["names"])):
+        values = " ".join(
+            "{:>6.3f}".format(x) for x in result["correlation"][idx, :idx]
+        )
+        lines.append("{:<{}}{}".format(result["names"][idx], width, values))
+
+    quantiles = np.quantile(
+        result["residuals"] / result["sigma"], [0.0, 0.25, 0.5, 0.75, 1.0]
+    )
+    lines += [
+        "",
+        "Standardized residuals:",
+        "{:>11}{:>11}{:>11}{:>11}{:>11}".format("Min", "Q1", "Med", "Q3", "Max"),
+        "".join("{:>11.7f}".format(x) for x in quantiles),
+        "",
+        "Residual standard error: {:.7g} ".format(result["sigma"]),
+        "Degrees of freedom: {} total; {} residual".format(
+            result["n"], result["df_residual"]
+        ),
+    ]
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(
+        description="Fit pm25_internal ~ filter + pm25_external with CAR(1) errors."
+    )
+    parser.add_argument("--csv", default=path_csv, help="Path of preprocessed.csv")
+    parser.add_argument(
+        "--phi", type=float, default=None, help="Fixed phi (default: estimate)."
+    )
+    parser.add_argument("--method", choices=["REML", "ML"], default="REML")
+    args = parser.parse_args(argv)
+
+    df = pd.read_csv(args.csv, sep=";")
+    X = np.column_stack(
+        [
+            np.ones(len(df)),
+            df["filter"].astype(bool).to_numpy(dtype=np.float64),
+            df["pm25_external"].to_numpy(dtype=np.float64),
+        ]
+    )
+    result = fit_gls_car1(
+        y=df["pm25_internal"].to_numpy(dtype=np.float64),
+        X=X,
+        timestamp=df["timestamp"].to_numpy(dtype=np.float64),
+        names=["(Intercept)", "filterTrue", "pm25_external"],
+        phi=args.phi,
+        method=args.method,
+    )
+    print(summary(result))
+
+
+if __name__ == "__main__":
+    main()
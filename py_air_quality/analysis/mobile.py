@@ -0,0 +1,217 @@
+"""
+Processing of mobile air quality measurements.
+
+Join air pollution data (measured with py-air-quality) with GPS location data
+(from the "GPS Logger" Android App), see `mobile_measurement.py`.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def parse_gps_timestamps(datetime_strings) -> np.ndarray:
+    """
+    Epoch timestamps (int64, rounded to seconds) of GPS Logger datetime strings
+    (e.g. '2025-03-09 14:00:01', some with fractional seconds, e.g.
+    '2025-03-09 14:00:01.000'). The GPS datetime is assumed to be in UTC.
+    Raises a `ValueError` if a string cannot be parsed.
+    """
+    # Mixed formats (with & without fractional seconds) are parsed in one
+    # vectorised pass:
+    datetime_utc = pd.to_datetime(
+        pd.Series(datetime_strings, dtype=object), format="ISO8601", utc=True
+    )
+    microseconds = (
+        datetime_utc.dt.tz_localize(None)
+        .to_numpy(dtype="datetime64[us]")
+        .astype(np.int64)
+    )
+    # Round to the nearest second (half to even, as `round`):
+    return np.rint(microseconds / 1e6).astype(np.int64)
+
+
+def web_mercator(longitude, latitude):
+    """
+    Project GPS coordinates (degrees) to "Web Mercator" coordinates, normalised
+    between 0 and 1 (as `tilemapbase.project`, for whole arrays at once).
+    """
+    longitude = np.asarray(longitude, dtype=np.float64)
+    latitude_rad = np.radians(np.asarray(latitude, dtype=np.float64))
+    x = (longitude + 180.0) / 360.0
+    y = (1.0 - np.arcsinh(np.tan(latitude_rad)) / np.pi) / 2.0
+    return x, y
+
+
+def join_air_gps(
+    *, df_air: pd.DataFrame, df_gps: pd.DataFrame, time_diff_thr: float = 10.0
+):
+    """
+    Join air pollution & GPS data on the nearest timestamp.
+
+    `df_air` needs a `timestamp_air` column, `df_gps` a `timestamp_gps` column.
+    Datapoints where the timestamps of the particulate concentration and the
+    GPS measurement differ by `time_diff_thr` seconds or more are removed.
+    Returns the joined data, and the number of removed datapoints.
+    """
+    # Data must be sorted before merge.
+    df_air = df_air.sort_values("timestamp_air")
+    df_gps = df_gps.sort_values("timestamp_gps")
+
+    df = pd.merge_asof(
+        df_gps,
+        df_air,
+        left_on="timestamp_gps",
+        right_on="timestamp_air",
+        direction="nearest",
+    )
+
+    # Remove datapoints where the timestamps of the particulate concentration
+    # and the GPS measurements are above some threshold (or where there is no
+    # air pollution datapoint at all).
+    time_diff = np.absolute(
+        df["timestamp_gps"].to_numpy(dtype=np.float64)
+        - df["timestamp_air"].to_numpy(dtype=np.float64)
+    )
+    time_diff_bool = np.less(time_diff, time_diff_thr)
+
+    df = df.loc[time_diff_bool]
+
+    n_excluded = int(len(time_diff_bool) - np.sum(time_diff_bool))
+
+    return df, n_excluded
+
+
+def process_session(
+    *,
+    df_air: pd.DataFrame,
+    df_gps: pd.DataFrame,
+    pollutant: str = "pm25",
+    time_diff_thr: float = 10.0,
+):
+    """
+    Process a mobile measurement: parse the GPS timestamps, join air pollution
+    & GPS data, remove datapoints without matching air pollution data, and
+    project the coordinates for plotting on a map.
+
+    `df_air` is the air pollution data (as returned by `read_csv_data`), and
+    `df_gps` the GPS data as read from the GPS Logger file (columns `date time`,
+    `latitude`, `longitude`). Returns the joined data (with `timestamp_gps`,
+    `latitude`, `longitude`, `timestamp_air`, the pollutant, and the Web
+    Mercator coordinates `x` & `y`), and the number of removed datapoints.
+    """
+    df_air = df_air[["timestamp", pollutant]].rename(
+        columns={"timestamp": "timestamp_air"}
+    )
+
+    df_gps = pd.DataFrame(
+        {
+            "timestamp_gps": parse_gps_timestamps(df_gps["date time"].to_numpy()),
+            "latitude": df_gps["latitude"].to_numpy(dtype=np.float64),
+            "longitude": df_gps["longitude"].to_numpy(dtype=np.float64),
+        }
+    )
+
+    df, n_excluded = join_air_gps(
+        df_air=df_air, df_gps=df_gps, time_diff_thr=time_diff_thr
+    )
+
+    df = df.reset_index(drop=True)
+    df["x"], df["y"] = web_mercator(
+        df["longitude"].to_numpy(), df["latitude"].to_numpy()
+    )
+
+    return df, n_excluded
+
+
+def plot_session(
+    df: pd.DataFrame,
+    *,
+    pollutant: str,
+    path_plot: str,
+    figure_size=(16, 16),
+    tile_cache=None,
+):
+    """
+    Plot a processed mobile measurement (as returned by `process_session`) on a
+    map from openstreetmap.org, and save the plot as png file. Map tiles are
+    taken from `tile_cache` (default: `TileCache()`, see `tile_cache.py`).
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from matplotlib.cm import ScalarMappable
+
+    from py_air_quality.analysis.tile_cache import TileCache
+
+    if tile_cache is None:
+        tile_cache = TileCache()
+
+    # Get the minimum and maximum latitude and longitude. Add a margin for
+    # visualisation purposes.
+    lat_min = df["latitude"].min()
+    lat_max = df["latitude"].max()
+    long_min = df["longitude"].min()
+    long_max = df["longitude"].max()
+
+    plot_margin = 0.075 * max((long_max - long_min), (lat_max - lat_min))
+
+    long_min = long_min - plot_margin
+    long_max = long_max + plot_margin
+    lat_min = lat_min - plot_margin
+    lat_max = lat_max + plot_margin
+
+    # Get map from open street maps (tiles & the composited map are cached):
+    x_min, y_max = web_mercator(long_min, lat_min)
+    x_max, y_min = web_mercator(long_max, lat_max)
+
+    fig, ax = plt.subplots(figsize=figure_size)
+    ax.xaxis.set_visible(False)
+    ax.yaxis.set_visible(False)
+
+    tile_cache.plot(
+        ax, (float(x_min), float(x_max), float(y_min), float(y_max)), width=600
+    )
+
+    colour_map = sns.color_palette("Reds", as_cmap=True)  # plasma_r OrRd RdPu
+
+    # Minimum and maximum of colour map.
+    # vmin = np.floor(df[pollutant].min())  # Data-dependent colour scale minimum
+    vmin = 0.0  # Colour scale minimum = 0
+    vmax = np.ceil(df[pollutant].max())
+
+    # Plot air pollution on map.
+    ax.scatter(
+        df["x"].to_numpy(),
+        df["y"].to_numpy(),
+        s=150.0,
+        c=df[pollutant].to_numpy(),
+        marker=".",
+        cmap=colour_map,
+        vmin=vmin,
+        vmax=vmax,
+        linewidth=0,
+        zorder=2,
+        edgecolor="none",
+        alpha=1.0,
+    )
+
+    # Colour space for colour bar.
+    norm = plt.Normalize(vmin, vmax)
+    sm = ScalarMappable(norm=norm, cmap=colour_map)
+    sm.set_array([])
+
+    # Create colour bar.
+    cbar = fig.colorbar(sm, ax=ax, shrink=0.5)
+    cbar.ax.set_title(pollutant)
+
+    ax.spines["top"].set_visible(False)
+    ax.spines["bottom"].set_visible(False)
+    ax.spines["left"].set_visible(False)
+    ax.spines["right"].set_visible(False)
+
+    fig.savefig(
+        path_plot,
+        dpi=128,
+        bbox_inches="tight",
+    )
+    plt.close(fig)
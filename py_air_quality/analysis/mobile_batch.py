@@ -0,0 +1,389 @@
+"""
+Process many mobile measurements at once.
+
+Batch mode of `mobile_measurement.py`: finds the GPS Logger files (`*.txt`) and
+air pollution csv files (`*.csv`, measured with py-air-quality) in a directory,
+pairs each GPS file with the air pollution file that covers most of its time
+range (the air pollution data of several sessions may be in one file, as
+written by `measurement_continuous.py`), and processes the sessions in parallel
+(one process per core by default):
+```
+py-air-quality mobile-batch --directory ~/air_pollution_data --output ~/air_pollution_plots
+```
+
+For each session, the plot (`<GPS file name>_<pollutant>.png`) is saved in the
+output directory, and a row with statistics of the session is added to the
+summary index (`index_<pollutant>.csv`). Each session is identified by the hash
+of its GPS file, of the air pollution data during the session, and of the
+processing parameters; sessions that are already in the index (with the same
+hash) are skipped.
+
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from py_air_quality.analysis.mobile import parse_gps_timestamps
+from py_air_quality.internal.content_hash import file_hash, job_key
+
+# Increase when the processing changes, to process all sessions again:
+batch_version = 1
+
+# Columns of the summary index:
+index_columns = (
+    "session",
+    "path_air",
+    "path_gps",
+    "key",
+    "start",
+    "end",
+    "duration_minutes",
+    "distance_km",
+    "n_valid",
+    "n_excluded",
+    "mean",
+    "median",
+    "p90",
+    "max",
+    "plot",
+)
+
+
+def _first_last_rows(path: str):
+    """
+    Header, first and last data row of a csv file (without reading the entire
+    file). Returns None if the file has no data rows.
+    """
+    with open(path, "rb") as file:
+        header = file.readline()
+        first = file.readline()
+        if not first.strip():
+            return None
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        file.seek(max(size - 4096, 0))
+        last = [x for x in file.read().splitlines() if x.strip()][-1]
+    rows = csv.reader([header.decode(), first.decode(), last.decode()])
+    return [[x.strip() for x in row] for row in rows]
+
+
+def time_range(path: str):
+    """
+    First & last epoch timestamp of an air pollution csv file (`timestamp`
+    column) or GPS Logger file (`date time` column). Returns None if the file
+    has neither column, or no data.
+    """
+    try:
+        rows = _first_last_rows(path)
+    except (OSError, UnicodeDecodeError, IndexError):
+        return None
+    if rows is None:
+        return None
+    header, first, last = rows
+    try:
+        if "timestamp" in header:
+            i = header.index("timestamp")
+            return int(first[i]), int(last[i])
+        if "date time" in header:
+            i = header.index("date time")
+            start, end = parse_gps_timestamps([first[i], last[i]])
+            return int(start), int(end)
+    except (ValueError, IndexError):
+        return None
+    return None
+
+
+def discover_sessions(directory: str):
+    """
+    Pairs of GPS Logger file & air pollution file in a directory (see module
+    docstring), as list of dictionaries (`session`, `path_air`, `path_gps`,
+    `start`, `end`), sorted by start time.
+    """
+    ranges_air = {}
+    ranges_gps = {}
+    for file_name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, file_name)
+        if file_name.endswith(".csv"):
+            ranges_air[path] = time_range(path)
+        elif file_name.endswith(".txt"):
+            ranges_gps[path] = time_range(path)
+    ranges_air = {k: v for k, v in ranges_air.items() if v is not None}
+
+    sessions = []
+    for path_gps, range_gps in ranges_gps.items():
+        if range_gps is None:
+            continue
+        start, end = range_gps
+        overlap = {
+            path_air: min(end, range_air[1]) - max(start, range_air[0])
+            for path_air, range_air in ranges_air.items()
+        }
+        if not overlap:
+            continue
+        path_air = max(overlap, key=overlap.get)
+        if overlap[path_air] < 0:
+            continue
+        sessions.append(
+            {
+                "session": os.path.splitext(os.path.basename(path_gps))[0],
+                "path_air": path_air,
+                "path_gps": path_gps,
+                "start": start,
+                "end": end,
+            }
+        )
+    return sorted(sessions, key=lambda x: x["start"])
+
+
+def distance_km(latitude, longitude) -> float:
+    """Length of a track (haversine distance between consecutive fixes)."""
+    latitude = np.radians(np.asarray(latitude, dtype=np.float64))
+    longitude = np.radians(np.asarray(longitude, dtype=np.float64))
+    a = (
+        np.sin(np.diff(latitude) / 2.0) ** 2
+        + np.cos(latitude[:-1])
+        * np.cos(latitude[1:])
+        * np.sin(np.diff(longitude) / 2.0) ** 2
+    )
+    return float(np.sum(2.0 * 6371.0 * np.arcsin(np.sqrt(a))))
+
+
+def process(
+    session: dict,
+    df_air: pd.DataFrame,
+    *,
+    pollutant: str,
+    time_diff_thr: float,
+    path_plot: str,
+    offline: bool,
+) -> dict:
+    """
+    Join, plot and summarise one session (runs in a worker process). Returns
+    the row of the summary index (without `key`).
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+    from py_air_quality.analysis.mobile import plot_session, process_session
+    from py_air_quality.analysis.tile_cache import TileCache
+
+    df, n_excluded = process_session(
+        df_air=df_air,
+        df_gps=pd.read_csv(session["path_gps"]),
+        pollutant=pollutant,
+        time_diff_thr=time_diff_thr,
+    )
+    if len(df) == 0:
+        raise ValueError("No GPS fixes with matching air pollution data.")
+    plot_session(
+        df,
+        pollutant=pollutant,
+        path_plot=path_plot,
+        tile_cache=TileCache(offline=offline),
+    )
+
+    values = df[pollutant].to_numpy(dtype=np.float64)
+    values = values[~np.isnan(values)]
+    timestamp = df["timestamp_gps"].to_numpy()
+    row = {
+        "session": session["session"],
+        "path_air": session["path_air"],
+        "path_gps": session["path_gps"],
+        "start": pd.Timestamp(int(timestamp[0]), unit="s", tz="UTC").isoformat(),
+        "end": pd.Timestamp(int(timestamp[-1]), unit="s", tz="UTC").isoformat(),
+        "duration_minutes": round((timestamp[-1] - timestamp[0]) / 60.0, 1),
+        "distance_km": round(
+            distance_km(df["latitude"].to_numpy(), df["longitude"].to_numpy()), 3
+        ),
+        "n_valid": len(df),
+        "n_excluded": n_excluded,
+        "plot": os.path.basename(path_plot),
+    }
+    for column, statistic in (
+        ("mean", np.mean),
+        ("median", np.median),
+        ("p90", lambda x: np.percentile(x, 90)),
+        ("max", np.max),
+    ):
+        row[column] = round(float(statistic(values)), 2) if len(values) else None
+    return row
+
+
+def _session_air(df_air: pd.DataFrame, session: dict, time_diff_thr: float):
+    """Air pollution data that can be joined with the GPS data of a session."""
+    timestamp = df_air["timestamp"].to_numpy()
+    start, end = np.searchsorted(
+        timestamp,
+        [session["start"] - time_diff_thr, session["end"] + time_diff_thr],
+        side="left",
+    )
+    return df_air.iloc[start:end][["timestamp", "pm25", "pm10"]]
+
+
+def read_index(path_index: str) -> pd.DataFrame:
+    """Summary index (empty if it does not exist yet)."""
+    if not os.path.isfile(path_index):
+        return pd.DataFrame(columns=list(index_columns))
+    return pd.read_csv(path_index)
+
+
+def write_index(path_index: str, df_index: pd.DataFrame):
+    """Write the summary index atomically, sorted by start time."""
+    df_index = df_index.sort_values(["start", "session"], ignore_index=True)
+    path_tmp = path_index + ".{}.tmp".format(os.getpid())
+    df_index.to_csv(path_tmp, index=False, columns=list(index_columns))
+    os.replace(path_tmp, path_index)
+
+
+def run(
+    *,
+    directory: str,
+    output_directory: str,
+    pollutant: str = "pm25",
+    time_diff_thr: float = 10.0,
+    workers=None,
+    offline: bool = False,
+    force: bool = False,
+):
+    """
+    Process the sessions in `directory` that are not in the summary index yet.
+    Returns the number of processed, skipped and failed sessions.
+    """
+    from py_air_quality.crud.read_csv_data import read_csv_data
+
+    os.makedirs(output_directory, exist_ok=True)
+    path_index = os.path.join(output_directory, "index_{}.csv".format(pollutant))
+    df_index = read_index(path_index)
+    done = set(zip(df_index["session"], df_index["key"]))
+
+    sessions = discover_sessions(directory)
+    print("Found {} sessions in {}".format(len(sessions), directory))
+
+    # Read each air pollution file once (it may contain several sessions):
+    air_data = {}
+    jobs = []
+    n_skipped = 0
+    for session in sessions:
+        if session["path_air"] not in air_data:
+            df_air = read_csv_data(session["path_air"])
+            air_data[session["path_air"]] = df_air.sort_values(
+                "timestamp", ignore_index=True
+            )
+        df_air = _session_air(air_data[session["path_air"]], session, time_diff_thr)
+        key = job_key(
+            version=batch_version,
+            gps=file_hash(session["path_gps"]),
+            air=pd.util.hash_pandas_object(df_air, index=False).sum().item(),
+            pollutant=pollutant,
+            time_diff_thr=time_diff_thr,
+        )
+        path_plot = os.path.join(
+            output_directory, "{}_{}.png".format(session["session"], pollutant)
+        )
+        if (
+            (not force)
+            and ((session["session"], key) in done)
+            and os.path.isfile(path_plot)
+        ):
+            n_skipped += 1
+            continue
+        jobs.append((session, df_air, key, path_plot))
+
+    rows = []
+    n_failed = 0
+    t_start = time.perf_counter()
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(
+                    process,
+                    session,
+                    df_air,
+                    pollutant=pollutant,
+                    time_diff_thr=time_diff_thr,
+                    path_plot=path_plot,
+                    offline=offline,
+                ): (session, key)
+                for session, df_air, key, path_plot in jobs
+            }
+            for future in as_completed(futures):
+                session, key = futures[future]
+                try:
+                    row = future.result()
+                except Exception as error:
+                    n_failed += 1
+                    print("Failed: {} ({})".format(session["session"], error))
+                    continue
+                row["key"] = key
+                rows.append(row)
+                print(
+                    "Processed: {} ({} datapoints)".format(
+                        session["session"], row["n_valid"]
+                    )
+                )
+
+    if rows:
+        df_new = pd.DataFrame(rows, columns=list(index_columns))
+        df_index = df_index.loc[~df_index["session"].isin(df_new["session"])]
+        df_index = pd.concat(
+            [x for x in (df_index, df_new) if len(x)], ignore_index=True
+        )
+        write_index(path_index, df_index)
+
+    print(
+        "Processed {} sessions in {:.1f} s, skipped {} (unchanged), failed {}".format(
+            len(rows), time.perf_counter() - t_start, n_skipped, n_failed
+        )
+    )
+    return len(rows), n_skipped, n_failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Process all mobile measurements (air pollution & GPS files)"
+        " in a directory."
+    )
+    parser.add_argument(
+        "--directory", required=True, help="Directory with the csv & GPS files."
+    )
+    parser.add_argument(
+        "--output", required=True, help="Directory for the plots & summary index."
+    )
+    parser.add_argument("--pollutant", default="pm25")
+    parser.add_argument("--time-diff-thr", type=float, default=10.0)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: number of cores).",
+    )
+    parser.add_argument(
+        "--offline", action="store_true", help="Only use cached map tiles."
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Process sessions in the index again."
+    )
+    args = parser.parse_args(argv)
+
+    _, _, n_failed = run(
+        directory=args.directory,
+        output_directory=args.output,
+        pollutant=args.pollutant,
+        time_diff_thr=args.time_diff_thr,
+        workers=args.workers,
+        offline=args.offline,
+        force=args.force,
+    )
+    return 1 if n_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,423 @@
+"""
+Spatial aggregation of many mobile measurement tracks.
+
+Instead of plotting every datapoint of a single track (see
+`mobile_measurement.py`), the readings of many tracks (e.g. a season of commute
+recordings) are binned into a square grid on the "Web Mercator" projection. At
+`level` z, the map is divided into 2**z x 2**z cells (as map tiles at zoom
+level z); at level 20, a cell is about 24 m wide in Berlin.
+
+For each cell, the grid stores the number of readings, their sum, and a quantile
+sketch (see `py_air_quality/internal/quantile_sketch.py`), so that mean and
+percentiles (e.g. median & 90th percentile) can be computed without keeping the
+readings. The grid is saved in a directory (`grid.npz`), together with the keys
+of the tracks that have been added. New tracks are merged into the existing
+cells, without reading earlier tracks again, and a track that has already been
+added is skipped.
+
+Plotting only depends on the number of occupied cells, not on the number of
+tracks.
+
+Add a track (air pollution csv file & GPS Logger file) to a grid, and plot it:
+```
+py-air-quality mobile-grid add --grid ~/air_quality_grid --air measurement_mobile.csv --gps 20250309-140001.txt
+py-air-quality mobile-grid render --grid ~/air_quality_grid --output grid_pm25.png
+```
+
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from py_air_quality.internal.quantile_sketch import (
+    SketchMapping,
+    grouped_quantiles,
+    merge_sparse,
+    sparse_counts,
+)
+
+default_level = 20
+
+# Increase when the file format changes (older grids cannot be read):
+grid_version = 1
+
+grid_file_name = "grid.npz"
+
+
+def cell_index(x, y, *, level: int = default_level):
+    """
+    Grid cell of Web Mercator coordinates (normalised between 0 and 1, see
+    `mobile.web_mercator`), as column (`ix`) and row (`iy`) index.
+    """
+    size = 2**level
+    ix = np.clip(np.floor(np.asarray(x) * size), 0, size - 1).astype(np.int64)
+    iy = np.clip(np.floor(np.asarray(y) * size), 0, size - 1).astype(np.int64)
+    return ix, iy
+
+
+def cell_id(ix, iy, *, level: int = default_level):
+    """Single integer identifier of each cell (`ix * 2**level + iy`)."""
+    return np.asarray(ix, dtype=np.int64) * (2**level) + np.asarray(iy, dtype=np.int64)
+
+
+def cell_position(cell, *, level: int = default_level):
+    """Column & row index of cell identifiers (inverse of `cell_id`)."""
+    cell = np.asarray(cell, dtype=np.int64)
+    return cell // (2**level), cell % (2**level)
+
+
+class SpatialGrid:
+    """
+    Grid of readings from many tracks, stored in `directory` (see module
+    docstring). Opens the existing grid, or starts an empty one. Raises a
+    `ValueError` if the existing grid has a different level, pollutant, or
+    sketch mapping.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        *,
+        level: int = default_level,
+        pollutant: str = "pm25",
+        mapping: SketchMapping = None,
+    ):
+        if not (0 < level <= 30):
+            raise ValueError("Grid level needs to be between 1 and 30.")
+        self.directory = directory
+        self.path = os.path.join(directory, grid_file_name)
+        self.level = level
+        self.pollutant = pollutant
+        self.mapping = mapping if mapping is not None else SketchMapping()
+
+        # Cells (sorted identifiers), number of readings & sum of readings:
+        self.cell = np.zeros(0, dtype=np.int64)
+        self.count = np.zeros(0, dtype=np.int64)
+        self.total = np.zeros(0, dtype=np.float64)
+        # Quantile sketches of all cells (sparse, see `merge_sparse`):
+        self.sketch = (
+            np.zeros(0, dtype=np.int64),
+            np.zeros(0, dtype=np.int32),
+            np.zeros(0, dtype=np.int64),
+        )
+        # Tracks that have been added, by key:
+        self.tracks = {}
+
+        if os.path.isfile(self.path):
+            self._load()
+
+    def _meta(self) -> dict:
+        return {
+            "version": grid_version,
+            "level": self.level,
+            "pollutant": self.pollutant,
+            "mapping": self.mapping.key(),
+        }
+
+    def _load(self):
+        with np.load(self.path, allow_pickle=False) as npz:
+            meta = json.loads(str(npz["meta"]))
+            if meta != self._meta():
+                raise ValueError(
+                    "Grid in {} has different parameters: {}".format(
+                        self.directory, meta
+                    )
+                )
+            self.cell = npz["cell"]
+            self.count = npz["count"]
+            self.total = npz["total"]
+            self.sketch = (npz["sketch_cell"], npz["sketch_bin"], npz["sketch_count"])
+            self.tracks = json.loads(str(npz["tracks"]))
+
+    def save(self):
+        """Save the grid (atomically, readers never see a partial file)."""
+        os.makedirs(self.directory, exist_ok=True)
+        path_tmp = self.path + ".{}.tmp".format(os.getpid())
+        with open(path_tmp, "wb") as file:
+            np.savez(
+                file,
+                meta=np.array(json.dumps(self._meta(), sort_keys=True)),
+                cell=self.cell,
+                count=self.count,
+                total=self.total,
+                sketch_cell=self.sketch[0],
+                sketch_bin=self.sketch[1],
+                sketch_count=self.sketch[2],
+                tracks=np.array(json.dumps(self.tracks, sort_keys=True)),
+            )
+        os.replace(path_tmp, self.path)
+
+    def add_track(self, x, y, values, *, key: str, name=None) -> bool:
+        """
+        Add the readings of a track (Web Mercator coordinates `x` & `y`, and
+        pollutant concentration; missing values are ignored). `key` identifies
+        the track (e.g. hash of the source files); returns False (and leaves
+        the grid unchanged) if a track with this key has already been added.
+        Call `save` to write the grid to disk.
+        """
+        if key in self.tracks:
+            return False
+
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        ix, iy = cell_index(
+            np.asarray(x)[valid], np.asarray(y)[valid], level=self.level
+        )
+        cell = cell_id(ix, iy, level=self.level)
+        values = values[valid]
+
+        # Aggregate the track, then merge with the existing cells:
+        cell_track, inverse = np.unique(cell, return_inverse=True)
+        count_track = np.bincount(inverse, minlength=len(cell_track))
+        total_track = np.bincount(inverse, weights=values, minlength=len(cell_track))
+        cell_all = np.concatenate((self.cell, cell_track))
+        cell_new, inverse = np.unique(cell_all, return_inverse=True)
+        self.count = np.bincount(
+            inverse,
+            weights=np.concatenate((self.count, count_track)),
+            minlength=len(cell_new),
+        ).astype(np.int64)
+        self.total = np.bincount(
+            inverse,
+            weights=np.concatenate((self.total, total_track)),
+            minlength=len(cell_new),
+        )
+        self.cell = cell_new
+        self.sketch = merge_sparse(
+            self.sketch, sparse_counts(cell, values, self.mapping)
+        )
+
+        self.tracks[key] = {
+            "name": name,
+            "readings": int(len(values)),
+            "added": int(time.time()),
+        }
+        return True
+
+    def cells(self, *, q=(0.1, 0.5, 0.9), level=None) -> pd.DataFrame:
+        """
+        Statistics of each occupied cell: column & row index (`ix`, `iy`),
+        Web Mercator coordinates of the cell corner (`x0`, `y0`), `count`,
+        `mean`, and the quantiles `q` (columns e.g. `p10`, `p50`, `p90`).
+        Cells can be combined to a coarser `level` (less than the level of the
+        grid), e.g. for an overview of a large area.
+        """
+        cell = self.cell
+        count = self.count
+        total = self.total
+        sketch = self.sketch
+        if (level is not None) and (level != self.level):
+            if self.level < level:
+                raise ValueError("Level needs to be at most {}.".format(self.level))
+            shift = self.level - level
+            ix, iy = cell_position(cell, level=self.level)
+            cell, inverse = np.unique(
+                cell_id(ix >> shift, iy >> shift, level=level), return_inverse=True
+            )
+            count = np.bincount(inverse, weights=count).astype(np.int64)
+            total = np.bincount(inverse, weights=total)
+            ix, iy = cell_position(sketch[0], level=self.level)
+            sketch = merge_sparse(
+                (cell_id(ix >> shift, iy >> shift, level=level), sketch[1], sketch[2])
+            )
+        else:
+            level = self.level
+
+        ix, iy = cell_position(cell, level=level)
+        size = 2**level
+        df = pd.DataFrame(
+            {
+                "ix": ix,
+                "iy": iy,
+                "x0": ix / size,
+                "y0": iy / size,
+                "count": count,
+                "mean": total / np.maximum(count, 1),
+            }
+        )
+        for quantile in q:
+            _, df["p{:g}".format(100 * quantile)] = grouped_quantiles(
+                *sketch, quantile, self.mapping
+            )
+        df.attrs["level"] = level
+        return df
+
+
+def plot_cells(
+    ax,
+    df_cells: pd.DataFrame,
+    *,
+    statistic: str = "mean",
+    min_count: int = 1,
+    cmap="Reds",
+    vmin=0.0,
+    vmax=None,
+):
+    """
+    Plot a statistic of the cells (as returned by `SpatialGrid.cells`) as image
+    on a matplotlib axes, in Web Mercator coordinates (as `tile_cache`). Cells
+    with less than `min_count` readings are not shown. Returns the image.
+    """
+    df_cells = df_cells.loc[min_count <= df_cells["count"]]
+    if len(df_cells) == 0:
+        raise ValueError("No cells with at least {} readings.".format(min_count))
+    size = 2 ** df_cells.attrs["level"]
+
+    # Image of the bounding box of the occupied cells (empty cells are NaN):
+    ix = df_cells["ix"].to_numpy()
+    iy = df_cells["iy"].to_numpy()
+    ix_min, iy_min = ix.min(), iy.min()
+    image = np.full((iy.max() - iy_min + 1, ix.max() - ix_min + 1), np.nan)
+    image[iy - iy_min, ix - ix_min] = df_cells[statistic].to_numpy()
+
+    if vmax is None:
+        vmax = np.ceil(np.nanmax(image))
+    return ax.imshow(
+        image,
+        extent=(
+            ix_min / size,
+            (ix.max() + 1) / size,
+            (iy.max() + 1) / size,
+            iy_min / size,
+        ),
+        origin="upper",
+        cmap=cmap,
+        vmin=vmin,
+        vmax=vmax,
+        interpolation="nearest",
+        zorder=2,
+    )
+
+
+# ------------------------------------------------------------------------------
+# *** Command line
+
+
+def _add(args):
+    from py_air_quality.analysis.mobile import process_session
+    from py_air_quality.crud.read_csv_data import read_csv_data
+    from py_air_quality.internal.content_hash import file_hash, job_key
+
+    grid = SpatialGrid(args.grid, level=args.level, pollutant=args.pollutant)
+    key = job_key(
+        air=file_hash(args.air),
+        gps=file_hash(args.gps),
+        time_diff_thr=args.time_diff_thr,
+    )
+    if key in grid.tracks:
+        print("Track already in grid: {}".format(args.gps))
+        return 0
+
+    df, n_excluded = process_session(
+        df_air=read_csv_data(args.air),
+        df_gps=pd.read_csv(args.gps),
+        pollutant=args.pollutant,
+        time_diff_thr=args.time_diff_thr,
+    )
+    grid.add_track(
+        df["x"].to_numpy(),
+        df["y"].to_numpy(),
+        df[args.pollutant].to_numpy(),
+        key=key,
+        name=os.path.basename(args.gps),
+    )
+    grid.save()
+    print(
+        "Added {} datapoints ({} excluded), grid: {} tracks, {} cells".format(
+            len(df), n_excluded, len(grid.tracks), len(grid.cell)
+        )
+    )
+    return 0
+
+
+def _render(args):
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    from py_air_quality.analysis.tile_cache import TileCache
+
+    grid = SpatialGrid(args.grid, level=args.grid_level, pollutant=args.pollutant)
+    df_cells = grid.cells(level=args.level)
+
+    fig, ax = plt.subplots(figsize=(16, 16))
+    ax.xaxis.set_visible(False)
+    ax.yaxis.set_visible(False)
+    image = plot_cells(ax, df_cells, statistic=args.statistic, min_count=args.min_count)
+
+    # Map from openstreetmap.org in the background (see `tile_cache`):
+    x_min, x_max, y_max, y_min = image.get_extent()
+    margin = 0.075 * max(x_max - x_min, y_max - y_min)
+    TileCache(offline=args.offline).plot(
+        ax,
+        (x_min - margin, x_max + margin, y_min - margin, y_max + margin),
+        width=600,
+    )
+
+    cbar = fig.colorbar(image, ax=ax, shrink=0.5)
+    cbar.ax.set_title("{} {}".format(args.pollutant, args.statistic))
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    fig.savefig(args.output, dpi=128, bbox_inches="tight")
+    plt.close(fig)
+    print(
+        "Plotted {} cells from {} tracks: {}".format(
+            len(df_cells), len(grid.tracks), args.output
+        )
+    )
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Aggregate mobile measurements of many tracks on a grid."
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    parser_add = subparsers.add_parser("add", help="Add a track to the grid.")
+    parser_add.add_argument("--grid", required=True, help="Grid directory.")
+    parser_add.add_argument(
+        "--air", required=True, help="Air pollution csv file (py-air-quality)."
+    )
+    parser_add.add_argument("--gps", required=True, help="GPS Logger file.")
+    parser_add.add_argument("--pollutant", default="pm25")
+    parser_add.add_argument("--level", type=int, default=default_level)
+    parser_add.add_argument("--time-diff-thr", type=float, default=10.0)
+    parser_add.set_defaults(function=_add)
+
+    parser_render = subparsers.add_parser("render", help="Plot the grid.")
+    parser_render.add_argument("--grid", required=True, help="Grid directory.")
+    parser_render.add_argument("--output", required=True, help="Output png file.")
+    parser_render.add_argument("--pollutant", default="pm25")
+    parser_render.add_argument(
+        "--grid-level",
+        type=int,
+        default=default_level,
+        help="Level of the grid (as when adding tracks).",
+    )
+    parser_render.add_argument(
+        "--level", type=int, default=None, help="Plot at a coarser level."
+    )
+    parser_render.add_argument(
+        "--statistic", default="mean", help="E.g. mean, count, p50 or p90."
+    )
+    parser_render.add_argument("--min-count", type=int, default=1)
+    parser_render.add_argument(
+        "--offline", action="store_true", help="Only use cached map tiles."
+    )
+    parser_render.set_defaults(function=_render)
+
+    args = parser.parse_args(argv)
+    return args.function(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,291 @@
+"""
+Map tiles for the mobile measurement plots, cached on disk.
+
+Tiles are requested from a tile source (e.g. openstreetmap.org, or a directory
+of pre-downloaded tiles), and stored in a least-recently-used cache that is
+bounded in size (see `py_air_quality.internal.artifact_cache`). The basemap of a
+plot (the tiles covering the plotted area, composited into one image) is cached
+as well, by source, zoom level and tile range, so that plotting the same area
+again only needs to read one array.
+
+A tile source is any object with a `name` (used for the cache keys), a
+`tile_size` (pixels), a `max_zoom`, and a method `fetch(zoom, x, y)` that
+returns the PNG image of a tile, or raises `TileUnavailable`:
+- `HttpTileSource`: tile server (e.g. `osm_tiles`)
+- `DirectoryTileSource`: tiles on disk (e.g. `<directory>/<zoom>/<x>/<y>.png`)
+
+In offline mode (or after the first failed connection), tiles are only taken
+from the cache; missing tiles are left blank, and basemaps with missing tiles
+are not cached.
+
+Coordinates are "Web Mercator" coordinates normalised between 0 and 1 (see
+`mobile.web_mercator`); at zoom level z, the map consists of 2**z x 2**z tiles.
+
+"""
+
+import io
+import logging
+import math
+import os
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+from py_air_quality.internal.artifact_cache import ArtifactCache
+from py_air_quality.internal.content_hash import job_key
+
+logger = logging.getLogger(__name__)
+
+# Default cache directory (can be changed with `PY_AIR_QUALITY_TILE_CACHE`):
+cache_directory_default = os.environ.get(
+    "PY_AIR_QUALITY_TILE_CACHE",
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+        "py_air_quality",
+        "tiles",
+    ),
+)
+
+# Colour of missing tiles (RGB):
+missing_colour = (224, 224, 224)
+
+
+class TileUnavailable(Exception):
+    """The tile source cannot provide a tile."""
+
+
+class HttpTileSource:
+    """
+    Tiles from a tile server; `url` contains `{zoom}`, `{x}` and `{y}`. Raises
+    `ConnectionError` if the server cannot be reached.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        *,
+        tile_size: int = 256,
+        max_zoom: int = 19,
+        user_agent: str = "py-air-quality",
+        timeout: float = 10.0,
+    ):
+        self.name = name
+        self.url = url
+        self.tile_size = tile_size
+        self.max_zoom = max_zoom
+        self.user_agent = user_agent
+        self.timeout = timeout
+
+    def fetch(self, zoom: int, x: int, y: int) -> bytes:
+        request = urllib.request.Request(
+            self.url.format(zoom=zoom, x=x, y=y),
+            headers={"User-Agent": self.user_agent},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as error:
+            raise TileUnavailable(str(error))
+        except (urllib.error.URLError, OSError) as error:
+            raise ConnectionError(str(error))
+
+
+class DirectoryTileSource:
+    """
+    Tiles stored on disk, e.g. downloaded in advance for offline use. `pattern`
+    is the path of a tile relative to `directory`.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        *,
+        name=None,
+        pattern: str = "{zoom}/{x}/{y}.png",
+        tile_size: int = 256,
+        max_zoom: int = 19,
+    ):
+        self.directory = directory
+        self.name = name if name is not None else os.path.abspath(directory)
+        self.pattern = pattern
+        self.tile_size = tile_size
+        self.max_zoom = max_zoom
+
+    def fetch(self, zoom: int, x: int, y: int) -> bytes:
+        path = os.path.join(self.directory, self.pattern.format(zoom=zoom, x=x, y=y))
+        try:
+            with open(path, "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            raise TileUnavailable(path)
+
+
+# Standard tiles from openstreetmap.org (see
+# https://operations.osmfoundation.org/policies/tiles/):
+osm_tiles = HttpTileSource("osm", "https://tile.openstreetmap.org/{zoom}/{x}/{y}.png")
+
+
+def decode_tile(content: bytes, tile_size: int) -> np.ndarray:
+    """RGB image (uint8) of a PNG tile."""
+    import matplotlib.image
+
+    image = matplotlib.image.imread(io.BytesIO(content), format="png")
+    if image.ndim == 2:
+        image = np.stack((image,) * 3, axis=-1)
+    image = image[..., :3]
+    if image.dtype != np.uint8:
+        image = np.round(image * 255.0).astype(np.uint8)
+    if image.shape[:2] != (tile_size, tile_size):
+        raise ValueError("Unexpected tile size: {}".format(image.shape))
+    return image
+
+
+class TileCache:
+    """
+    Tiles & basemaps from a tile source, cached on disk (see module
+    docstring). Sizes are in bytes; tiles and basemaps are evicted separately.
+    """
+
+    def __init__(
+        self,
+        *,
+        source=osm_tiles,
+        cache_directory=None,
+        max_tile_bytes: int = 256 * 1024**2,
+        max_basemap_bytes: int = 256 * 1024**2,
+        offline: bool = False,
+    ):
+        if cache_directory is None:
+            cache_directory = cache_directory_default
+        self.source = source
+        self.offline = offline
+        self.tiles = ArtifactCache(
+            os.path.join(cache_directory, "tiles"),
+            max_memory_bytes=0,
+            max_disk_bytes=max_tile_bytes,
+        )
+        self.basemaps = ArtifactCache(
+            os.path.join(cache_directory, "basemaps"),
+            max_memory_bytes=0,
+            max_disk_bytes=max_basemap_bytes,
+            suffix=".npy",
+        )
+
+    def tile(self, zoom: int, x: int, y: int):
+        """PNG image of a tile, None if it is not available."""
+        key = job_key(source=self.source.name, zoom=zoom, x=x, y=y)
+        content = self.tiles.get(key)
+        if (content is not None) or self.offline:
+            return content
+        try:
+            content = self.source.fetch(zoom, x, y)
+        except TileUnavailable as error:
+            logger.warning("Tile not available: %s", error)
+            return None
+        except ConnectionError as error:
+            logger.warning("Tile source not reachable, continuing offline: %s", error)
+            self.offline = True
+            return None
+        self._add(self.tiles, key, content)
+        return content
+
+    def _add(self, cache: ArtifactCache, key: str, content: bytes):
+        """
+        Add content to one of the caches. Several processes can share a cache
+        directory (e.g. `mobile_batch.py`); if another process writes or
+        removes the same entry at the same time, the content is not cached.
+        """
+        try:
+            with open(cache.path_tmp(key), "wb") as file:
+                file.write(content)
+            cache.add(key)
+        except FileNotFoundError:
+            pass
+
+    def zoom(self, extent, width: int) -> int:
+        """Lowest zoom level at which `extent` is at least `width` pixels wide."""
+        x_min, x_max, _, _ = extent
+        span = max(x_max - x_min, 1e-12)
+        zoom = math.ceil(math.log2(width / (self.source.tile_size * span)))
+        return int(min(max(zoom, 0), self.source.max_zoom))
+
+    def tile_range(self, extent, zoom: int):
+        """Tiles covering `extent` (first & last column, first & last row)."""
+        x_min, x_max, y_min, y_max = extent
+        n = 2**zoom
+        x0 = min(max(int(math.floor(x_min * n)), 0), n - 1)
+        x1 = min(max(int(math.floor(x_max * n)), 0), n - 1)
+        y0 = min(max(int(math.floor(y_min * n)), 0), n - 1)
+        y1 = min(max(int(math.floor(y_max * n)), 0), n - 1)
+        return x0, x1, y0, y1
+
+    def basemap(self, extent, *, zoom=None, width: int = 600):
+        """
+        Image (RGB, uint8) of the tiles covering `extent` (`x_min, x_max,
+        y_min, y_max`), and the extent of the image (for `imshow`, as
+        `left, right, bottom, top`). The zoom level is chosen so that `extent`
+        is at least `width` pixels wide, unless given.
+        """
+        if zoom is None:
+            zoom = self.zoom(extent, width)
+        x0, x1, y0, y1 = self.tile_range(extent, zoom)
+        n = 2**zoom
+        image_extent = (x0 / n, (x1 + 1) / n, (y1 + 1) / n, y0 / n)
+
+        key = job_key(source=self.source.name, zoom=zoom, tiles=[x0, x1, y0, y1])
+        content = self.basemaps.get(key)
+        if content is not None:
+            return np.load(io.BytesIO(content), allow_pickle=False), image_extent
+
+        size = self.source.tile_size
+        image = np.empty(((y1 - y0 + 1) * size, (x1 - x0 + 1) * size, 3), np.uint8)
+        image[...] = missing_colour
+        complete = True
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                tile = self.tile(zoom, x, y)
+                if tile is None:
+                    complete = False
+                    continue
+                row = (y - y0) * size
+                column = (x - x0) * size
+                image[row : row + size, column : column + size] = decode_tile(
+                    tile, size
+                )
+
+        # Basemaps with missing tiles are composited again next time (the
+        # tiles may be available then):
+        if complete:
+            content = io.BytesIO()
+            np.save(content, image, allow_pickle=False)
+            self._add(self.basemaps, key, content.getvalue())
+        return image, image_extent
+
+    def prefetch(self, extent, *, zooms) -> int:
+        """
+        Download the tiles covering `extent` at the given zoom levels into the
+        cache (e.g. before going offline). Returns the number of tiles that are
+        available.
+        """
+        available = 0
+        for zoom in zooms:
+            x0, x1, y0, y1 = self.tile_range(extent, zoom)
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    available += self.tile(zoom, x, y) is not None
+        return available
+
+    def plot(self, ax, extent, *, zoom=None, width: int = 600):
+        """
+        Plot the basemap of `extent` on a matplotlib axes (Web Mercator
+        coordinates, y axis pointing down as on the map), and limit the axes to
+        `extent`.
+        """
+        image, image_extent = self.basemap(extent, zoom=zoom, width=width)
+        ax.imshow(image, extent=image_extent, origin="upper", zorder=1)
+        x_min, x_max, y_min, y_max = extent
+        ax.set_xlim(x_min, x_max)
+        ax.set_ylim(y_max, y_min)
+        return image
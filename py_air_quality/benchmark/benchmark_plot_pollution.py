@@ -0,0 +1,68 @@
+"""
+Benchmark rendering of the daytime profile plots.
+
+Synthetic measurement data (one sample every 5 minutes, like the cron job) is
+plotted with `py_air_quality.server.plot.plot_pollution`, and the render time
+is printed for 30 and 365 days of data, with new figures per call and with
+reused figure templates (`reuse_figures=True`).
+
+Usage:
+python py_air_quality/benchmark/benchmark_plot_pollution.py
+
+See `benchmark_suite.py` for the other stages of the data path.
+
+"""
+
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from py_air_quality.benchmark import synthetic_data
+from py_air_quality.server.plot import plot_pollution
+
+# ------------------------------------------------------------------------------
+# *** Parameters
+
+# Number of days of data to benchmark:
+list_days = [30, 365]
+
+# Interval between synthetic measurements, in seconds:
+sampling_interval = 300
+
+# Number of repetitions per benchmark (the fastest run is reported):
+repetitions = 3
+
+
+def benchmark_plot_pollution(*, days: int, path_plot: str, reuse_figures: bool):
+    """Return the fastest render time (in seconds) for `days` of data."""
+    utc_now = datetime.now(timezone.utc)
+    df = synthetic_data.measurement_dataframe(
+        days=days,
+        interval_seconds=sampling_interval,
+        end_epoch=int(utc_now.timestamp()),
+    )
+    durations = []
+    for _ in range(repetitions):
+        t1 = time.perf_counter()
+        plot_pollution(
+            df=df.copy(),
+            utc_now=utc_now,
+            local_now_hour=12.0,
+            path_plot=path_plot,
+            reuse_figures=reuse_figures,
+        )
+        durations.append(time.perf_counter() - t1)
+    return min(durations)
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path_plot = os.path.join(tmp_dir, "benchmark_{}.png")
+        for days in list_days:
+            for reuse_figures in [False, True]:
+                duration = benchmark_plot_pollution(
+                    days=days, path_plot=path_plot, reuse_figures=reuse_figures
+                )
+                msg = "{:>4} days, reuse figures: {!s:>5}: {:.3f} s"
+                print(msg.format(days, reuse_figures, duration))
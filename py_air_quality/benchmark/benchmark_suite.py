@@ -0,0 +1,327 @@
+"""
+Benchmark suite for the data path.
+
+Times the main processing stages on synthetic data (see `synthetic_data.py`):
+- `read_csv_data`: parse a measurement csv file (as in `commit_to_db.py`)
+- `transform`: database documents to dataframe with time columns (as in
+  `query_measurements` in `plot_pollution_from_db.py`), for several sensors
+- `plot_pollution`: render all daytime profile plots
+- `filter_effect`: hourly means & merge with external data (as in
+  `analysis_filter_effect_berlinluftdaten.py`)
+- `mobile_join`: parse GPS timestamps & join with air quality data (as in
+  `mobile_measurement.py`)
+- `mobile_session`: whole mobile pipeline (parse, join, filter & project GPS
+  coordinates, `process_session` in `mobile.py`)
+
+Results are written as json. If a baseline (the json output of an earlier run)
+is given, the run fails (exit code 1) when a case is slower than the baseline by
+more than the threshold factor.
+
+Usage:
+```
+python py_air_quality/benchmark/benchmark_suite.py --output results.json
+python py_air_quality/benchmark/benchmark_suite.py --baseline results.json
+python py_air_quality/benchmark/benchmark_suite.py --scale full --cases csv
+```
+
+The `quick` scale takes a few minutes; the `full` scale (up to five years of
+data at 5 s sampling) needs several GB of memory and can take a long time.
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from dateutil import tz
+
+from py_air_quality.analysis.filter_effect import internal_hourly, merge_external
+from py_air_quality.analysis.mobile import (
+    join_air_gps,
+    parse_gps_timestamps,
+    process_session,
+)
+from py_air_quality.benchmark import synthetic_data
+from py_air_quality.crud.read_csv_data import add_time_columns, read_csv_data
+from py_air_quality.server.plot import plot_pollution
+
+# ------------------------------------------------------------------------------
+# *** Parameters
+
+# Cases per scale: (stage, days of data, sampling interval in seconds, number of
+# sensors). For the mobile stages, the duration is given in hours.
+scales = {
+    "quick": [
+        ("read_csv_data", 7, 5, 1),
+        ("read_csv_data", 7, 1, 1),
+        ("transform", 30, 300, 10),
+        ("transform", 30, 5, 1),
+        ("plot_pollution", 30, 300, 1),
+        ("plot_pollution", 365, 300, 1),
+        ("filter_effect", 7, 5, 1),
+        ("mobile_join", 2, 1, 1),
+        ("mobile_session", 2, 1, 1),
+    ],
+    "full": [
+        ("read_csv_data", 7, 5, 1),
+        ("read_csv_data", 7, 1, 1),
+        ("read_csv_data", 365, 5, 1),
+        ("read_csv_data", 1826, 5, 1),
+        ("transform", 30, 300, 10),
+        ("transform", 30, 5, 1),
+        ("transform", 30, 5, 10),
+        ("transform", 365, 5, 1),
+        ("plot_pollution", 30, 300, 1),
+        ("plot_pollution", 365, 300, 1),
+        ("plot_pollution", 365, 5, 1),
+        ("plot_pollution", 1826, 300, 1),
+        ("filter_effect", 7, 5, 1),
+        ("filter_effect", 90, 5, 1),
+        ("filter_effect", 365, 5, 1),
+        ("mobile_join", 2, 1, 1),
+        ("mobile_join", 24, 1, 1),
+        ("mobile_session", 2, 1, 1),
+        ("mobile_session", 8, 1, 1),
+        ("mobile_session", 24, 1, 1),
+    ],
+}
+
+# A case fails the regression check if it is slower than the baseline by more
+# than this factor:
+default_threshold = 1.25
+
+# Cases faster than this (in seconds) are not checked for regressions (too
+# noisy):
+min_checked_seconds = 0.01
+
+default_repeats = 3
+
+local_time_zone_name = synthetic_data.local_time_zone_name
+
+pollutant = "pm25"
+
+
+# ------------------------------------------------------------------------------
+# *** Benchmark cases
+
+
+def case_name(stage, days, interval_seconds, n_sensors):
+    unit = "h" if stage.startswith("mobile") else "d"
+    name = "{}/{}{}@{}s".format(stage, days, unit, interval_seconds)
+    if 1 < n_sensors:
+        name += "x{}".format(n_sensors)
+    return name
+
+
+def setup_case(stage, days, interval_seconds, n_sensors, end_epoch, tmp_dir):
+    """
+    Create the input data of a case. Returns a function that runs the stage
+    once, and the number of rows processed per run.
+    """
+    if stage == "read_csv_data":
+        path_csv = os.path.join(tmp_dir, "measurement.csv")
+        n_rows = synthetic_data.write_measurement_csv(
+            path_csv, days=days, interval_seconds=interval_seconds, end_epoch=end_epoch
+        )
+        return (lambda: read_csv_data(path_csv)), n_rows
+
+    if stage == "transform":
+        documents = synthetic_data.mongo_documents(
+            days=days,
+            interval_seconds=interval_seconds,
+            end_epoch=end_epoch,
+            n_sensors=n_sensors,
+        )
+        data = [synthetic_data.projected_documents(x) for x in documents.values()]
+        local_time_zone = tz.gettz(local_time_zone_name)
+
+        def run():
+            for data_sensor in data:
+                df = pd.DataFrame(data_sensor, columns=["timestamp", "pm25", "pm10"])
+                add_time_columns(df, local_time_zone=local_time_zone)
+
+        return run, sum(len(x) for x in data)
+
+    if stage == "plot_pollution":
+        df = synthetic_data.measurement_dataframe(
+            days=days, interval_seconds=interval_seconds, end_epoch=end_epoch
+        )
+        path_plot = os.path.join(tmp_dir, "plot_{}.png")
+        utc_now = datetime.fromtimestamp(end_epoch, tz=timezone.utc)
+
+        def run():
+            plot_pollution(
+                df=df, utc_now=utc_now, local_now_hour=12.0, path_plot=path_plot
+            )
+
+        return run, len(df)
+
+    if stage == "filter_effect":
+        # First half of the time without filter, second half with filter:
+        df_internal = synthetic_data.measurement_dataframe(
+            days=days, interval_seconds=interval_seconds, end_epoch=end_epoch
+        )
+        df_internal["filter"] = np.arange(len(df_internal)) >= (len(df_internal) // 2)
+        df_internal = df_internal[["timestamp", "datetime", pollutant, "filter"]]
+        df_internal = df_internal.rename(columns={pollutant: pollutant + "_internal"})
+        df_external = synthetic_data.external_hourly(
+            days=days, end_epoch=end_epoch, pollutant=pollutant
+        )
+
+        def run():
+            df_internal_hourly = internal_hourly(df_internal)
+            merge_external(
+                df_internal=df_internal_hourly,
+                df_external=df_external,
+                pollutant=pollutant,
+            )
+
+        return run, len(df_internal)
+
+    if stage == "mobile_join":
+        # GPS logged every `interval_seconds`, air quality every 5 s:
+        df_gps_raw = synthetic_data.gps_track(
+            hours=days, interval_seconds=interval_seconds, end_epoch=end_epoch
+        )
+        timestamp, pm25, _ = synthetic_data.measurement_arrays(
+            days=(days / 24.0), interval_seconds=5, end_epoch=end_epoch
+        )
+        df_air = pd.DataFrame({"timestamp_air": timestamp, pollutant: pm25})
+
+        def run():
+            df_gps = df_gps_raw.copy()
+            df_gps["timestamp_gps"] = parse_gps_timestamps(
+                df_gps["date time"].to_list()
+            )
+            df_gps = df_gps[["timestamp_gps", "latitude", "longitude"]]
+            join_air_gps(df_air=df_air, df_gps=df_gps)
+
+        return run, len(df_gps_raw)
+
+    if stage == "mobile_session":
+        # Whole mobile pipeline (as in `mobile_measurement.py`): GPS logged
+        # every `interval_seconds`, air quality every 5 s.
+        df_gps = synthetic_data.gps_track(
+            hours=days, interval_seconds=interval_seconds, end_epoch=end_epoch
+        )
+        timestamp, pm25, _ = synthetic_data.measurement_arrays(
+            days=(days / 24.0), interval_seconds=5, end_epoch=end_epoch
+        )
+        df_air = pd.DataFrame({"timestamp": timestamp, pollutant: pm25})
+
+        def run():
+            process_session(df_air=df_air, df_gps=df_gps, pollutant=pollutant)
+
+        return run, len(df_gps)
+
+    raise ValueError("Unknown stage: {}".format(stage))
+
+
+def run_suite(*, scale: str, cases_filter=None, repeats: int = default_repeats):
+    """Run the cases of a scale; returns the results by case name."""
+    end_epoch = int(datetime.now(timezone.utc).timestamp())
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for stage, days, interval_seconds, n_sensors in scales[scale]:
+            name = case_name(stage, days, interval_seconds, n_sensors)
+            if cases_filter and not any(x in name for x in cases_filter):
+                continue
+            run, n_rows = setup_case(
+                stage, days, interval_seconds, n_sensors, end_epoch, tmp_dir
+            )
+            durations = []
+            for _ in range(repeats):
+                t1 = time.perf_counter()
+                run()
+                durations.append(time.perf_counter() - t1)
+            results[name] = {
+                "stage": stage,
+                "rows": n_rows,
+                "seconds": min(durations),
+                "durations": durations,
+                "rows_per_second": n_rows / max(min(durations), 1e-9),
+            }
+            print(
+                "{:<36} {:>10} rows {:>10.4f} s".format(name, n_rows, min(durations)),
+                flush=True,
+            )
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float):
+    """Names of the cases that regressed compared to the baseline."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        seconds_baseline = baseline[name]["seconds"]
+        ratio = result["seconds"] / max(seconds_baseline, 1e-9)
+        result["baseline_seconds"] = seconds_baseline
+        result["ratio"] = ratio
+        if (threshold < ratio) and (min_checked_seconds <= result["seconds"]):
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--scale", choices=sorted(scales), default="quick")
+    parser.add_argument(
+        "--cases", nargs="*", help="Only run cases whose name contains one of these."
+    )
+    parser.add_argument("--repeats", type=int, default=default_repeats)
+    parser.add_argument("--output", help="Path of the json output.")
+    parser.add_argument("--baseline", help="Json output of an earlier run.")
+    parser.add_argument("--threshold", type=float, default=default_threshold)
+    args = parser.parse_args(argv)
+
+    results = run_suite(scale=args.scale, cases_filter=args.cases, repeats=args.repeats)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for name, result in results.items():
+            if "ratio" in result:
+                print(
+                    "{:<36} {:>6.2f}x baseline{}".format(
+                        name,
+                        result["ratio"],
+                        "  REGRESSION" if name in regressions else "",
+                    )
+                )
+
+    output = {
+        "meta": {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "scale": args.scale,
+            "repeats": args.repeats,
+            "threshold": args.threshold,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+        },
+        "results": results,
+        "regressions": regressions,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(output, file, indent=2)
+
+    if regressions:
+        print("Regressions: {}".format(", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""
+Import-time report of the entry points.
+
+Imports each module in a fresh interpreter with `python -X importtime`, and
+reports the import time of the module (without the interpreter's own start-up
+imports), the wall-clock time of the interpreter (start-up until exit), the peak
+memory (max RSS), and the modules with the largest cumulative import time.
+
+The acquisition scripts are started every few minutes (on a Raspberry Pi Zero),
+so they must not import heavy dependencies. The run fails (exit code 1) if one
+of them imports pandas, numpy or pydantic.
+
+Usage:
+```
+python py_air_quality/benchmark/import_time.py
+python py_air_quality/benchmark/import_time.py --output import_time.json
+```
+
+Modules that cannot be imported here (e.g. because of missing credentials) are
+reported as failed, but do not fail the run.
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+# ------------------------------------------------------------------------------
+# *** Parameters
+
+# Modules to import, and the top-level packages they must not import:
+heavy_packages = ("pandas", "numpy", "pydantic")
+cases = [
+    ("py_air_quality.cli", heavy_packages),
+    ("py_air_quality.measurement.measurement", heavy_packages),
+    ("py_air_quality.measurement.measurement_continuous", heavy_packages),
+    ("py_air_quality.crud.read_csv_data", ()),
+    ("py_air_quality.server.plot_pollution_from_db", ()),
+    ("py_air_quality.server.server", ()),
+]
+
+# Number of modules with the largest cumulative import time to report:
+n_top = 10
+
+default_repeats = 3
+
+
+# ------------------------------------------------------------------------------
+# *** Import time
+
+
+def parse_importtime(text: str):
+    """
+    Parse the output of `-X importtime`. Returns a list of (module, self time,
+    cumulative time, nesting level), times in seconds.
+    """
+    entries = []
+    for line in text.splitlines():
+        if not line.startswith("import time:") or ("|" not in line):
+            continue
+        fields = line[len("import time:") :].split("|")
+        try:
+            self_us = int(fields[0])
+            cumulative_us = int(fields[1])
+        except ValueError:
+            # Header line.
+            continue
+        name = fields[2].rstrip()
+        level = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), self_us / 1e6, cumulative_us / 1e6, level))
+    return entries
+
+
+def measure_import(module: str):
+    """
+    Import a module in a fresh interpreter. Returns the `-X importtime` entries,
+    the wall-clock time, the max RSS (in MiB), and the error output (if the
+    import failed).
+    """
+    with tempfile.TemporaryFile(mode="w+") as stderr:
+        t1 = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-X", "importtime", "-c", "import " + module],
+            stdout=subprocess.DEVNULL,
+            stderr=stderr,
+        )
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - t1
+        process.returncode = os.waitstatus_to_exitcode(status)
+        stderr.seek(0)
+        text = stderr.read()
+
+    # `ru_maxrss` is in KiB on Linux:
+    max_rss = rusage.ru_maxrss / 1024.0
+    entries = parse_importtime(text)
+    error = None
+    if process.returncode != 0:
+        error = [x for x in text.splitlines() if not x.startswith("import time:")]
+        error = error[-1] if error else "exit code {}".format(process.returncode)
+    return entries, wall_time, max_rss, error
+
+
+def module_entries(entries, module: str):
+    """
+    The entries of the import of `module` (without the imports during
+    interpreter start-up, e.g. `site`). Children are listed before their parent,
+    so the import of `module` starts after the last top-level entry that is not
+    one of its packages.
+    """
+    parts = module.split(".")
+    packages = {".".join(parts[: idx + 1]) for idx in range(len(parts))}
+    start = 0
+    for idx, (name, _, _, level) in enumerate(entries):
+        if (level == 0) and (name not in packages):
+            start = idx + 1
+    return entries[start:]
+
+
+def run_case(module: str, forbidden, repeats: int):
+    """Import a module `repeats` times; keep the fastest run."""
+    runs = [measure_import(module) for _ in range(repeats)]
+    entries, wall_time, max_rss, error = min(runs, key=lambda x: x[1])
+    entries_module = module_entries(entries, module)
+    top_level = {name.split(".")[0] for name, _, _, _ in entries_module}
+    heavy = sorted(x for x in forbidden if x in top_level)
+    # Modules imported directly by the module & its packages, by cumulative
+    # time:
+    top = sorted(
+        (
+            (name, cumulative)
+            for name, _, cumulative, level in entries_module
+            if level == 1
+        ),
+        key=lambda x: x[1],
+        reverse=True,
+    )[:n_top]
+    return {
+        "import_seconds": sum(x[1] for x in entries_module),
+        "wall_seconds": wall_time,
+        "max_rss_mib": max_rss,
+        "n_modules": len(entries_module),
+        "heavy_imports": heavy,
+        "top": top,
+        "error": error,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--modules", nargs="*", help="Modules to import (default: entry points)."
+    )
+    parser.add_argument("--repeats", type=int, default=default_repeats)
+    parser.add_argument("--output", help="Path of the json output.")
+    args = parser.parse_args(argv)
+
+    if args.modules:
+        selected = [(x, dict(cases).get(x, ())) for x in args.modules]
+    else:
+        selected = cases
+
+    results = {}
+    failed = []
+    for module, forbidden in selected:
+        result = run_case(module, forbidden, args.repeats)
+        results[module] = result
+        if result["error"]:
+            print("{:<52} failed: {}".format(module, result["error"]))
+            continue
+        print(
+            "{:<52} import {:>6.3f} s  wall {:>6.3f} s  rss {:>6.1f} MiB".format(
+                module,
+                result["import_seconds"],
+                result["wall_seconds"],
+                result["max_rss_mib"],
+            )
+        )
+        for name, cumulative in result["top"]:
+            print("    {:<48} {:>6.3f} s".format(name, cumulative))
+        if result["heavy_imports"]:
+            print("    imports {}".format(", ".join(result["heavy_imports"])))
+            failed.append(module)
+
+    if args.output:
+        output = {
+            "meta": {
+                "time": datetime.now(timezone.utc).isoformat(),
+                "repeats": args.repeats,
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+            },
+            "results": results,
+            "failed": failed,
+        }
+        with open(args.output, "w") as file:
+            json.dump(output, file, indent=2)
+
+    if failed:
+        print("Heavy imports in: {}".format(", ".join(failed)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+Synthetic data for benchmarks, at realistic scales.
+
+Measurements have a daily cycle, noise, and occasional failed readings (missing
+values, written as `None` like in `measurement.py`). All generators are
+deterministic for a given seed.
+
+Scales used by the benchmarks:
+- sampling every 300 s (cron job), 5 s (`measurement_continuous.py`) or 1 s
+- from one week to five years of data
+- many sensors (combinations of location, condition & sensor type, like in
+  `plot_pollution_from_db.py`)
+
+"""
+
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from dateutil import tz
+
+from py_air_quality.crud.read_csv_data import add_time_columns
+
+# Share of failed readings (missing values):
+missing_share = 0.002
+
+local_time_zone_name = "Europe/Berlin"
+
+
+def measurement_arrays(
+    *, days: float, interval_seconds: float, end_epoch: int, seed: int = 0
+):
+    """Epoch timestamps, pm25 & pm10 (with missing values as nan)."""
+    rng = np.random.default_rng(seed)
+    timestamp = np.arange(
+        end_epoch - int(days * 86400), end_epoch, interval_seconds
+    ).astype(np.int64)
+    n = len(timestamp)
+    # Daily cycle with a peak in the evening, plus noise:
+    daytime = (timestamp % 86400) / 86400.0
+    cycle = 2.0 * np.sin(2.0 * np.pi * (daytime - 0.5))
+    pm25 = np.abs(5.0 + cycle + rng.normal(0.0, 2.0, size=n))
+    pm10 = pm25 + np.abs(rng.normal(2.0, 1.0, size=n))
+    pm25 = np.around(pm25, decimals=1)
+    pm10 = np.around(pm10, decimals=1)
+    missing = rng.random(n) < missing_share
+    pm25[missing] = np.nan
+    pm10[missing] = np.nan
+    return timestamp, pm25, pm10
+
+
+def write_measurement_csv(
+    path_csv: str, *, days: float, interval_seconds: float, end_epoch: int, seed=0
+):
+    """Write measurements in the csv format of `measurement.py`."""
+    timestamp, pm25, pm10 = measurement_arrays(
+        days=days, interval_seconds=interval_seconds, end_epoch=end_epoch, seed=seed
+    )
+    df = pd.DataFrame({"timestamp": timestamp, "pm25": pm25, "pm10": pm10})
+    df.to_csv(path_csv, index=False, na_rep="None")
+    return len(df)
+
+
+def measurement_dataframe(
+    *, days: float, interval_seconds: float, end_epoch: int, seed: int = 0
+):
+    """Measurements in the format of `read_csv_data` (with time columns)."""
+    timestamp, pm25, pm10 = measurement_arrays(
+        days=days, interval_seconds=interval_seconds, end_epoch=end_epoch, seed=seed
+    )
+    df = pd.DataFrame({"timestamp": timestamp, "pm25": pm25, "pm10": pm10})
+    return add_time_columns(df, local_time_zone=tz.gettz(local_time_zone_name))
+
+
+def sensor_combinations(n_sensors: int):
+    """Combinations of location, condition & sensor type."""
+    return [
+        {
+            "measurement_location": "Location {}".format(idx // 2),
+            "experimental_condition": ("baseline", "with_filter")[idx % 2],
+            "sensor_type": "Nova Fitness SDS011",
+        }
+        for idx in range(n_sensors)
+    ]
+
+
+def mongo_documents(
+    *,
+    days: float,
+    interval_seconds: float,
+    end_epoch: int,
+    n_sensors: int = 1,
+    seed: int = 0,
+):
+    """
+    Documents as committed to the database by `commit_to_db.py`, for each
+    sensor. Returns a dictionary with a list of documents per sensor index.
+    """
+    record_time_utc = datetime.fromtimestamp(end_epoch, tz=timezone.utc)
+    documents = {}
+    for idx_sensor, combination in enumerate(sensor_combinations(n_sensors)):
+        timestamp, pm25, pm10 = measurement_arrays(
+            days=days,
+            interval_seconds=interval_seconds,
+            end_epoch=end_epoch,
+            seed=seed + idx_sensor,
+        )
+        dt = pd.to_datetime(timestamp, unit="s", utc=True).to_pydatetime()
+        documents[idx_sensor] = [
+            {
+                "timestamp": int(x),
+                "pm25": (None if np.isnan(y) else float(y)),
+                "pm10": (None if np.isnan(z) else float(z)),
+                "datetime": d,
+                "record_time_utc": record_time_utc,
+                **combination,
+            }
+            for x, y, z, d in zip(timestamp.tolist(), pm25, pm10, dt)
+        ]
+    return documents
+
+
+def projected_documents(documents):
+    """Documents as returned by the query in `plot_pollution_from_db.py`."""
+    return [
+        {"timestamp": x["timestamp"], "pm25": x["pm25"], "pm10": x["pm10"]}
+        for x in documents
+    ]
+
+
+def external_hourly(*, days: float, end_epoch: int, pollutant: str, seed: int = 0):
+    """Hourly outdoor measurements (after parsing, see `filter_effect`)."""
+    rng = np.random.default_rng(seed)
+    end_epoch = end_epoch - (end_epoch % 3600)
+    timestamp = np.arange(end_epoch - int(days * 86400), end_epoch, 3600)
+    values = np.abs(rng.normal(10.0, 4.0, size=len(timestamp)))
+    return pd.DataFrame(
+        {"timestamp": timestamp, (pollutant + "_external"): np.around(values, 1)}
+    )
+
+
+def gps_track(*, hours: float, interval_seconds: float, end_epoch: int, seed: int = 0):
+    """
+    GPS data in the format of the "GPS Logger" App (a random walk around
+    Berlin; some datetime strings with milliseconds).
+    """
+    rng = np.random.default_rng(seed)
+    timestamp = np.arange(
+        end_epoch - int(hours * 3600), end_epoch, interval_seconds
+    ).astype(np.int64)
+    n = len(timestamp)
+    latitude = 52.5 + np.cumsum(rng.normal(0.0, 1e-4, size=n))
+    longitude = 13.4 + np.cumsum(rng.normal(0.0, 1e-4, size=n))
+    date_time = pd.to_datetime(timestamp, unit="s").strftime("%Y-%m-%d %H:%M:%S")
+    with_ms = rng.random(n) < 0.5
+    date_time = np.where(with_ms, date_time + ".000", date_time)
+    return pd.DataFrame(
+        {"date time": date_time, "latitude": latitude, "longitude": longitude}
+    )
@@ -0,0 +1,113 @@
+"""
+Command line entry point: `py-air-quality <command> [arguments]`.
+
+Each command runs one of the scripts, as if it was started directly (e.g.
+`py-air-quality measure` instead of `python .../measurement/measurement.py`).
+Arguments after the command are passed on to the script (e.g. `--profile`).
+
+The script is only imported when its command is run, so that the entry point
+itself stays cheap: `measure` and `measure-continuous` never import pandas,
+numpy or pydantic (see `py_air_quality/benchmark/import_time.py`).
+
+Cron job example (every 5 minutes):
+```
+*/5 * * * * /home/pi/py_main/bin/py-air-quality measure
+```
+
+"""
+
+import argparse
+import runpy
+import sys
+
+# Command: (module, arguments passed to the module before the user's arguments,
+# help text).
+commands = {
+    "measure": (
+        "py_air_quality.measurement.measurement",
+        [],
+        "Take one measurement (e.g. as a cron job).",
+    ),
+    "measure-continuous": (
+        "py_air_quality.measurement.measurement_continuous",
+        [],
+        "Measure continuously (e.g. as a service).",
+    ),
+    "mobile-session": (
+        "py_air_quality.measurement.mobile_session",
+        [],
+        "Join GPS fixes with readings during a mobile measurement.",
+    ),
+    "commit": (
+        "py_air_quality.crud.commit_to_db",
+        [],
+        "Commit new measurements to the database.",
+    ),
+    "commit-daemon": (
+        "py_air_quality.crud.commit_daemon",
+        [],
+        "Commit new measurements to the database as soon as they are written.",
+    ),
+    "data-quality": (
+        "py_air_quality.crud.data_quality",
+        [],
+        "Flag gaps, spikes, stuck & out-of-range measurements.",
+    ),
+    "plot": (
+        "py_air_quality.server.plot_pollution_from_db",
+        [],
+        "Plot measurements from the database.",
+    ),
+    "render-daemon": (
+        "py_air_quality.server.render_daemon",
+        [],
+        "Plot measurements from the database in a long-lived process.",
+    ),
+    "serve": (
+        "uvicorn",
+        ["py_air_quality.server.server:app"],
+        "Start the server (uvicorn options, e.g. --host 123.456.7.890).",
+    ),
+    "mobile-batch": (
+        "py_air_quality.analysis.mobile_batch",
+        [],
+        "Process all mobile measurements in a directory.",
+    ),
+    "mobile-grid": (
+        "py_air_quality.analysis.spatial_grid",
+        [],
+        "Aggregate mobile measurements of many tracks on a map grid.",
+    ),
+    "benchmark": (
+        "py_air_quality.benchmark.benchmark_suite",
+        [],
+        "Run the benchmark suite.",
+    ),
+    "import-time": (
+        "py_air_quality.benchmark.import_time",
+        [],
+        "Report the import time of the entry points.",
+    ),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="py-air-quality",
+        description="Measure and analyse air particulate concentration.",
+    )
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    subparsers.required = True
+    for command, (_, _, help_text) in commands.items():
+        # Arguments of the command (including `--help`) are left to the script:
+        subparsers.add_parser(command, help=help_text, add_help=False)
+    args, arguments_script = parser.parse_known_args(argv)
+
+    module, arguments, _ = commands[args.command]
+    sys.argv = [module] + arguments + arguments_script
+    runpy.run_module(module, run_name="__main__", alter_sys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
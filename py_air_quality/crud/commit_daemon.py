@@ -0,0 +1,261 @@
+"""
+Commit new measurements to the database as soon as they are written.
+
+Event-driven alternative to the `commit_to_db.py` cron job (which waits 55 s
+for the measurement to finish). The measurement scripts notify the daemon after
+each reading (UDP message to `COMMIT_LISTEN_ADDRESS`, which needs to be one of
+the `NOTIFY_ADDRESSES` in the `.env` file, see
+`py_air_quality/internal/notify.py`). Because notifications can get lost, the
+csv file is also checked for new rows every `--poll-seconds` seconds (one
+`os.stat` if nothing changed).
+
+Only the rows appended since the last check are parsed, and nothing is sent to
+the database if there are no new rows. The age of the newest datapoint when its
+insertion is acknowledged is recorded in the metrics (`commit_daemon.prom`).
+
+Requires database credentials to be set in
+py-air-quality/py_air_quality/internal/.credentials
+
+Can be run as a service (instead of the cron job), e.g. with a systemd unit
+file (see `py_air_quality/measurement/measurement_continuous.py` for how to set
+up a service):
+```
+[Unit]
+Description=Python Air Quality Commit Daemon
+After=network-online.target
+
+[Service]
+User=pi
+Type=simple
+Restart=always
+ExecStart=/home/pi/py_main/bin/python /home/pi/github/py-air-quality/py_air_quality/crud/commit_daemon.py
+
+[Install]
+WantedBy=multi-user.target
+```
+
+"""
+
+import argparse
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pymongo
+
+from py_air_quality.crud import commit_to_db
+from py_air_quality.crud.read_csv_data import add_time_columns
+from py_air_quality.internal.metrics import textfile_path
+from py_air_quality.internal.notify import parse_addresses
+from py_air_quality.internal.settings import settings
+from py_air_quality.server.measurement_store import MeasurementStore
+
+metrics = commit_to_db.metrics
+
+path_metrics = textfile_path(commit_to_db.data_directory, "commit_daemon")
+
+notifications = metrics.counter(
+    "notifications_total",
+    "Number of notifications received, by whether they matched the condition.",
+    ["matched"],
+)
+
+
+class CommitDaemon:
+    """
+    Commit new rows of the measurement csv file when notified, or when the file
+    changed.
+    """
+
+    def __init__(
+        self,
+        *,
+        listen_address: str = settings.COMMIT_LISTEN_ADDRESS,
+        poll_seconds: float = 30.0,
+    ):
+        self.logger = self._init_logger()
+
+        # Enable graceful shutdown of the service:
+        signal.signal(signal.SIGTERM, self._handle_sigterm)
+        signal.signal(signal.SIGINT, self._handle_sigterm)
+
+        self.poll_seconds = poll_seconds
+        self.continue_committing = True
+
+        # Socket for notifications from the measurement scripts (None if
+        # disabled, then only the csv file is checked):
+        self.socket = None
+        addresses = parse_addresses(listen_address)
+        if addresses:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket.bind(addresses[0])
+            self.socket.setblocking(False)
+
+        self.store = MeasurementStore(commit_to_db.path_csv)
+
+        self.client = commit_to_db.connect()
+        self.db_collection = self.client.air_quality["air_quality"]
+        self.newest_db_timestamp = None
+
+    def _init_logger(self):
+        logger = logging.getLogger(__name__)
+        logger.setLevel(logging.DEBUG)
+        stdout_handler = logging.StreamHandler()
+        stdout_handler.setLevel(logging.DEBUG)
+        stdout_handler.setFormatter(logging.Formatter("%(levelname)8s | %(message)s"))
+        logger.addHandler(stdout_handler)
+        return logger
+
+    def _receive(self, timeout: float):
+        """
+        Wait for notifications (at most `timeout` seconds). Returns whether a
+        notification about the condition of this daemon was received.
+        """
+        if self.socket is None:
+            time.sleep(timeout)
+            return False
+        readable, _, _ = select.select([self.socket], [], [], timeout)
+        matched = False
+        while readable:
+            try:
+                datagram = self.socket.recv(65536)
+            except BlockingIOError:
+                break
+            try:
+                message = json.loads(datagram)
+                is_match = (
+                    (message.get("type") == "reading")
+                    and (
+                        message.get("experimental_condition")
+                        == commit_to_db.experimental_condition
+                    )
+                    and (
+                        message.get("measurement_location")
+                        == commit_to_db.measurement_location
+                    )
+                )
+            except (ValueError, AttributeError):
+                is_match = False
+            notifications.inc(matched=str(is_match).lower())
+            matched = matched or is_match
+        return matched
+
+    def commit(self):
+        """Insert the rows appended to the csv file since the last commit."""
+        if self.newest_db_timestamp is None:
+            self.newest_db_timestamp = commit_to_db.find_newest_timestamp(
+                self.db_collection
+            )
+
+        if not os.path.isfile(commit_to_db.path_csv):
+            # No measurement yet.
+            return 0
+
+        with metrics.time_stage("csv_parse"):
+            self.store.refresh()
+            if self.newest_db_timestamp is None:
+                start = np.iinfo(np.int64).min
+            else:
+                start = self.newest_db_timestamp + 1
+            timestamp, pm25, pm10 = self.store.window(start)
+            quality = self.store.window_quality(start)
+            interval = self.store.window_interval(start)
+
+        if len(timestamp) == 0:
+            return 0
+
+        df = pd.DataFrame(
+            {
+                "timestamp": timestamp.copy(),
+                "pm25": pm25.copy(),
+                "pm10": pm10.copy(),
+                "quality_pm25": quality[0].copy(),
+                "quality_pm10": quality[1].copy(),
+                "interval": interval.copy(),
+            }
+        )
+        df = add_time_columns(df)
+
+        if self.newest_db_timestamp is not None:
+            # The quality flags of the newest measurement in the database
+            # depend on the next measurement:
+            quality = self.store.window_quality(
+                self.newest_db_timestamp, self.newest_db_timestamp + 1
+            )
+            commit_to_db.update_quality(
+                self.db_collection,
+                pd.DataFrame(
+                    {
+                        "timestamp": [self.newest_db_timestamp] * quality.shape[1],
+                        "quality_pm25": quality[0],
+                        "quality_pm10": quality[1],
+                    }
+                ),
+            )
+
+        utc_now = datetime.now(timezone.utc)
+        if commit_to_db.insert_measurements(self.db_collection, df, utc_now):
+            self.newest_db_timestamp = int(timestamp[-1])
+            metrics.write_textfile(path_metrics)
+            return len(df)
+        return 0
+
+    def start(self):
+        """Commit new data until stopped."""
+        self.logger.info("Commit daemon started.")
+        next_poll = time.monotonic()
+        while self.continue_committing:
+            now = time.monotonic()
+            if next_poll <= now:
+                # Check the csv file (also commits data whose notification got
+                # lost):
+                check = True
+                next_poll = now + self.poll_seconds
+            else:
+                check = self._receive(min(1.0, next_poll - now))
+            if not check:
+                continue
+            try:
+                self.commit()
+            except pymongo.errors.PyMongoError as error:
+                # The client reconnects by itself; try again on the next check.
+                self.logger.error("Database error: {}".format(error))
+                metrics.write_textfile(path_metrics)
+        if self.socket is not None:
+            self.socket.close()
+        self.client.close()
+        metrics.write_textfile(path_metrics)
+        self.logger.info("Commit daemon stopped.")
+
+    def _handle_sigterm(self, sig, frame):
+        self.logger.info("Stop requested.")
+        self.continue_committing = False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Commit new measurements to the database when they are written."
+    )
+    parser.add_argument(
+        "--poll-seconds",
+        type=float,
+        default=30.0,
+        help="Seconds between checks of the csv file (in case of lost notifications).",
+    )
+    args = parser.parse_args(argv)
+
+    daemon = CommitDaemon(poll_seconds=args.poll_seconds)
+    daemon.start()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,20 +7,32 @@ py-air-quality/py_air_quality/internal/.credentials
 Can be run as a cron job:
 */5 * * * * /home/pi/py_main/bin/python /home/pi/github/py-air-quality/py_air_quality/crud/commit_to_db.py >> /home/pi/air_quality/crontab_log_db.txt 2>&1
 
-"""
+To commit new measurements as soon as they are written (instead of waiting for
+the next cron run), see `py_air_quality/crud/commit_daemon.py`.
 
+Measurements are committed with their quality flags (`quality_pm25` &
+`quality_pm10`, see `py_air_quality/crud/data_quality.py`). The flags of the
+newest measurement in the database are updated on the next commit (it may turn
+out to be a spike).
 
-from time import sleep
+"""
 
-sleep(55)
 
+import atexit
 import os
+import time
 from datetime import datetime, timezone
 
 import pymongo
 
 from py_air_quality.crud.read_csv_data import read_csv_data
+from py_air_quality.internal import profiling
 from py_air_quality.internal.credentials import credentials
+from py_air_quality.internal.metrics import (
+    Registry,
+    freshness_buckets,
+    textfile_path,
+    )
 from py_air_quality.internal.settings import settings
 
 
@@ -45,6 +57,22 @@ path_csv = os.path.join(
     'measurement_{}.csv'.format(experimental_condition)
     )
 
+# Metrics of this run (e.g. for the textfile collector of the Prometheus node
+# exporter):
+metrics = Registry(script='commit_to_db')
+path_metrics = textfile_path(data_directory, 'commit_to_db')
+inserted = metrics.counter(
+    'inserted_datapoints_total', 'Number of datapoints inserted into database.')
+newest_timestamp = metrics.gauge(
+    'newest_committed_timestamp_seconds',
+    'Timestamp of the newest datapoint in the database (epoch seconds).',
+    )
+commit_freshness = metrics.histogram(
+    'commit_freshness_seconds',
+    'Age of the newest datapoint when its insertion was acknowledged.',
+    buckets=freshness_buckets,
+    )
+
 
 # ------------------------------------------------------------------------------
 # *** Load credentials from .credentials file
@@ -57,34 +85,33 @@ mongodb_tsl_cert = credentials.PATH_MONGODB_TSL_CERTIFICATE
 
 
 # ------------------------------------------------------------------------------
-# *** Commit new data to mongodb database
-
-utc_now = datetime.now(timezone.utc)
-
-print('Commit new data to mongodb database at {}'.format(utc_now))
-
-with pymongo.MongoClient(mongodb_url,
-                         username=mongodb_username,
-                         authMechanism='MONGODB-X509',
-                         tls=True,
-                         tlsCertificateKeyFile=mongodb_tsl_cert,
-                         ) as client:
-
-    db = client.air_quality
-
-    db_collection = db['air_quality']
-
-    # Get the newest datapoint (from the same measurement conditions) from the
-    # mongodb database:
+# *** Functions
+
+def connect():
+    """Client for the mongodb database (use as context manager)."""
+    return pymongo.MongoClient(mongodb_url,
+                               username=mongodb_username,
+                               authMechanism='MONGODB-X509',
+                               tls=True,
+                               tlsCertificateKeyFile=mongodb_tsl_cert,
+                               )
+
+
+def find_newest_timestamp(db_collection):
+    """
+    Get the timestamp of the newest datapoint (from the same measurement
+    conditions) from the mongodb database. Returns None if there is none.
+    """
     dict_search = {'experimental_condition': experimental_condition,
                    'measurement_location': measurement_location,
                    'sensor_type': sensor_type,
                    }
 
-    search_results = db_collection.find_one(
-        dict_search,
-        sort=[('timestamp', pymongo.DESCENDING)],
-        )
+    with metrics.time_stage('db_find_newest'):
+        search_results = db_collection.find_one(
+            dict_search,
+            sort=[('timestamp', pymongo.DESCENDING)],
+            )
 
     if search_results:
         newest_db_timestamp = search_results.get('timestamp')
@@ -94,30 +121,119 @@ with pymongo.MongoClient(mongodb_url,
         print('Found no previous data from same condition in database')
         newest_db_timestamp = None
 
-    # Read measurement data from csv file, and select new measurements that are
-    # not yet in the database.
-    df = read_csv_data(path_csv, newest_db_timestamp=newest_db_timestamp)
+    return newest_db_timestamp
+
+
+def insert_measurements(db_collection, df, utc_now):
+    """
+    Annotate new measurements (dataframe as returned by `read_csv_data`), and
+    insert them into the database. Returns whether the insertion was
+    acknowledged.
+    """
+    print('Insert {} new datapoints into database'.format(len(df)))
+
+    # Select & annotate data to be committed to database (the sampling
+    # interval only if it was recorded, see
+    # `py_air_quality/measurement/adaptive_sampling.py`):
+    columns = ['timestamp', 'pm25', 'pm10', 'datetime',
+               'quality_pm25', 'quality_pm10']
+    if ('interval' in df.columns) and df['interval'].notna().any():
+        columns.append('interval')
+    df = df[columns].copy()
+    df['experimental_condition'] = experimental_condition
+    df['measurement_location'] = measurement_location
+    df['sensor_type'] = sensor_type
+    df['record_time_utc'] = utc_now
+
+    # Commit new measurement data to database:
+    df_list = df.to_dict(orient='records')
+    with metrics.time_stage('db_insert'):
+        db_response = db_collection.insert_many(df_list)
 
-    if 0 < len(df):
+    if not db_response.acknowledged:
+        print('ERROR: Database insertion failed.')
+        return False
 
-        print('Insert {} new datapoints into database'.format(len(df)))
+    print('Database insertion acknowledged.')
+    inserted.inc(len(df_list))
+    newest_db_timestamp = int(df['timestamp'].max())
+    newest_timestamp.set(newest_db_timestamp)
+    commit_freshness.observe(time.time() - newest_db_timestamp)
+    metrics.mark_success()
+    return True
 
-        # Select & annotate data to be committed to database:
-        df = df[['timestamp', 'pm25', 'pm10', 'datetime']]
-        df['experimental_condition'] = experimental_condition
-        df['measurement_location'] = measurement_location
-        df['sensor_type'] = sensor_type
-        df['record_time_utc'] = utc_now
 
-        # Commit new measurement data to database:
-        df_list = df.to_dict(orient='records')
-        db_response = db_collection.insert_many(df_list)
+def update_quality(db_collection, df):
+    """
+    Set the quality flags of measurements that are already in the database
+    (dataframe with `timestamp`, `quality_pm25` & `quality_pm10` columns).
+    """
+    for timestamp, quality_pm25, quality_pm10 in zip(
+            df['timestamp'], df['quality_pm25'], df['quality_pm10']):
+        dict_search = {'experimental_condition': experimental_condition,
+                       'measurement_location': measurement_location,
+                       'sensor_type': sensor_type,
+                       'timestamp': int(timestamp),
+                       }
+        dict_update = {'$set': {'quality_pm25': int(quality_pm25),
+                                'quality_pm10': int(quality_pm10),
+                                }
+                       }
+        with metrics.time_stage('db_update_quality'):
+            db_collection.update_one(dict_search, dict_update, upsert=False)
+
+
+def main():
+    # Wait for the measurement to finish (assuming that the measurement is done
+    # at the same frequency, through cron tab).
+    time.sleep(55)
+
+    # Written at exit (also if the run fails, so that failed stages are
+    # recorded):
+    atexit.register(metrics.write_textfile, path_metrics)
+
+    # Profile the script if requested (see
+    # `py_air_quality.internal.profiling`):
+    profiling.start('commit_to_db', data_directory)
+
+    profiling.mark('commit')
+
+    utc_now = datetime.now(timezone.utc)
+
+    print('Commit new data to mongodb database at {}'.format(utc_now))
+
+    with connect() as client:
+
+        db = client.air_quality
+
+        db_collection = db['air_quality']
+
+        newest_db_timestamp = find_newest_timestamp(db_collection)
+
+        # Read measurement data from csv file, and select new measurements
+        # that are not yet in the database.
+        with metrics.time_stage('csv_parse'):
+            df = read_csv_data(path_csv)
+        if newest_db_timestamp is not None:
+            df_newest = df.loc[df['timestamp'] == newest_db_timestamp]
+            df = df.loc[df['timestamp'] > newest_db_timestamp].copy()
+
+        if 0 < len(df):
+
+            if newest_db_timestamp is not None:
+                # The quality flags of the newest measurement in the database
+                # depend on the next measurement:
+                update_quality(db_collection, df_newest)
+
+            insert_measurements(db_collection, df, utc_now)
 
-        if db_response.acknowledged:
-            print('Database insertion acknowledged.')
         else:
-            print('ERROR: Database insertion failed.')
 
-    else:
+            print('No new data to be committed to database.')
+            metrics.mark_success()
+            if newest_db_timestamp is not None:
+                newest_timestamp.set(newest_db_timestamp)
+
 
-        print('No new data to be committed to database.')
+if __name__ == '__main__':
+    main()
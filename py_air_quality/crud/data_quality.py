@@ -0,0 +1,384 @@
+"""
+Data quality flags of measurements: gaps, spikes, stuck & out-of-range values.
+
+Every reading gets one flag value per pollutant (`quality_pm25` and
+`quality_pm10`, zero if nothing was detected), combining these bits:
+- `MISSING`: failed read (`None` in the csv file)
+- `OUT_OF_RANGE`: outside the measurement range of the sensor (for the SDS011
+  0 to 999.9 µg/m³; readings at the upper limit are saturated)
+- `SPIKE`: single reading that differs from the readings before & after it
+  (in the same direction) by more than `max(spike_delta, spike_ratio * mean of
+  the neighbours)`, while the neighbours agree with each other
+- `STUCK`: the same value has been read for at least `stuck_seconds` (flat-line;
+  only the readings after `stuck_seconds` are flagged)
+- `AFTER_GAP`: first reading after a gap of more than `gap_seconds` (e.g. when
+  the Raspberry Pi was off); see `gaps` for the gaps themselves
+
+Flags only depend on the readings up to the next one, so they can be computed
+incrementally as new readings are written (`QualityChecker`), with the same
+result as for the entire history at once. The flags of the newest reading are
+provisional: it can still become a `SPIKE` when the next reading arrives.
+
+Readings with any of the `exclude_default` flags are left out of plots and
+analyses (see `exclude_flagged`); readings after a gap are valid.
+
+The flags of the measurements in the database are set when they are committed
+(see `py_air_quality/crud/commit_to_db.py`). To set them for the history in the
+database (or to check a csv file):
+```
+py-air-quality data-quality --db
+py-air-quality data-quality --csv ~/air_quality/measurement_baseline.csv
+```
+
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+MISSING = 1
+OUT_OF_RANGE = 2
+SPIKE = 4
+STUCK = 8
+AFTER_GAP = 16
+
+flag_names = {
+    MISSING: "missing",
+    OUT_OF_RANGE: "out_of_range",
+    SPIKE: "spike",
+    STUCK: "stuck",
+    AFTER_GAP: "after_gap",
+}
+
+# Flags of readings that are not used in plots & analyses (missing readings are
+# nan anyway):
+exclude_default = OUT_OF_RANGE | SPIKE | STUCK
+
+# Pollutants, in the order of the rows of the flag arrays:
+pollutants = ("pm25", "pm10")
+
+
+class QualityChecker:
+    """
+    Compute quality flags incrementally (see module docstring). Readings are
+    expected in chronological order.
+    """
+
+    def __init__(
+        self,
+        *,
+        n_series: int = 2,
+        gap_seconds: float = 600.0,
+        value_range: tuple = (0.0, 999.9),
+        spike_delta: float = 20.0,
+        spike_ratio: float = 1.0,
+        stuck_seconds: float = 3600.0,
+    ):
+        self.n_series = n_series
+        self.gap_seconds = gap_seconds
+        self.value_range = value_range
+        self.spike_delta = spike_delta
+        self.spike_ratio = spike_ratio
+        self.stuck_seconds = stuck_seconds
+        # The last two readings (the spike flag of the newest one depends on
+        # the next reading, and the one before is its neighbour):
+        self.context_timestamp = np.zeros(0, dtype=np.int64)
+        self.context_values = np.zeros((n_series, 0))
+        # State before the context readings: timestamp of the last reading, and
+        # value & start time of the current run of identical values per series
+        # (nan if none).
+        self.last_timestamp = None
+        self.run_value = np.full(n_series, np.nan)
+        self.run_start = np.full(n_series, np.nan)
+
+    def update(self, timestamp: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """
+        Flags (uint8, shape (n_series, n)) of new readings (`values` with shape
+        (n_series, n_readings), nan for failed reads). Except on the first
+        call, the flags of the previous newest reading are returned as well
+        (first column), because they can change with the next reading.
+        """
+        timestamp = np.asarray(timestamp, dtype=np.int64)
+        values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+        n_context = len(self.context_timestamp)
+        timestamp = np.concatenate([self.context_timestamp, timestamp])
+        values = np.concatenate([self.context_values, values], axis=1)
+        n = len(timestamp)
+        flags = np.zeros((self.n_series, n), dtype=np.uint8)
+        if n == 0:
+            return flags
+
+        after_gap = np.zeros(n, dtype=bool)
+        after_gap[1:] = self.gap_seconds < np.diff(timestamp)
+        if self.last_timestamp is not None:
+            after_gap[0] = self.gap_seconds < (timestamp[0] - self.last_timestamp)
+        flags[:, after_gap] |= AFTER_GAP
+
+        missing = np.isnan(values)
+        flags[missing] |= MISSING
+        with np.errstate(invalid="ignore"):
+            out_of_range = (values < self.value_range[0]) | (
+                self.value_range[1] <= values
+            )
+        flags[out_of_range] |= OUT_OF_RANGE
+
+        flags[:, 1:-1][self._spikes(values, after_gap)] |= SPIKE
+
+        # Number of gaps up to each reading (runs of identical values do not
+        # continue across gaps):
+        gap_count = np.cumsum(after_gap)
+        run_value = self.run_value.copy()
+        run_start = self.run_start.copy()
+        for series in range(self.n_series):
+            idx = np.flatnonzero(~missing[series])
+            if len(idx) == 0:
+                continue
+            value = values[series, idx]
+            time_valid = timestamp[idx].astype(np.float64)
+            new_run = np.ones(len(idx), dtype=bool)
+            new_run[1:] = (value[1:] != value[:-1]) | (
+                gap_count[idx[1:]] != gap_count[idx[:-1]]
+            )
+            new_run[0] = not (
+                (value[0] == run_value[series]) and (gap_count[idx[0]] == 0)
+            )
+            first = np.maximum.accumulate(np.where(new_run, np.arange(len(idx)), 0))
+            start = time_valid[first]
+            if not new_run[0]:
+                start[first == 0] = run_start[series]
+            stuck = self.stuck_seconds <= (time_valid - start)
+            flags[series, idx[stuck]] |= STUCK
+
+            # Run state before the readings kept as context:
+            before = np.flatnonzero(idx < (n - 2))
+            if len(before):
+                run_value[series] = value[before[-1]]
+                run_start[series] = start[before[-1]]
+
+        # Keep the last two readings as context for the next call:
+        if 2 < n:
+            for series in range(self.n_series):
+                # Position of the last valid reading before the context:
+                valid = np.flatnonzero(~missing[series, : n - 2])
+                gaps_before = gap_count[valid[-1]] if len(valid) else 0
+                if gap_count[n - 3] != gaps_before:
+                    run_value[series] = np.nan
+            self.last_timestamp = int(timestamp[-3])
+            self.run_value = run_value
+            self.run_start = run_start
+        self.context_timestamp = timestamp[-2:]
+        self.context_values = values[:, -2:]
+
+        # The first context reading is final (it was returned before):
+        return flags[:, max(n_context - 1, 0) :]
+
+    def _spikes(self, values: np.ndarray, after_gap: np.ndarray) -> np.ndarray:
+        """Spikes among the readings that have a neighbour on both sides."""
+        previous = values[:, :-2]
+        current = values[:, 1:-1]
+        following = values[:, 2:]
+        threshold = np.maximum(
+            self.spike_delta, self.spike_ratio * 0.5 * (previous + following)
+        )
+        with np.errstate(invalid="ignore"):
+            d_previous = current - previous
+            d_following = current - following
+            return (
+                (np.sign(d_previous) == np.sign(d_following))
+                & (threshold < np.abs(d_previous))
+                & (threshold < np.abs(d_following))
+                & (np.abs(following - previous) <= threshold)
+                & ~after_gap[np.newaxis, 1:-1]
+                & ~after_gap[np.newaxis, 2:]
+            )
+
+
+def quality_flags(timestamp: np.ndarray, values: np.ndarray, **kwargs) -> np.ndarray:
+    """
+    Flags of all readings at once (`values` with shape (n_series, n_readings),
+    in chronological order; see `QualityChecker` for the parameters).
+    """
+    return QualityChecker(n_series=len(np.atleast_2d(values)), **kwargs).update(
+        timestamp, values
+    )
+
+
+def add_quality_columns(df: pd.DataFrame, **kwargs) -> pd.DataFrame:
+    """
+    Add `quality_pm25` & `quality_pm10` columns to measurement data (with
+    `timestamp`, `pm25` and `pm10` columns, in any order).
+    """
+    timestamp = df["timestamp"].to_numpy(dtype=np.int64)
+    order = np.argsort(timestamp, kind="stable")
+    values = np.stack([df[x].to_numpy(dtype=np.float64)[order] for x in pollutants])
+    flags = quality_flags(timestamp[order], values, **kwargs)
+    for i, pollutant in enumerate(pollutants):
+        column = np.zeros(len(df), dtype=np.uint8)
+        column[order] = flags[i]
+        df["quality_" + pollutant] = column
+    return df
+
+
+def exclude_flagged(df: pd.DataFrame, flags: int = exclude_default) -> pd.DataFrame:
+    """
+    Set readings with any of the given flags to nan (for dataframes with
+    quality columns, see `add_quality_columns`).
+    """
+    for pollutant in pollutants:
+        column = "quality_" + pollutant
+        if column in df:
+            flagged = (df[column].fillna(0).to_numpy(dtype=np.int64) & flags) != 0
+            df.loc[flagged, pollutant] = np.nan
+    return df
+
+
+def gaps(timestamp: np.ndarray, *, gap_seconds: float = 600.0):
+    """
+    Gaps of more than `gap_seconds` between readings (in chronological order),
+    as arrays of the timestamps before & after each gap.
+    """
+    timestamp = np.asarray(timestamp, dtype=np.int64)
+    idx = np.flatnonzero(gap_seconds < np.diff(timestamp))
+    return timestamp[idx], timestamp[idx + 1]
+
+
+def summary(timestamp: np.ndarray, flags: np.ndarray, *, gap_seconds: float = 600.0):
+    """Text summary of the flags & gaps of measurement data."""
+    lines = ["{} readings".format(len(timestamp))]
+    for i, pollutant in enumerate(pollutants[: len(flags)]):
+        counts = ", ".join(
+            "{} {}".format(name, int(np.count_nonzero(flags[i] & flag)))
+            for flag, name in flag_names.items()
+        )
+        lines.append("{}: {}".format(pollutant, counts))
+    start, end = gaps(timestamp, gap_seconds=gap_seconds)
+    lines.append(
+        "{} gaps of more than {:.0f} s, {:.1f} days in total".format(
+            len(start), gap_seconds, np.sum(end - start) / 86400.0
+        )
+    )
+    return "\n".join(lines)
+
+
+def backfill_db(*, chunk_size: int = 50000, **kwargs):
+    """
+    Set the quality flags of all measurements of the experimental condition in
+    the database (see `py_air_quality/crud/commit_to_db.py` for the settings).
+    """
+    import pymongo
+
+    from py_air_quality.crud import commit_to_db
+
+    dict_search = {
+        "experimental_condition": commit_to_db.experimental_condition,
+        "measurement_location": commit_to_db.measurement_location,
+        "sensor_type": commit_to_db.sensor_type,
+    }
+    with commit_to_db.connect() as client:
+        db_collection = client.air_quality["air_quality"]
+        t_start = time.perf_counter()
+        documents = db_collection.find(
+            dict_search,
+            projection={"_id": False, "timestamp": True, "pm25": True, "pm10": True},
+            sort=[("timestamp", pymongo.ASCENDING)],
+        )
+        df = pd.DataFrame(list(documents), columns=["timestamp", "pm25", "pm10"])
+        print(
+            "Read {} datapoints in {:.1f} s".format(
+                len(df), time.perf_counter() - t_start
+            )
+        )
+        if len(df) == 0:
+            return
+        timestamp = df["timestamp"].to_numpy(dtype=np.int64)
+        flags = quality_flags(
+            timestamp,
+            np.stack([df[x].to_numpy(dtype=np.float64) for x in pollutants]),
+            **kwargs,
+        )
+        print(summary(timestamp, flags))
+
+        # Most readings have no flags; set those with one request, then the
+        # others by flag value:
+        t_start = time.perf_counter()
+        db_collection.update_many(
+            dict_search, {"$set": {"quality_" + x: 0 for x in pollutants}}
+        )
+        flagged = np.any(flags != 0, axis=0)
+        combinations = pd.DataFrame(
+            {
+                "timestamp": timestamp[flagged],
+                "quality_pm25": flags[0, flagged],
+                "quality_pm10": flags[1, flagged],
+            }
+        )
+        for (quality_pm25, quality_pm10), df_flag in combinations.groupby(
+            ["quality_pm25", "quality_pm10"]
+        ):
+            values = df_flag["timestamp"].tolist()
+            for i in range(0, len(values), chunk_size):
+                db_collection.update_many(
+                    {**dict_search, "timestamp": {"$in": values[i : i + chunk_size]}},
+                    {
+                        "$set": {
+                            "quality_pm25": int(quality_pm25),
+                            "quality_pm10": int(quality_pm10),
+                        }
+                    },
+                )
+        print(
+            "Updated the flags of {} datapoints in {:.1f} s".format(
+                len(df), time.perf_counter() - t_start
+            )
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Flag gaps, spikes, stuck & out-of-range measurements."
+    )
+    parser.add_argument(
+        "--csv", default=None, help="Measurement csv file to check (summary only)."
+    )
+    parser.add_argument(
+        "--output", default=None, help="Save the flags of the csv file (csv file)."
+    )
+    parser.add_argument(
+        "--db",
+        action="store_true",
+        help="Set the flags of all measurements of the condition in the database.",
+    )
+    parser.add_argument("--gap-seconds", type=float, default=600.0)
+    parser.add_argument("--stuck-seconds", type=float, default=3600.0)
+    args = parser.parse_args(argv)
+    kwargs = {"gap_seconds": args.gap_seconds, "stuck_seconds": args.stuck_seconds}
+
+    if args.csv is not None:
+        from py_air_quality.server.measurement_store import MeasurementStore
+
+        t_start = time.perf_counter()
+        store = MeasurementStore(args.csv, quality_parameters=kwargs)
+        timestamp, _, _ = store.window(np.iinfo(np.int64).min)
+        flags = store.window_quality(np.iinfo(np.int64).min)
+        print(summary(timestamp, flags, gap_seconds=args.gap_seconds))
+        print("Checked in {:.1f} s".format(time.perf_counter() - t_start))
+        if args.output is not None:
+            pd.DataFrame(
+                {
+                    "timestamp": timestamp,
+                    "quality_pm25": flags[0],
+                    "quality_pm10": flags[1],
+                }
+            ).to_csv(args.output, index=False)
+    if args.db:
+        backfill_db(**kwargs)
+    if (args.csv is None) and (not args.db):
+        parser.error("Nothing to do, use --csv and/or --db.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
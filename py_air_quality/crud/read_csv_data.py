@@ -1,42 +1,96 @@
 import numpy as np
 import pandas as pd
-from dateutil import tz
-from datetime import datetime, timezone
+
+from py_air_quality.crud.data_quality import add_quality_columns
+from py_air_quality.crud.time_features import local_datetime, time_features
 
 
 def read_csv_data(path_csv, newest_db_timestamp=None):
     """
     Read & process measurement data from csv file.
     Load csv data created from `py_air_quality.measurement.measurement.py`, and
-    transform date string to datetime object, and return dataframe.
+    transform date string to datetime object, and return dataframe. Quality
+    flags are added as `quality_pm25` & `quality_pm10` columns (see
+    `py_air_quality.crud.data_quality`). Files without sampling interval (see
+    `py_air_quality.measurement.adaptive_sampling`) get an `interval` column of
+    nan.
     """
 
     df = pd.read_csv(path_csv)
 
+    df = df.replace(to_replace='None', value=np.nan)
+
+    df = df.astype({'pm25': np.float64, 'pm10': np.float64})
+
+    if 'interval' not in df.columns:
+        df['interval'] = np.nan
+    df = df.astype({'interval': np.float64})
+
+    # Quality flags depend on the preceding readings, so they are computed
+    # before selecting new measurements:
+    df = add_quality_columns(df)
+
     if newest_db_timestamp:
         # Select new measurements that are not yet in database:
-        df = df.loc[df['timestamp'] > newest_db_timestamp]
+        df = df.loc[df['timestamp'] > newest_db_timestamp].copy()
 
-    df = df.replace(to_replace='None', value=np.nan)
+    df = add_time_columns(df)
 
-    df = df.astype({'pm25': np.float64, 'pm10': np.float64})
+    return df
 
-    df['datetime'] = [
-        datetime.fromtimestamp(x, tz=timezone.utc) for x in
-        df['timestamp'].tolist()
-        ]
 
-    # Convert datetime to local time:
-    df['datetime'] = [
-        x.astimezone(tz.tzlocal()) for x in df['datetime'].tolist()
-        ]
+def interval_weights(interval, timestamp, max_seconds=60.0):
+    """
+    Weights of readings for time-weighted aggregates: the sampling interval in
+    seconds, i.e. the time since the previous reading (rounded, at least one).
+    Readings without interval (nan, e.g. from files written with a fixed
+    interval, or older database documents) are weighted by the time since the
+    previous reading (since the next one for the first reading), at most
+    `max_seconds` (the longest fixed interval, so that a reading after a gap
+    does not stand for the gap). Recorded and missing intervals can therefore
+    be mixed in one aggregate.
+    """
+    interval = np.asarray(interval, dtype=np.float64)
+    timestamp = np.asarray(timestamp, dtype=np.float64)
+    missing = np.isnan(interval)
+    if missing.any():
+        # Time since the previous reading (timestamps may be unordered, e.g.
+        # database query results):
+        order = np.argsort(timestamp, kind='stable')
+        elapsed = np.diff(timestamp[order])
+        elapsed = np.concatenate([elapsed[:1], elapsed])
+        if len(elapsed) == 0:
+            elapsed = np.full(len(order), max_seconds)
+        gap = np.empty(len(order), dtype=np.float64)
+        gap[order] = elapsed
+        interval = np.where(missing, np.minimum(gap, max_seconds), interval)
+    weights = np.round(interval)
+    return np.maximum(weights, 1.0).astype(np.int64)
+
 
-    # Add column for hour of the day:
+def add_time_columns(df, local_time_zone=None):
+    """
+    Add local datetime, weekday, weekend & daytime columns to measurement data.
+    The dataframe needs an epoch `timestamp` column. If no time zone is given,
+    the local time zone of the system is used. See
+    `py_air_quality.crud.time_features` for the definition of the columns.
+    """
+
+    timestamp = df['timestamp'].to_numpy(dtype=np.int64)
+
+    # Local datetime (time zone aware, stored as int64 by pandas):
+    datetime_local = local_datetime(timestamp, local_time_zone=local_time_zone)
+    df['datetime'] = datetime_local
+
+    features = time_features(timestamp, datetime_local=datetime_local)
 
     # Add column for weekday (where Monday is 0 and Sunday is 6):
-    df['weekday'] = [x.weekday() for x in df['datetime'].tolist()]
+    df['weekday'] = features['weekday']
 
     # Add column for weekend (binary; 0 = weekday, 1 = weekend):
-    df['weekend'] = [(5 <= x) for x in df['weekday'].tolist()]
+    df['weekend'] = features['weekend']
+
+    # Add column for the time of day (in hours, between 0 and 24):
+    df['daytime'] = features['daytime']
 
     return df
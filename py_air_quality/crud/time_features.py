@@ -0,0 +1,111 @@
+"""
+Local time features of epoch timestamps, computed for whole arrays at once.
+
+The conversion to local time uses the transition times of the time zone (via
+pandas), so it is correct across daylight saving time changes, without creating
+a `datetime` object per measurement. All features are numeric numpy arrays:
+- `utc_offset`: offset of local time from UTC, in seconds (int32)
+- `weekday`: day of the week, Monday is 0 and Sunday is 6 (int8)
+- `weekend`: Saturday or Sunday (bool)
+- `daytime`: local time of day in hours, from 0 to 24 (float64)
+- `hour`: local hour of the day, from 0 to 23 (int8)
+- `minute`: minute of the hour, from 0 to 59 (int8)
+- `hour_start`: epoch timestamp of the start of the local hour (int64); unique
+  per hour, also when the clock is set back
+- `day`: local calendar day, in days since 1970-01-01 (int32)
+
+"""
+
+import numpy as np
+import pandas as pd
+from dateutil import tz
+
+# 1970-01-01 was a Thursday:
+_weekday_epoch = 3
+
+
+def resolve_time_zone(local_time_zone=None):
+    """Time zone to use; the local time zone of the system if None is given."""
+    if local_time_zone is None:
+        # Returns the zone of `/etc/localtime` (or of the `TZ` variable) with
+        # its transition times, which pandas converts without a per-row
+        # fallback (unlike `tz.tzlocal()`).
+        return tz.gettz()
+    return local_time_zone
+
+
+def local_datetime(timestamp, local_time_zone=None) -> pd.DatetimeIndex:
+    """Time zone aware datetimes of epoch timestamps (in seconds)."""
+    timestamp = np.asarray(timestamp, dtype=np.int64)
+    return pd.to_datetime(timestamp, unit="s", utc=True).tz_convert(
+        resolve_time_zone(local_time_zone)
+    )
+
+
+def wall_clock_seconds(datetime_local: pd.DatetimeIndex) -> np.ndarray:
+    """
+    Local wall-clock time of time zone aware datetimes, in seconds since
+    1970-01-01 (local), as int64 array.
+    """
+    return (
+        datetime_local.tz_localize(None)
+        .to_numpy(dtype="datetime64[s]")
+        .astype(np.int64)
+    )
+
+
+def epoch_from_wall_clock(wall_clock, local_time_zone=None) -> np.ndarray:
+    """
+    Epoch timestamps (in seconds) of local wall-clock times, given as naive
+    datetimes or as seconds since 1970-01-01 (local). Ambiguous times (when the
+    clock is set back) resolve to the first occurrence (like
+    `datetime.timestamp`), times that do not exist (when the clock is set
+    forward) are shifted forward to the end of the gap.
+    """
+    if isinstance(wall_clock, np.ndarray) and np.issubdtype(
+        wall_clock.dtype, np.integer
+    ):
+        wall_clock = pd.to_datetime(wall_clock.astype(np.int64), unit="s")
+    wall_clock = pd.DatetimeIndex(wall_clock)
+    datetime_local = wall_clock.tz_localize(
+        resolve_time_zone(local_time_zone),
+        ambiguous=np.ones(len(wall_clock), dtype=bool),
+        nonexistent="shift_forward",
+    )
+    return (
+        datetime_local.tz_convert("UTC")
+        .tz_localize(None)
+        .to_numpy(dtype="datetime64[s]")
+        .astype(np.int64)
+    )
+
+
+def time_features(timestamp, local_time_zone=None, *, datetime_local=None) -> dict:
+    """
+    Local time features of epoch timestamps (in seconds), see module docstring.
+    If no time zone is given, the local time zone of the system is used. If the
+    local datetimes of the timestamps are already known (`local_datetime`), they
+    can be passed as `datetime_local` to avoid a second conversion.
+    """
+    timestamp = np.asarray(timestamp, dtype=np.int64)
+    if datetime_local is None:
+        datetime_local = local_datetime(timestamp, local_time_zone)
+
+    # Local wall-clock time, in seconds since 1970-01-01 (local):
+    wall = wall_clock_seconds(datetime_local)
+
+    second_of_day = np.mod(wall, 86400)
+    day = np.floor_divide(wall, 86400)
+    second_of_hour = np.mod(second_of_day, 3600)
+    weekday = np.mod(day + _weekday_epoch, 7).astype(np.int8)
+
+    return {
+        "utc_offset": (wall - timestamp).astype(np.int32),
+        "weekday": weekday,
+        "weekend": 5 <= weekday,
+        "daytime": second_of_day / 3600.0,
+        "hour": np.floor_divide(second_of_day, 3600).astype(np.int8),
+        "minute": np.floor_divide(second_of_hour, 60).astype(np.int8),
+        "hour_start": timestamp - second_of_hour,
+        "day": day.astype(np.int32),
+    }
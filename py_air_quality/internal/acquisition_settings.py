@@ -0,0 +1,125 @@
+"""
+Light-weight settings for the measurement scripts.
+
+Reads the same `.env` file and environment variables as `settings.py`, but only
+uses the standard library. Importing pydantic (and python-dotenv) costs more
+than the rest of a measurement run's imports together, which matters on a
+Raspberry Pi Zero when a script is started every few minutes.
+
+Only the settings needed for acquisition are read; keep the names, types and
+defaults in line with `settings.Settings`. As with `load_dotenv`, variables that
+are already set in the environment take precedence over the `.env` file.
+
+"""
+
+import os
+
+# Directory of the `.env` file read by `settings.py`:
+_internal_directory = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_dotenv(path: str) -> dict:
+    """
+    Parse a `.env` file (`KEY=value` per line; optional `export` prefix,
+    quotes, and comments). Returns an empty dictionary if the file does not
+    exist.
+    """
+    values = {}
+    try:
+        with open(path) as file:
+            lines = file.read().splitlines()
+    except OSError:
+        return values
+    for line in lines:
+        line = line.strip()
+        if line.startswith("export "):
+            line = line[len("export ") :].lstrip()
+        if (not line) or line.startswith("#") or ("=" not in line):
+            continue
+        key, value = line.split("=", 1)
+        key = key.strip()
+        value = value.strip()
+        if value[:1] in ("'", '"') and value[:1] in value[1:]:
+            # Quoted value (everything after the closing quote is ignored):
+            value = value[1 : value.index(value[0], 1)]
+        elif " #" in value:
+            # Inline comment:
+            value = value.split(" #", 1)[0].rstrip()
+        values[key] = value
+    return values
+
+
+def _dotenv_paths():
+    """
+    The `.env` files loaded by `settings.py`: the one next to it, then the
+    first one found in the parent directories (like `find_dotenv`).
+    """
+    paths = [os.path.join(_internal_directory, ".env")]
+    directory = _internal_directory
+    while True:
+        path = os.path.join(directory, ".env")
+        if os.path.isfile(path):
+            paths.append(path)
+            break
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            break
+        directory = parent
+    return paths
+
+
+class AcquisitionSettings:
+    """
+    Settings of the measurement scripts (subset of `settings.Settings`).
+
+    Raises a `ValueError` if a setting without default is missing, or cannot be
+    converted to its type.
+    """
+
+    EXPERIMENTAL_CONDITION: str
+    DATA_DIRECTORY: str
+    MEASUREMENT_LOCATION: str
+    SENSOR_TYPE: str
+
+    NOTIFY_ADDRESSES: str = "127.0.0.1:8765,127.0.0.1:8766"
+    ALERTS: str = ""
+
+    SAMPLING_MIN_SECONDS: float = 5.0
+    SAMPLING_MAX_SECONDS: float = 60.0
+    SAMPLING_GROWTH: float = 1.5
+    SAMPLING_CHANGE_ABSOLUTE: float = 2.0
+    SAMPLING_CHANGE_RELATIVE: float = 0.2
+    SAMPLING_WARMUP_SECONDS: float = 30.0
+
+    def __init__(self, environ=None):
+        if environ is None:
+            environ = dict(os.environ)
+            for path in _dotenv_paths():
+                for key, value in read_dotenv(path).items():
+                    environ.setdefault(key, value)
+
+        for name, type_ in self.__annotations__.items():
+            if name in environ:
+                try:
+                    value = type_(environ[name])
+                except ValueError:
+                    msg = "Invalid value for setting {}: {!r}".format(
+                        name, environ[name]
+                    )
+                    raise ValueError(msg)
+            elif hasattr(type(self), name):
+                value = getattr(type(self), name)
+            else:
+                raise ValueError("Missing setting: {}".format(name))
+            setattr(self, name, value)
+
+
+_settings = None
+
+
+def get_settings() -> AcquisitionSettings:
+    """Settings, read from the environment and `.env` file on first use."""
+    global _settings
+    if _settings is None:
+        _settings = AcquisitionSettings()
+    return _settings
@@ -0,0 +1,154 @@
+"""
+Least-recently-used cache for rendered plots, bounded in memory and on disk.
+
+Artifacts are stored on disk as `<key>.<etag>.png`, where the key is the hash of
+the render job inputs (see `py_air_quality.internal.content_hash.job_key`),
+and the ETag is the hash of the file content. The index of the disk cache
+(including ETags) is kept in memory, so conditional requests can be answered
+without reading any file.
+
+"""
+
+import os
+from collections import OrderedDict
+
+from py_air_quality.internal.content_hash import file_hash
+
+
+class ArtifactCache:
+    """
+    Two-level LRU cache (memory & disk) for rendered artifacts.
+    """
+
+    def __init__(
+        self,
+        cache_directory: str,
+        max_memory_bytes: int = 32 * 1024**2,
+        max_disk_bytes: int = 256 * 1024**2,
+        suffix: str = ".png",
+    ):
+        self.cache_directory = cache_directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.suffix = suffix
+
+        # Artifact content held in memory, by key (least recently used first):
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+
+        # Disk index: key -> (etag, size), least recently used first:
+        self.disk = OrderedDict()
+        self.disk_bytes = 0
+
+        os.makedirs(cache_directory, exist_ok=True)
+
+        # Rebuild the disk index from the file names, ordered by modification
+        # time (which is updated on access).
+        entries = []
+        for file_name in os.listdir(cache_directory):
+            if not file_name.endswith(suffix):
+                continue
+            path_file = os.path.join(cache_directory, file_name)
+            key_etag = file_name[: -len(suffix)].split(".")
+            if len(key_etag) != 2:
+                # Incomplete write from a previous process:
+                os.remove(path_file)
+                continue
+            stat = os.stat(path_file)
+            entries.append((stat.st_mtime, key_etag[0], key_etag[1], stat.st_size))
+
+        for _, key, etag, size in sorted(entries):
+            self.disk[key] = (etag, size)
+            self.disk_bytes += size
+
+        self._evict()
+
+    def path(self, key: str, etag: str) -> str:
+        """Path of a cached artifact on disk."""
+        return os.path.join(
+            self.cache_directory, "{}.{}{}".format(key, etag, self.suffix)
+        )
+
+    def path_tmp(self, key: str) -> str:
+        """Path where a new artifact should be written before calling `add`."""
+        # Unique per process, in case several processes share the directory:
+        return os.path.join(
+            self.cache_directory, "{}-{}{}".format(key, os.getpid(), self.suffix)
+        )
+
+    def etag(self, key: str):
+        """ETag of a cached artifact (None if not cached)."""
+        entry = self.disk.get(key)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def get(self, key: str):
+        """Content of a cached artifact (None if not cached)."""
+        entry = self.disk.get(key)
+        if entry is None:
+            return None
+        etag, _ = entry
+        self.disk.move_to_end(key)
+
+        content = self.memory.get(key)
+        if content is not None:
+            self.memory.move_to_end(key)
+            return content
+
+        path_file = self.path(key, etag)
+        try:
+            with open(path_file, "rb") as file:
+                content = file.read()
+            os.utime(path_file)
+        except FileNotFoundError:
+            # Removed by another process:
+            self._remove(key)
+            return None
+
+        self._add_to_memory(key, content)
+        return content
+
+    def add(self, key: str):
+        """
+        Add an artifact that has been written to `path_tmp(key)`.
+
+        Returns the ETag of the artifact.
+        """
+        path_tmp = self.path_tmp(key)
+        etag = file_hash(path_tmp)
+        size = os.path.getsize(path_tmp)
+
+        if key in self.disk:
+            self._remove(key)
+
+        os.replace(path_tmp, self.path(key, etag))
+        self.disk[key] = (etag, size)
+        self.disk_bytes += size
+
+        self._evict()
+        return etag
+
+    def _add_to_memory(self, key: str, content: bytes):
+        if self.max_memory_bytes < len(content):
+            return
+        self.memory[key] = content
+        self.memory_bytes += len(content)
+        while self.max_memory_bytes < self.memory_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def _remove(self, key: str):
+        etag, size = self.disk.pop(key)
+        self.disk_bytes -= size
+        content = self.memory.pop(key, None)
+        if content is not None:
+            self.memory_bytes -= len(content)
+        try:
+            os.remove(self.path(key, etag))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        while self.disk and (self.max_disk_bytes < self.disk_bytes):
+            self._remove(next(iter(self.disk)))
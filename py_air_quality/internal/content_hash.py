@@ -0,0 +1,26 @@
+"""
+Content hashes, used as cache keys and ETags (render jobs, map tiles, mobile
+sessions).
+
+A job is identified by a hash of its inputs (e.g. data high-water mark, window
+bounds, view), and an artifact by a hash of its content.
+
+"""
+
+import hashlib
+import json
+
+
+def job_key(**inputs) -> str:
+    """Hash the inputs of a job (any json-serialisable values)."""
+    serialised = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(serialised.encode("utf-8")).hexdigest()
+
+
+def file_hash(path: str) -> str:
+    """Hash the content of a file."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(65536), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
@@ -0,0 +1,341 @@
+"""
+Lightweight pipeline metrics: counters, gauges and latency histograms.
+
+Metrics are collected in a `Registry`, and exported in the Prometheus text
+format, either via the `/metrics` route of `server.py`, or (for the cron
+scripts) by writing a file that can be picked up by the textfile collector of
+the Prometheus node exporter, e.g.:
+
+```
+registry = Registry(script="commit_to_db")
+with registry.time_stage("csv_parse"):
+    df = read_csv_data(path_csv)
+registry.write_textfile(path_metrics)
+```
+
+Every registry has a histogram of stage durations (`time_stage`), a counter of
+failed stages, and a gauge with the time of the last successful run. Counters
+of the cron scripts only count within one run (each run overwrites its file).
+
+When profiling is enabled (see `profiling`), the stage durations are also
+recorded as profiling sections.
+
+Only uses the standard library, so that the measurement scripts stay light.
+
+"""
+
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from py_air_quality.internal import profiling
+
+# Prefix of all metric names:
+namespace = "py_air_quality"
+
+# Default histogram buckets, in seconds (from database round trips to sensor
+# stabilisation):
+default_buckets = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+# Buckets for the age of data (from measurement to database or plot), in
+# seconds (from event-driven updates to cron jobs):
+freshness_buckets = (
+    0.5,
+    1.0,
+    2.0,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+    600.0,
+    1800.0,
+    3600.0,
+)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if 0 < value else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels) -> str:
+    """Labels as `{name="value",...}` (empty string if there are no labels)."""
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(x, _escape(y)) for x, y in labels) + "}"
+
+
+class _Metric:
+    """
+    Base class of metrics with a fixed set of label names.
+    """
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=(), const_labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.const_labels = tuple(const_labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels: dict):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                "Metric {} expects labels {}, got {}.".format(
+                    self.name, self.labelnames, tuple(labels)
+                )
+            )
+        return tuple(str(labels[x]) for x in self.labelnames)
+
+    def _labels(self, key, extra=()):
+        return self.const_labels + tuple(zip(self.labelnames, key)) + tuple(extra)
+
+    def _samples(self):
+        """(suffix, labels, value) of each sample."""
+        raise NotImplementedError
+
+    def expose(self) -> str:
+        """Metric in the Prometheus text format."""
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation.replace("\n", " ")),
+            "# TYPE {} {}".format(self.name, self.type_name),
+        ]
+        with self.lock:
+            samples = list(self._samples())
+        for suffix, labels, value in samples:
+            lines.append(
+                "{}{}{} {}".format(
+                    self.name, suffix, _format_labels(labels), _format_value(value)
+                )
+            )
+        return "\n".join(lines) + "\n"
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count (e.g. number of readings).
+    """
+
+    type_name = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only be increased.")
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def _samples(self):
+        for key, value in self.values.items():
+            yield "", self._labels(key), value
+
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down (e.g. last timestamp, queue length).
+    """
+
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self):
+        for key, value in self.values.items():
+            yield "", self._labels(key), value
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values (e.g. latencies), in cumulative buckets.
+    """
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames=(),
+        const_labels=(),
+        buckets=default_buckets,
+    ):
+        super().__init__(name, documentation, labelnames, const_labels)
+        self.buckets = tuple(sorted(float(x) for x in buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            if key not in self.values:
+                # Count per bucket (not cumulative), sum, and total count:
+                self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            bucket_counts, _, _ = self.values[key]
+            # First bucket whose upper bound is at least the value:
+            bucket_counts[bisect_left(self.buckets, value)] += 1
+            self.values[key][1] += value
+            self.values[key][2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the `with` block, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        for key, (bucket_counts, total, count) in self.values.items():
+            cumulative = 0
+            for upper, bucket_count in zip(self.buckets + (math.inf,), bucket_counts):
+                cumulative += bucket_count
+                yield "_bucket", self._labels(
+                    key, (("le", _format_value(upper)),)
+                ), cumulative
+            yield "_sum", self._labels(key), total
+            yield "_count", self._labels(key), count
+
+
+class Registry:
+    """
+    Collection of metrics of one process.
+
+    Keyword arguments are added as labels to all metrics (e.g. the name of the
+    script, so that the files of several cron scripts can be told apart).
+    """
+
+    def __init__(self, **const_labels):
+        self.const_labels = tuple(sorted((x, str(y)) for x, y in const_labels.items()))
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+        self.stage_seconds = self.histogram(
+            "stage_seconds", "Duration of pipeline stages.", ["stage"]
+        )
+        self.stage_failures = self.counter(
+            "stage_failures_total",
+            "Number of pipeline stages that raised an exception.",
+            ["stage"],
+        )
+        self.last_success = self.gauge(
+            "last_success_timestamp_seconds",
+            "Time of the last successful run (epoch seconds).",
+        )
+
+    def _register(self, cls, name: str, documentation: str, labelnames, **kwargs):
+        name = "{}_{}".format(namespace, name)
+        with self.lock:
+            if name in self.metrics:
+                metric = self.metrics[name]
+                if (type(metric) is not cls) or (
+                    metric.labelnames != tuple(labelnames)
+                ):
+                    raise ValueError("Metric {} already registered.".format(name))
+                return metric
+            metric = cls(
+                name,
+                documentation,
+                labelnames=labelnames,
+                const_labels=self.const_labels,
+                **kwargs
+            )
+            self.metrics[name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(
+        self, name: str, documentation: str, labelnames=(), buckets=default_buckets
+    ) -> Histogram:
+        return self._register(
+            Histogram, name, documentation, labelnames, buckets=buckets
+        )
+
+    @contextmanager
+    def time_stage(self, stage: str):
+        """Record the duration of a pipeline stage (and count failures)."""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.stage_failures.inc(stage=stage)
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            self.stage_seconds.observe(duration, stage=stage)
+            profiling.record_section(stage, duration)
+
+    def mark_success(self):
+        """Set the time of the last successful run to now."""
+        self.last_success.set(time.time())
+
+    def expose(self) -> str:
+        """All metrics in the Prometheus text format."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "".join(x.expose() for x in metrics)
+
+    def write_textfile(self, path: str):
+        """
+        Write all metrics to a file (replaced atomically, so that a collector
+        never reads a partial file). Errors are ignored, so that metrics never
+        fail the pipeline.
+        """
+        path_tmp = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path_tmp, "w") as file:
+                file.write(self.expose())
+            os.replace(path_tmp, path)
+        except OSError:
+            try:
+                os.remove(path_tmp)
+            except OSError:
+                pass
+
+
+def textfile_path(directory: str, script: str) -> str:
+    """Path of the metrics file of a script (`<directory>/metrics/<script>.prom`)."""
+    return os.path.join(directory, "metrics", "{}.prom".format(script))
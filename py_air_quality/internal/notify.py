@@ -0,0 +1,105 @@
+"""
+Local notifications about new measurements.
+
+After writing a reading to the csv file, the measurement scripts send a small
+json message as UDP datagram to each configured address (e.g. the server, see
+`NOTIFY_ADDRESSES` in the `.env` file). Sending never blocks and never fails
+the measurement; if nobody is listening, the message is lost.
+
+Only uses the standard library, so that the measurement scripts stay light.
+
+"""
+
+import json
+import socket
+
+
+def parse_addresses(addresses: str):
+    """Parse comma-separated 'host:port' pairs."""
+    parsed = []
+    for address in addresses.split(","):
+        address = address.strip()
+        if not address:
+            continue
+        host, port = address.rsplit(":", 1)
+        parsed.append((host, int(port)))
+    return parsed
+
+
+class Notifier:
+    """
+    Send notifications as UDP datagrams to a list of addresses.
+    """
+
+    def __init__(self, addresses: str):
+        self.addresses = parse_addresses(addresses)
+        self.socket = None
+        if self.addresses:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket.setblocking(False)
+
+    def send(self, message: dict):
+        """Send message to all addresses (errors are ignored)."""
+        if self.socket is None:
+            return
+        datagram = json.dumps(message).encode("utf-8")
+        for address in self.addresses:
+            try:
+                self.socket.sendto(datagram, address)
+            except OSError:
+                pass
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+
+def reading_message(
+    *,
+    experimental_condition: str,
+    measurement_location: str,
+    timestamp: int,
+    pm25,
+    pm10,
+    interval=None,
+):
+    """
+    Message announcing a new reading (pm25 & pm10 may be None), optionally with
+    the time since the previous reading (seconds, see
+    `py_air_quality/measurement/adaptive_sampling.py`).
+    """
+    return {
+        "type": "reading",
+        "experimental_condition": experimental_condition,
+        "measurement_location": measurement_location,
+        "timestamp": timestamp,
+        "pm25": pm25,
+        "pm10": pm10,
+        "interval": interval,
+    }
+
+
+def geotagged_message(
+    *,
+    experimental_condition: str,
+    measurement_location: str,
+    timestamp_gps: int,
+    latitude: float,
+    longitude: float,
+    timestamp_air: int,
+    pm25,
+    pm10,
+):
+    """Message announcing a reading joined with a GPS fix (mobile session)."""
+    return {
+        "type": "geotagged",
+        "experimental_condition": experimental_condition,
+        "measurement_location": measurement_location,
+        "timestamp": timestamp_gps,
+        "latitude": latitude,
+        "longitude": longitude,
+        "timestamp_air": timestamp_air,
+        "pm25": pm25,
+        "pm10": pm10,
+    }
@@ -0,0 +1,270 @@
+"""
+Opt-in profiling of the scripts.
+
+Profiling is enabled with the environment variable `PY_AIR_QUALITY_PROFILE`, or
+with the `--profile` command line flag, e.g.:
+
+```
+PY_AIR_QUALITY_PROFILE=1 python commit_to_db.py
+PY_AIR_QUALITY_PROFILE=cprofile,sections python commit_to_db.py
+python commit_to_db.py --profile
+```
+
+The variable can be `1` (all profilers), or a comma-separated selection of
+`cprofile`, `tracemalloc` and `sections`. When the script exits, timestamped
+files are written to a `profiles` directory (e.g. in `DATA_DIRECTORY`):
+- `<script>_<time>.prof`: cProfile stats (e.g. for `snakeviz` or `pstats`)
+- `<script>_<time>_cprofile.txt`: functions with the highest cumulative time
+- `<script>_<time>_tracemalloc.txt`: lines with the largest allocations
+- `<script>_<time>_sections.txt`: wall-clock time per named section
+
+The wall-clock report lists consecutive parts of a script (started with `mark`),
+and sections (blocks of code timed with `section`). The stages timed with
+`metrics.Registry.time_stage` are recorded as sections as well.
+
+When profiling is disabled, `mark`, `section` and `record_section` only check
+a global variable, and the profilers are not imported. Only uses the standard
+library.
+
+"""
+
+import atexit
+import os
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import Optional
+
+# Environment variable that enables profiling:
+environment_variable = "PY_AIR_QUALITY_PROFILE"
+
+# Command line flag that enables profiling (all profilers):
+command_line_flag = "--profile"
+
+all_modes = ("cprofile", "tracemalloc", "sections")
+
+# Number of entries in the text reports:
+n_top = 40
+
+# Profiler of the running script (None if profiling is disabled):
+_active = None
+
+_null_context = nullcontext()
+
+
+def requested_modes(argv=None):
+    """Profilers requested via environment variable or command line flag."""
+    argv = sys.argv if argv is None else argv
+    if command_line_flag in argv:
+        return all_modes
+    value = os.environ.get(environment_variable, "").strip().lower()
+    if value in ("", "0", "false", "no", "off"):
+        return ()
+    if value in ("1", "true", "yes", "on", "all"):
+        return all_modes
+    modes = tuple(x.strip() for x in value.split(",") if x.strip())
+    unknown = [x for x in modes if x not in all_modes]
+    if unknown:
+        # Never fail the measurement because of a typo:
+        msg = "Ignoring unknown profiling mode(s) in {}: {} (available: {})."
+        print(
+            msg.format(environment_variable, ", ".join(unknown), ", ".join(all_modes)),
+            file=sys.stderr,
+        )
+    return tuple(x for x in modes if x in all_modes)
+
+
+class Profiler:
+    """
+    Collect cProfile stats, allocations and section timings of one run.
+    """
+
+    def __init__(self, name: str, output_directory: str, modes=all_modes):
+        self.name = name
+        self.output_directory = os.path.join(output_directory, "profiles")
+        self.modes = tuple(modes)
+        self.profile = None
+        # Calls, total, and maximum duration per section, and per consecutive
+        # part of the script (see `mark`), in seconds:
+        self.sections = {}
+        self.parts = {}
+        self.current_mark = None
+        self.start_time = None
+        self.start_datetime = None
+
+    def start(self):
+        self.start_datetime = datetime.now()
+        self.start_time = time.perf_counter()
+        if "tracemalloc" in self.modes:
+            import tracemalloc
+
+            tracemalloc.start()
+        if "cprofile" in self.modes:
+            import cProfile
+
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    @staticmethod
+    def _add(timings: dict, name: str, seconds: float):
+        calls, total, maximum = timings.get(name, (0, 0.0, 0.0))
+        timings[name] = (calls + 1, total + seconds, max(maximum, seconds))
+
+    def record(self, name: str, seconds: float):
+        """Add the duration of one execution of a section."""
+        self._add(self.sections, name, seconds)
+
+    def mark(self, name: Optional[str]):
+        """End the current part of the script (if any), and start a new one."""
+        now = time.perf_counter()
+        if self.current_mark is not None:
+            self._add(self.parts, self.current_mark[0], now - self.current_mark[1])
+        self.current_mark = None if name is None else (name, now)
+
+    @contextmanager
+    def section(self, name: str):
+        """Record the wall-clock time of the `with` block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def stop(self):
+        """Stop profiling, and write the reports. Returns the paths of the files."""
+        if self.start_time is None:
+            return []
+        if self.profile is not None:
+            self.profile.disable()
+        self.mark(None)
+        wall_time = time.perf_counter() - self.start_time
+        self.start_time = None
+
+        os.makedirs(self.output_directory, exist_ok=True)
+        prefix = os.path.join(
+            self.output_directory,
+            "{}_{}".format(self.name, self.start_datetime.strftime("%Y%m%dT%H%M%S")),
+        )
+        paths = []
+
+        if self.profile is not None:
+            import io
+            import pstats
+
+            self.profile.dump_stats(prefix + ".prof")
+            paths.append(prefix + ".prof")
+            report = io.StringIO()
+            stats = pstats.Stats(self.profile, stream=report)
+            stats.sort_stats("cumulative").print_stats(n_top)
+            paths.append(self._write(prefix + "_cprofile.txt", report.getvalue()))
+
+        if "tracemalloc" in self.modes:
+            import tracemalloc
+
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            lines = [
+                "Traced memory: current {:.1f} MiB, peak {:.1f} MiB".format(
+                    current / 1024**2, peak / 1024**2
+                ),
+                "",
+                "Top {} allocations by line (still allocated at exit):".format(n_top),
+            ]
+            for stat in snapshot.statistics("lineno")[:n_top]:
+                lines.append(str(stat))
+            paths.append(
+                self._write(prefix + "_tracemalloc.txt", "\n".join(lines) + "\n")
+            )
+
+        if "sections" in self.modes:
+            lines = ["Wall time: {:.3f} s".format(wall_time)]
+            tables = [
+                ("Parts of the script (consecutive):", self.parts),
+                ("Sections (can be nested or repeated):", self.sections),
+            ]
+            for title, timings in tables:
+                if not timings:
+                    continue
+                lines.extend(["", title, self._format_header()])
+                for name, timing in sorted(timings.items(), key=lambda x: -x[1][1]):
+                    lines.append(self._format_timing(name, timing, wall_time))
+            paths.append(self._write(prefix + "_sections.txt", "\n".join(lines) + "\n"))
+
+        return paths
+
+    @staticmethod
+    def _format_header() -> str:
+        return "{:<32} {:>8} {:>12} {:>12} {:>12} {:>8}".format(
+            "name", "calls", "total [s]", "mean [s]", "max [s]", "share"
+        )
+
+    @staticmethod
+    def _format_timing(name: str, timing, wall_time: float) -> str:
+        calls, total, maximum = timing
+        return "{:<32} {:>8} {:>12.4f} {:>12.4f} {:>12.4f} {:>7.1f}%".format(
+            name,
+            calls,
+            total,
+            total / calls,
+            maximum,
+            100.0 * total / wall_time if 0 < wall_time else 0.0,
+        )
+
+    @staticmethod
+    def _write(path: str, text: str) -> str:
+        with open(path, "w") as file:
+            file.write(text)
+        return path
+
+
+def start(name: str, output_directory: str, argv=None) -> Optional[Profiler]:
+    """
+    Start profiling the running script if requested (see module docstring).
+
+    The reports are written when the script exits. Returns the profiler, or
+    None if profiling is disabled.
+    """
+    global _active
+    modes = requested_modes(argv)
+    if not modes:
+        return None
+    if _active is not None:
+        return _active
+    _active = Profiler(name, output_directory, modes)
+    _active.start()
+    atexit.register(stop)
+    return _active
+
+
+def stop():
+    """Stop profiling and write the reports (called automatically at exit)."""
+    global _active
+    if _active is None:
+        return []
+    profiler = _active
+    _active = None
+    paths = profiler.stop()
+    for path in paths:
+        print("Profile written to {}".format(path))
+    return paths
+
+
+def mark(name: str):
+    """Start a new part of the script (ends the previous one)."""
+    if _active is not None:
+        _active.mark(name)
+
+
+def section(name: str):
+    """Context manager recording the wall-clock time of a block of code."""
+    if _active is None:
+        return _null_context
+    return _active.section(name)
+
+
+def record_section(name: str, seconds: float):
+    """Add a duration measured elsewhere (e.g. by the metrics) to a section."""
+    if _active is not None:
+        _active.record(name, seconds)
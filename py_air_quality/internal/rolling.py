@@ -0,0 +1,358 @@
+"""
+Streaming rolling statistics of live readings, and threshold alerts.
+
+Statistics are updated with each reading in O(1) (amortised) time, without
+keeping more than the readings inside the longest window:
+- `RollingWindow`: count, mean, variance (weighted Welford's algorithm, with
+  removal of expired readings), min & max (monotonic deques) over a time window,
+  e.g. the last hour
+- `Ewma`: exponentially weighted moving average with a half-life in seconds
+  (for irregular sampling intervals)
+- `ThresholdAlert`: e.g. "pm25 1-hour mean above 25", with events when the
+  condition starts and stops to hold
+- `RollingStatistics`: windows & EWMA for each pollutant, and alerts
+
+Alerts are configured with the `ALERTS` setting in the `.env` file, as comma
+separated `<pollutant>:<window seconds>:<statistic><operator><threshold>`, e.g.
+`pm25:3600:mean>25,pm10:86400:mean>50` (statistics: mean, min, max, std, ewma;
+operators: `>`, `<`).
+
+Statistics are weighted by time, so that a burst of readings at a short
+interval (e.g. during an event, see
+`py_air_quality/measurement/adaptive_sampling.py`) does not dominate them, and
+alerts depend on the concentration, not on the sampling rate: mean & variance
+are weighted by the sampling interval of each reading (the time that it stands
+for), and the weight of a reading in the EWMA depends on the time since the
+previous reading.
+
+Only uses the standard library, so that the measurement scripts stay light.
+
+"""
+
+import math
+from collections import deque
+
+# Default windows, in seconds (5 minutes, 1 hour, 24 hours):
+default_windows = (300, 3600, 86400)
+
+# Default half-life of the EWMA, in seconds:
+default_half_life = 300.0
+
+# Readings without sampling interval are weighted by the time since the previous
+# reading, at most this long (seconds; see
+# `py_air_quality.crud.read_csv_data.interval_weights`):
+default_max_interval = 60.0
+
+# Statistics that alerts can refer to:
+alert_statistics = ("mean", "min", "max", "std", "ewma")
+
+
+def _is_valid(value) -> bool:
+    return (value is not None) and (not math.isnan(value))
+
+
+class RollingWindow:
+    """
+    Statistics of the readings of the last `seconds` seconds.
+
+    Readings need to be added in chronological order. A reading with timestamp
+    `t` is inside the window while `now - seconds < t`. Mean and variance are
+    weighted (e.g. by sampling interval); `count` is the number of readings.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.readings = deque()
+        # Candidates for the min & max (values are monotonic):
+        self.min_candidates = deque()
+        self.max_candidates = deque()
+        # Weighted Welford's algorithm:
+        self.count = 0
+        self.weight = 0.0
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, timestamp: float, value: float, weight: float = 1.0):
+        """Add a reading (and remove expired readings)."""
+        self.expire(timestamp)
+        self.readings.append((timestamp, value, weight))
+
+        self.count += 1
+        self.weight += weight
+        delta = value - self._mean
+        self._mean += delta * weight / self.weight
+        self._m2 += weight * delta * (value - self._mean)
+
+        while self.min_candidates and (value <= self.min_candidates[-1][1]):
+            self.min_candidates.pop()
+        self.min_candidates.append((timestamp, value))
+        while self.max_candidates and (self.max_candidates[-1][1] <= value):
+            self.max_candidates.pop()
+        self.max_candidates.append((timestamp, value))
+
+    def expire(self, now: float):
+        """Remove readings that are no longer inside the window."""
+        limit = now - self.seconds
+        while self.readings and (self.readings[0][0] <= limit):
+            _, value, weight = self.readings.popleft()
+            self.count -= 1
+            self.weight -= weight
+            if self.count == 0:
+                self.weight = 0.0
+                self._mean = 0.0
+                self._m2 = 0.0
+            else:
+                mean_previous = self._mean
+                self._mean -= (value - self._mean) * weight / self.weight
+                self._m2 -= weight * (value - mean_previous) * (value - self._mean)
+                self._m2 = max(self._m2, 0.0)
+        while self.min_candidates and (self.min_candidates[0][0] <= limit):
+            self.min_candidates.popleft()
+        while self.max_candidates and (self.max_candidates[0][0] <= limit):
+            self.max_candidates.popleft()
+
+    @property
+    def mean(self):
+        return self._mean if self.count else None
+
+    @property
+    def variance(self):
+        """
+        Weighted sample variance (None for less than two readings; the sample
+        variance for equal weights).
+        """
+        if self.count < 2:
+            return None
+        return self._m2 / self.weight * self.count / (self.count - 1)
+
+    @property
+    def std(self):
+        variance = self.variance
+        return math.sqrt(variance) if variance is not None else None
+
+    @property
+    def min(self):
+        return self.min_candidates[0][1] if self.min_candidates else None
+
+    @property
+    def max(self):
+        return self.max_candidates[0][1] if self.max_candidates else None
+
+    @property
+    def coverage(self) -> float:
+        """Time span of the readings, relative to the window length."""
+        if not self.readings:
+            return 0.0
+        return (self.readings[-1][0] - self.readings[0][0]) / self.seconds
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "std": self.std,
+            "min": self.min,
+            "max": self.max,
+        }
+
+
+class Ewma:
+    """
+    Exponentially weighted moving average; the weight of a reading halves
+    every `half_life` seconds.
+    """
+
+    def __init__(self, half_life: float = default_half_life):
+        self.half_life = half_life
+        self.value = None
+        self.timestamp = None
+
+    def add(self, timestamp: float, value: float):
+        if self.value is None:
+            self.value = value
+        else:
+            elapsed = max(timestamp - self.timestamp, 0.0)
+            alpha = 1.0 - math.pow(0.5, elapsed / self.half_life)
+            self.value += alpha * (value - self.value)
+        self.timestamp = timestamp
+
+
+class ThresholdAlert:
+    """
+    Alert when a rolling statistic of a pollutant is above (or below) a
+    threshold. The statistic is only evaluated once the readings span at least
+    `min_coverage` of the window (e.g. not on the first reading of a 1-hour
+    mean).
+    """
+
+    def __init__(
+        self,
+        *,
+        pollutant: str,
+        seconds: float,
+        statistic: str,
+        operator: str,
+        threshold: float,
+        min_coverage: float = 0.5,
+    ):
+        if statistic not in alert_statistics:
+            raise ValueError("Unknown statistic: {}".format(statistic))
+        if operator not in (">", "<"):
+            raise ValueError("Unknown operator: {}".format(operator))
+        self.pollutant = pollutant
+        self.seconds = seconds
+        self.statistic = statistic
+        self.operator = operator
+        self.threshold = threshold
+        self.min_coverage = min_coverage
+        self.active = False
+
+    @property
+    def name(self) -> str:
+        return "{}:{:g}:{}{}{:g}".format(
+            self.pollutant, self.seconds, self.statistic, self.operator, self.threshold
+        )
+
+    def evaluate(self, value):
+        """
+        Update the state with the current value of the statistic. Returns
+        'alert' or 'clear' if the state changed, else None.
+        """
+        if value is None:
+            return None
+        if self.operator == ">":
+            active = self.threshold < value
+        else:
+            active = value < self.threshold
+        if active == self.active:
+            return None
+        self.active = active
+        return "alert" if active else "clear"
+
+
+def parse_alerts(alerts: str):
+    """Parse the `ALERTS` setting (see module docstring)."""
+    parsed = []
+    for alert in alerts.split(","):
+        alert = alert.strip()
+        if not alert:
+            continue
+        try:
+            pollutant, seconds, condition = alert.split(":")
+            operator = ">" if ">" in condition else "<"
+            statistic, threshold = condition.split(operator)
+            parsed.append(
+                ThresholdAlert(
+                    pollutant=pollutant.strip(),
+                    seconds=float(seconds),
+                    statistic=statistic.strip(),
+                    operator=operator,
+                    threshold=float(threshold),
+                )
+            )
+        except ValueError:
+            raise ValueError("Invalid alert: {!r}".format(alert))
+    return parsed
+
+
+class RollingStatistics:
+    """
+    Rolling windows and EWMA for each pollutant, and threshold alerts
+    (time-weighted, see module docstring).
+    """
+
+    def __init__(
+        self,
+        *,
+        pollutants=("pm25", "pm10"),
+        windows=default_windows,
+        half_life: float = default_half_life,
+        max_interval: float = default_max_interval,
+        alerts=(),
+    ):
+        self.max_interval = max_interval
+        self.alerts = list(alerts)
+        # Windows needed for the alerts are added to the requested ones:
+        seconds = sorted(set(windows) | {x.seconds for x in self.alerts})
+        self.windows = {
+            pollutant: {x: RollingWindow(x) for x in seconds}
+            for pollutant in pollutants
+        }
+        self.ewma = {pollutant: Ewma(half_life) for pollutant in pollutants}
+        self.timestamp = None
+
+    def _interval(self, timestamp: float, interval) -> float:
+        """
+        Time that a reading stands for (seconds, at least one): its sampling
+        interval, or the time since the previous reading (at most
+        `max_interval`) if the interval is unknown.
+        """
+        if not _is_valid(interval):
+            if self.timestamp is None:
+                return 1.0
+            interval = min(timestamp - self.timestamp, self.max_interval)
+        return max(interval, 1.0)
+
+    def update(self, timestamp: float, interval=None, **values):
+        """
+        Add a reading (e.g. `update(t, pm25=3.2, pm10=5.1)`; missing values
+        may be None), optionally with its sampling interval in seconds (the
+        time since the previous reading). Returns the alert events caused by
+        this reading, as list of dictionaries.
+        """
+        interval = self._interval(timestamp, interval)
+        self.timestamp = timestamp
+        for pollutant, windows in self.windows.items():
+            value = values.get(pollutant)
+            if _is_valid(value):
+                for window in windows.values():
+                    window.add(timestamp, value, interval)
+                self.ewma[pollutant].add(timestamp, value)
+            else:
+                for window in windows.values():
+                    window.expire(timestamp)
+
+        events = []
+        for alert in self.alerts:
+            if alert.pollutant not in self.windows:
+                continue
+            window = self.windows[alert.pollutant][alert.seconds]
+            if window.coverage < alert.min_coverage:
+                continue
+            if alert.statistic == "ewma":
+                value = self.ewma[alert.pollutant].value
+            else:
+                value = getattr(window, alert.statistic)
+            state = alert.evaluate(value)
+            if state is not None:
+                events.append(
+                    {
+                        "type": "alert",
+                        "state": state,
+                        "alert": alert.name,
+                        "pollutant": alert.pollutant,
+                        "timestamp": timestamp,
+                        "value": value,
+                        "threshold": alert.threshold,
+                    }
+                )
+        return events
+
+    def snapshot(self, now=None) -> dict:
+        """
+        Current statistics, by pollutant and window (in seconds), e.g.
+        `{"pm25": {"3600": {"mean": ...}, "ewma": ...}}`. Readings older than
+        the window at time `now` (default: time of the last reading) are
+        removed first.
+        """
+        if now is None:
+            now = self.timestamp
+        result = {}
+        for pollutant, windows in self.windows.items():
+            result[pollutant] = {}
+            for seconds, window in windows.items():
+                if now is not None:
+                    window.expire(now)
+                result[pollutant]["{:g}".format(seconds)] = window.snapshot()
+            result[pollutant]["ewma"] = self.ewma[pollutant].value
+        result["active_alerts"] = [x.name for x in self.alerts if x.active]
+        return result
@@ -18,5 +18,34 @@ class Settings(BaseSettings):
     MEASUREMENT_LOCATION: str
     SENSOR_TYPE: str
 
+    # On-demand plot rendering in `server.py`: number of worker processes, and
+    # size limits of the plot cache in memory & on disk:
+    RENDER_WORKERS: int = 1
+    PLOT_CACHE_MEMORY_MB: float = 32.0
+    PLOT_CACHE_DISK_MB: float = 256.0
+
+    # Live notifications about new readings: addresses ('host:port', comma
+    # separated) that the measurement scripts notify, and addresses on which
+    # `server.py` and `commit_daemon.py` listen for notifications:
+    NOTIFY_ADDRESSES: str = '127.0.0.1:8765,127.0.0.1:8766'
+    NOTIFY_LISTEN_ADDRESS: str = '127.0.0.1:8765'
+    COMMIT_LISTEN_ADDRESS: str = '127.0.0.1:8766'
+
+    # Threshold alerts on rolling statistics of the live readings (see
+    # `py_air_quality/internal/rolling.py`), e.g. 'pm25:3600:mean>25':
+    ALERTS: str = ''
+
+    # Adaptive sampling interval of `measurement_continuous.py` (see
+    # `py_air_quality/measurement/adaptive_sampling.py`): bounds of the interval
+    # (seconds), growth factor after stable readings, change between readings
+    # that counts as an event (absolute in µg/m³, or relative), and time for the
+    # sensor to stabilise after sleeping between readings:
+    SAMPLING_MIN_SECONDS: float = 5.0
+    SAMPLING_MAX_SECONDS: float = 60.0
+    SAMPLING_GROWTH: float = 1.5
+    SAMPLING_CHANGE_ABSOLUTE: float = 2.0
+    SAMPLING_CHANGE_RELATIVE: float = 0.2
+    SAMPLING_WARMUP_SECONDS: float = 30.0
+
 
 settings = Settings()
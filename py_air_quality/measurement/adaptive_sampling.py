@@ -0,0 +1,98 @@
+"""
+Adaptive sampling interval for continuous measurements.
+
+The interval between readings is shortened to `min_interval` when a reading
+differs from the previous one by more than
+`max(change_absolute, change_relative * previous reading)` (for any pollutant),
+and lengthened by a factor of `growth` after each stable reading, up to
+`max_interval`. Events (e.g. cooking, traffic) are therefore sampled densely,
+and quiet periods (e.g. nights) with few rows.
+
+If the interval is long enough, the sensor (fan & laser) sleeps between
+readings, and is woken up `warmup_seconds` before the next reading, so that the
+airflow can stabilise (duty cycling, reduces wear of the sensor).
+
+Each row of the csv file records the time since the previous reading
+(`interval` column, in seconds), i.e. the time that the reading stands for, so
+that aggregates (e.g. daily means) can be weighted by time and are not biased
+towards events. The interval is measured, not scheduled: waking up the sensor,
+or a slow reading, make it longer than the scheduled one. The first reading
+after the start of the measurement has no interval (`None`). Files written
+without adaptive sampling have no `interval` column, and their readings are
+weighted by the time between readings (see
+`py_air_quality.crud.read_csv_data.interval_weights`).
+
+The bounds and the change-detection rule are set in the `.env` file (see
+`SAMPLING_*` in `py_air_quality/internal/settings.py`); with
+`SAMPLING_MAX_SECONDS` equal to `SAMPLING_MIN_SECONDS`, the interval is fixed.
+
+Only uses the standard library (see `py_air_quality/cli.py`).
+
+"""
+
+
+class AdaptiveScheduler:
+    """Sampling interval depending on the change between readings."""
+
+    def __init__(
+        self,
+        *,
+        min_interval: float = 5.0,
+        max_interval: float = 60.0,
+        growth: float = 1.5,
+        change_absolute: float = 2.0,
+        change_relative: float = 0.2,
+        warmup_seconds: float = 30.0,
+        min_sleep_seconds: float = 10.0,
+    ):
+        if not (0.0 < min_interval <= max_interval):
+            msg = "Invalid sampling interval bounds: {} to {} s."
+            raise ValueError(msg.format(min_interval, max_interval))
+        if growth < 1.0:
+            raise ValueError("Growth factor must be at least 1, got {}.".format(growth))
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.growth = growth
+        self.change_absolute = change_absolute
+        self.change_relative = change_relative
+        self.warmup_seconds = warmup_seconds
+        self.min_sleep_seconds = min_sleep_seconds
+        self.interval = min_interval
+        # Previous valid reading of each pollutant:
+        self.previous = {}
+
+    def is_change(self, readings: dict) -> bool:
+        """Whether any reading differs from the previous one (see module docstring)."""
+        for pollutant, value in readings.items():
+            previous = self.previous.get(pollutant)
+            if (value is None) or (previous is None):
+                continue
+            threshold = max(self.change_absolute, self.change_relative * abs(previous))
+            if threshold < abs(value - previous):
+                return True
+        return False
+
+    def update(self, **readings) -> float:
+        """
+        Interval until the next reading (seconds), after a reading (e.g.
+        `update(pm25=1.2, pm10=3.4)`; failed reads are None and do not change
+        the interval).
+        """
+        valid = {k: v for k, v in readings.items() if v is not None}
+        if valid:
+            if self.is_change(valid):
+                self.interval = self.min_interval
+            elif all(k in self.previous for k in valid):
+                self.interval = min(self.interval * self.growth, self.max_interval)
+            self.previous.update(valid)
+        return self.interval
+
+    def sensor_sleep_seconds(self, interval: float) -> float:
+        """
+        How long the sensor can sleep before the next reading (zero if the
+        interval is too short for duty cycling).
+        """
+        sleep_seconds = interval - self.warmup_seconds
+        if sleep_seconds < self.min_sleep_seconds:
+            return 0.0
+        return sleep_seconds
@@ -6,6 +6,10 @@ adjust permissions for the USB port:
 
 sudo chmod -R 777 /dev/ttyUSB0
 
+Only imports light-weight modules (no pandas, numpy or pydantic), because it is
+started every few minutes, e.g. with `py-air-quality measure` (see
+`py_air_quality/cli.py`).
+
 """
 
 
@@ -16,77 +20,144 @@ from datetime import datetime, timezone
 
 from sds011 import SDS011
 
-from py_air_quality.internal.settings import settings
-
+from py_air_quality.internal import profiling
+from py_air_quality.internal.acquisition_settings import get_settings
+from py_air_quality.internal.metrics import Registry, textfile_path
+from py_air_quality.internal.notify import Notifier, reading_message
 
-# ------------------------------------------------------------------------------
-# *** Load settings from .env file
 
-# Experimental condition, e.g. 'baseline' or 'with_filter':
-experimental_condition = settings.EXPERIMENTAL_CONDITION
+def main():
+    """Take one measurement, and append it to the csv file."""
 
-# Directory where to find data, and save plots (e.g. '/home/pi/air_quality/'):
-data_directory = settings.DATA_DIRECTORY
+    # --------------------------------------------------------------------------
+    # *** Load settings from .env file
 
-# Path of csv file from which to load measurement data:
-path_csv = os.path.join(
-    data_directory,
-    'measurement_{}.csv'.format(experimental_condition)
-    )
+    settings = get_settings()
 
+    # Experimental condition, e.g. 'baseline' or 'with_filter':
+    experimental_condition = settings.EXPERIMENTAL_CONDITION
 
-# ------------------------------------------------------------------------------
-# *** Measure air quality
+    # Measurement location, e.g. 'Berlin Kreuzberg':
+    measurement_location = settings.MEASUREMENT_LOCATION
 
-try:
+    # Directory where to find data, and save plots (e.g.
+    # '/home/pi/air_quality/'):
+    data_directory = settings.DATA_DIRECTORY
 
-    # Initialise sensor:
-    sensor = SDS011('/dev/ttyUSB0', use_query_mode=True)
-    time.sleep(5)
-    sensor.sleep(sleep=False)
+    # Path of csv file from which to load measurement data:
+    path_csv = os.path.join(
+        data_directory,
+        'measurement_{}.csv'.format(experimental_condition)
+        )
 
-    # Give sensor time to stabilise:
-    time.sleep(30)
+    # Metrics of this run (e.g. for the textfile collector of the Prometheus
+    # node exporter):
+    metrics = Registry(script='measurement')
+    path_metrics = textfile_path(data_directory, 'measurement')
+    readings = metrics.counter(
+        'readings_total', 'Number of readings, by status.', ['status'])
+    reading_timestamp = metrics.gauge(
+        'reading_timestamp_seconds',
+        'Time of the last reading (epoch seconds).',
+        )
+    concentration = metrics.gauge(
+        'concentration_ug_m3', 'Last measured concentration.', ['pollutant'])
 
-    for x in range(5):
-        _, _ = sensor.query()
-        time.sleep(1)
+    # Profile the script if requested (see
+    # `py_air_quality.internal.profiling`):
+    profiling.start('measurement', data_directory)
 
-    utc_now = datetime.now(timezone.utc)
+    # --------------------------------------------------------------------------
+    # *** Measure air quality
 
-    # Get measurement:
-    pm25, pm10 = sensor.query()
+    profiling.mark('measure')
 
-    sensor.sleep(sleep=True)
+    try:
 
-except Exception:
+        # Initialise sensor:
+        with metrics.time_stage('sensor_init'):
+            sensor = SDS011('/dev/ttyUSB0', use_query_mode=True)
+            time.sleep(5)
+            sensor.sleep(sleep=False)
 
-    utc_now = datetime.now(timezone.utc)
-    pm25 = None
-    pm10 = None
+        # Give sensor time to stabilise:
+        with metrics.time_stage('sensor_stabilisation'):
+            time.sleep(30)
 
-    try:
-        sensor.sleep(sleep=True)
-    except Exception:
-        pass
+            for x in range(5):
+                _, _ = sensor.query()
+                time.sleep(1)
 
+        utc_now = datetime.now(timezone.utc)
 
-# ------------------------------------------------------------------------------
-# *** Write data to csv file
+        # Get measurement:
+        with metrics.time_stage('sensor_query'):
+            pm25, pm10 = sensor.query()
 
-utc_now_str = str(round(utc_now.timestamp()))
+        sensor.sleep(sleep=True)
 
-# If the csv file does not exist yet, create it and write first line (header):
-if not os.path.isfile(path_csv):
-    with open(path_csv, mode='w') as csv_file:
-        csv_write = csv.writer(csv_file, delimiter=',')
-        csv_write.writerow(['timestamp', 'pm25', 'pm10'])
+    except Exception:
 
-# Append new record to csv file (note the `a` flag):
-with open(path_csv, 'a') as csv_file:
-    csv_file.write((utc_now_str
-                    + ','
-                    + str(pm25)
-                    + ','
-                    + str(pm10)
-                    + '\n'))
+        utc_now = datetime.now(timezone.utc)
+        pm25 = None
+        pm10 = None
+
+        try:
+            sensor.sleep(sleep=True)
+        except Exception:
+            pass
+
+    # --------------------------------------------------------------------------
+    # *** Write data to csv file
+
+    profiling.mark('csv_write')
+
+    utc_now_str = str(round(utc_now.timestamp()))
+
+    # If the csv file does not exist yet, create it and write first line
+    # (header):
+    if not os.path.isfile(path_csv):
+        with open(path_csv, mode='w') as csv_file:
+            csv_write = csv.writer(csv_file, delimiter=',')
+            csv_write.writerow(['timestamp', 'pm25', 'pm10'])
+
+    # Append new record to csv file (note the `a` flag):
+    with metrics.time_stage('csv_write'), open(path_csv, 'a') as csv_file:
+        csv_file.write((utc_now_str
+                        + ','
+                        + str(pm25)
+                        + ','
+                        + str(pm10)
+                        + '\n'))
+
+    # --------------------------------------------------------------------------
+    # *** Notify listeners (e.g. the server) about the new reading
+
+    profiling.mark('notify')
+
+    notifier = Notifier(settings.NOTIFY_ADDRESSES)
+    notifier.send(reading_message(
+        experimental_condition=experimental_condition,
+        measurement_location=measurement_location,
+        timestamp=int(utc_now_str),
+        pm25=pm25,
+        pm10=pm10,
+        ))
+    notifier.close()
+
+    # --------------------------------------------------------------------------
+    # *** Write metrics
+
+    reading_timestamp.set(int(utc_now_str))
+    if (pm25 is None) or (pm10 is None):
+        readings.inc(status='failed')
+    else:
+        readings.inc(status='ok')
+        concentration.set(pm25, pollutant='pm25')
+        concentration.set(pm10, pollutant='pm10')
+        metrics.mark_success()
+    metrics.write_textfile(path_metrics)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,13 @@
 Continuously monitor air quality with SDS011 sensor, e.g. for mobile
 measurements.
 
+The interval between readings adapts to the readings (short when they change
+quickly, long with the sensor sleeping in between when they are stable), see
+`py_air_quality/measurement/adaptive_sampling.py`. The time since the previous
+reading is recorded in the `interval` column of new csv files. Files created
+before (without `interval` column) are sampled at a fixed interval
+(`SAMPLING_MIN_SECONDS`).
+
 Create a service unit file:
 ```
 sudo nano /etc/systemd/system/py_air_quality.service
@@ -57,7 +64,12 @@ from datetime import datetime, timezone
 
 from sds011 import SDS011
 
-from py_air_quality.internal.settings import settings
+from py_air_quality.internal import profiling
+from py_air_quality.internal.acquisition_settings import get_settings
+from py_air_quality.internal.metrics import Registry, textfile_path
+from py_air_quality.internal.notify import Notifier, reading_message
+from py_air_quality.internal.rolling import RollingStatistics, parse_alerts
+from py_air_quality.measurement.adaptive_sampling import AdaptiveScheduler
 
 
 class ContinuousMeasurement:
@@ -73,16 +85,18 @@ class ContinuousMeasurement:
         # Enable graceful shutdown of the service:
         signal.signal(signal.SIGTERM, self._handle_sigterm)
 
-        # Take a sample every x seconds:
-        self.sampling_rate = 5.0
-
         self.continue_measurement = True
 
         # ----------------------------------------------------------------------
         # *** Load settings from .env file
 
+        settings = get_settings()
+
         # Experimental condition, e.g. 'baseline' or 'with_filter':
-        experimental_condition = settings.EXPERIMENTAL_CONDITION
+        self.experimental_condition = settings.EXPERIMENTAL_CONDITION
+
+        # Measurement location, e.g. 'Berlin Kreuzberg':
+        self.measurement_location = settings.MEASUREMENT_LOCATION
 
         # Directory where to store data (e.g. '/home/pi/air_quality/'):
         data_directory = settings.DATA_DIRECTORY
@@ -90,7 +104,7 @@ class ContinuousMeasurement:
         # Path of csv file where to store measurement data:
         self.path_csv = os.path.join(
             data_directory,
-            'measurement_{}.csv'.format(experimental_condition)
+            'measurement_{}.csv'.format(self.experimental_condition)
             )
 
         # If the csv file does not exist yet, create it and write first line
@@ -98,7 +112,76 @@ class ContinuousMeasurement:
         if not os.path.isfile(self.path_csv):
             with open(self.path_csv, mode='w') as csv_file:
                 csv_write = csv.writer(csv_file, delimiter=',')
-                csv_write.writerow(['timestamp', 'pm25', 'pm10'])
+                csv_write.writerow(['timestamp', 'pm25', 'pm10', 'interval'])
+
+        # Files created before the sampling interval was recorded keep their
+        # columns:
+        with open(self.path_csv) as csv_file:
+            header = csv_file.readline().strip().split(',')
+        self.write_interval = 'interval' in header
+
+        # Interval between samples (adapted to the change between readings).
+        # Nothing records the interval in files without interval column, so
+        # they are sampled at a fixed interval (e.g. to continue a running
+        # experiment):
+        max_interval = settings.SAMPLING_MAX_SECONDS
+        if not self.write_interval:
+            max_interval = settings.SAMPLING_MIN_SECONDS
+            msg = ('No interval column in {}, sampling at a fixed interval of '
+                   '{:g} s (start a new file for adaptive sampling).')
+            self.logger.warning(msg.format(self.path_csv, max_interval))
+        self.scheduler = AdaptiveScheduler(
+            min_interval=settings.SAMPLING_MIN_SECONDS,
+            max_interval=max_interval,
+            growth=settings.SAMPLING_GROWTH,
+            change_absolute=settings.SAMPLING_CHANGE_ABSOLUTE,
+            change_relative=settings.SAMPLING_CHANGE_RELATIVE,
+            warmup_seconds=settings.SAMPLING_WARMUP_SECONDS,
+            )
+
+        # Notify listeners (e.g. the server) about each new reading:
+        self.notifier = Notifier(settings.NOTIFY_ADDRESSES)
+
+        # Metrics (e.g. for the textfile collector of the Prometheus node
+        # exporter), written to file every x seconds:
+        self.metrics = Registry(script='measurement_continuous')
+        self.path_metrics = textfile_path(
+            data_directory, 'measurement_continuous')
+        self.metrics_interval = 60.0
+        self.metrics_written = 0.0
+        self.readings = self.metrics.counter(
+            'readings_total', 'Number of readings, by status.', ['status'])
+        self.reading_timestamp = self.metrics.gauge(
+            'reading_timestamp_seconds',
+            'Time of the last reading (epoch seconds).',
+            )
+        self.sample_interval = self.metrics.gauge(
+            'sample_interval_seconds',
+            'Time between the last two readings.',
+            )
+        self.scheduled_interval = self.metrics.gauge(
+            'scheduled_interval_seconds',
+            'Interval until the next reading (adaptive sampling).',
+            )
+        self.sensor_sleeps = self.metrics.counter(
+            'sensor_sleeps_total',
+            'Number of times the sensor slept between readings.',
+            )
+
+        # Rolling statistics of the readings (e.g. 1-hour mean), updated with
+        # each reading, and threshold alerts (see `ALERTS` in the `.env` file,
+        # and `py_air_quality.internal.rolling`):
+        self.statistics = RollingStatistics(
+            alerts=parse_alerts(settings.ALERTS))
+        self.rolling_mean = self.metrics.gauge(
+            'rolling_mean',
+            'Mean of the readings over a time window.',
+            ['pollutant', 'window_seconds'],
+            )
+        self.alert_active = self.metrics.gauge(
+            'alert_active', 'Whether a threshold alert is active.', ['alert'])
+        for alert in self.statistics.alerts:
+            self.alert_active.set(0, alert=alert.name)
 
         # ----------------------------------------------------------------------
         # *** Initialise sensor
@@ -110,16 +193,18 @@ class ContinuousMeasurement:
             try:
 
                 # Initialise sensor:
-                self.sensor = SDS011('/dev/ttyUSB0', use_query_mode=True)
-                time.sleep(5)
-                self.sensor.sleep(sleep=False)
+                with self.metrics.time_stage('sensor_init'):
+                    self.sensor = SDS011('/dev/ttyUSB0', use_query_mode=True)
+                    time.sleep(5)
+                    self.sensor.sleep(sleep=False)
 
                 # Give sensor time to stabilise:
-                time.sleep(30)
+                with self.metrics.time_stage('sensor_stabilisation'):
+                    time.sleep(30)
 
-                for x in range(5):
-                    _, _ = self.sensor.query()
-                    time.sleep(1)
+                    for x in range(5):
+                        _, _ = self.sensor.query()
+                        time.sleep(1)
 
                 sensor_initialised = True
 
@@ -143,16 +228,28 @@ class ContinuousMeasurement:
 
     def start(self):
         """Perform measurements."""
+        t_previous = None
+
         while self.continue_measurement:
 
             t1 = time.time()
 
+            # Time since the previous reading, i.e. the time that this reading
+            # stands for (None for the first reading):
+            if t_previous is None:
+                elapsed = None
+            else:
+                elapsed = t1 - t_previous
+                self.sample_interval.set(elapsed)
+            t_previous = t1
+
             try:
 
                 utc_now = datetime.now(timezone.utc)
 
                 # Get measurement:
-                pm25, pm10 = self.sensor.query()
+                with self.metrics.time_stage('sensor_query'):
+                    pm25, pm10 = self.sensor.query()
 
             except Exception:
 
@@ -160,34 +257,110 @@ class ContinuousMeasurement:
                 pm25 = None
                 pm10 = None
 
+            # Interval until the next reading:
+            interval = self.scheduler.update(pm25=pm25, pm10=pm10)
+            self.scheduled_interval.set(interval)
+
             # ------------------------------------------------------------------
             # *** Write data to csv file
 
             utc_now_str = str(round(utc_now.timestamp()))
 
+            row = utc_now_str + ',' + str(pm25) + ',' + str(pm10)
+            if elapsed is not None:
+                elapsed = round(elapsed, 1)
+            if self.write_interval:
+                row += ',' + str(elapsed)
+
             # Append new record to csv file (note the `a` flag):
-            with open(self.path_csv, 'a') as csv_file:
-                csv_file.write((utc_now_str
-                                + ','
-                                + str(pm25)
-                                + ','
-                                + str(pm10)
-                                + '\n'))
+            with self.metrics.time_stage('csv_write'), \
+                    open(self.path_csv, 'a') as csv_file:
+                csv_file.write(row + '\n')
+
+            self.notifier.send(reading_message(
+                experimental_condition=self.experimental_condition,
+                measurement_location=self.measurement_location,
+                timestamp=int(utc_now_str),
+                pm25=pm25,
+                pm10=pm10,
+                interval=elapsed,
+                ))
+
+            self._update_statistics(int(utc_now_str), pm25, pm10, elapsed)
+
+            self._update_metrics(int(utc_now_str), pm25, pm10)
 
             # ------------------------------------------------------------------
             # *** Sleep until next measurement
 
+            # If the interval is long enough, let the sensor sleep, and wake it
+            # up in time to stabilise before the next reading:
+            sensor_sleep = self.scheduler.sensor_sleep_seconds(interval)
+            if 0.0 < sensor_sleep:
+                self._sensor_sleep(t1 + sensor_sleep)
+
             t2 = time.time()
             td = t2 - t1
-            if td < self.sampling_rate:
-                sleep_duration = self.sampling_rate - td
+            if td < interval:
+                sleep_duration = interval - td
                 time.sleep(sleep_duration)
 
+    def _sensor_sleep(self, wake_time):
+        """Let the sensor sleep until `wake_time` (epoch seconds)."""
+        try:
+            self.sensor.sleep(sleep=True)
+        except Exception:
+            self.logger.error('Failed to put sensor to sleep.')
+            return
+        self.sensor_sleeps.inc()
+        time.sleep(max(wake_time - time.time(), 0.0))
+        # If waking up the sensor fails, the next reading fails and is recorded
+        # as such:
+        try:
+            self.sensor.sleep(sleep=False)
+        except Exception:
+            self.logger.error('Failed to wake up sensor.')
+
+    def _update_statistics(self, timestamp, pm25, pm10, interval):
+        """Update rolling statistics (weighted by interval), and log alerts."""
+        events = self.statistics.update(
+            timestamp, interval=interval, pm25=pm25, pm10=pm10)
+        for event in events:
+            if event['state'] == 'alert':
+                self.logger.warning('Alert {}: {:.1f}'.format(
+                    event['alert'], event['value']))
+                self.alert_active.set(1, alert=event['alert'])
+            else:
+                self.logger.info('Alert cleared {}: {:.1f}'.format(
+                    event['alert'], event['value']))
+                self.alert_active.set(0, alert=event['alert'])
+
+    def _update_metrics(self, timestamp, pm25, pm10):
+        """Count reading, and write metrics to file every x seconds."""
+        self.reading_timestamp.set(timestamp)
+        if (pm25 is None) or (pm10 is None):
+            self.readings.inc(status='failed')
+        else:
+            self.readings.inc(status='ok')
+            self.metrics.mark_success()
+        now = time.time()
+        if self.metrics_interval <= (now - self.metrics_written):
+            for pollutant, windows in self.statistics.windows.items():
+                for seconds, window in windows.items():
+                    if window.mean is not None:
+                        self.rolling_mean.set(
+                            window.mean,
+                            pollutant=pollutant,
+                            window_seconds='{:g}'.format(seconds),
+                            )
+            self.metrics.write_textfile(self.path_metrics)
+            self.metrics_written = now
+
     def stop(self):
         self.logger.info('Stopping measurement')
         self.continue_measurement = False
         # Wait for potentially ongoing measurement to finish:
-        time.sleep((self.sampling_rate + 0.1))
+        time.sleep((self.scheduler.min_interval + 0.1))
         self.sensor.sleep(sleep=True)
         sys.exit(0)
 
@@ -198,5 +371,8 @@ class ContinuousMeasurement:
 
 
 if __name__ == '__main__':
+    # Profile the service if requested (see `py_air_quality.internal.profiling`;
+    # reports are written when the service is stopped):
+    profiling.start('measurement_continuous', get_settings().DATA_DIRECTORY)
     service = ContinuousMeasurement()
     service.start()
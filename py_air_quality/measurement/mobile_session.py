@@ -0,0 +1,480 @@
+"""
+Join GPS fixes with air pollution readings during a mobile measurement.
+
+Live alternative to joining the two csv files after the measurement (see
+`py_air_quality/analysis/mobile.py`). While `measurement_continuous.py` is
+running, the session joins each GPS fix with the nearest reading (in time), and
+appends the geotagged reading to a csv file as soon as it is known:
+```
+py-air-quality mobile-session --gps-file /sdcard/GPSLogger/20250309-140001.txt
+```
+
+Inputs:
+- Readings are taken from the csv file of the continuous measurement (new rows
+  are read every `--poll-seconds`), and from reading notifications (UDP, if
+  `--listen` is one of the `NOTIFY_ADDRESSES` in the `.env` file).
+- GPS fixes are taken from the end of a "GPS Logger" csv file while it is being
+  written (`--gps-file`), and/or from `gps` messages to the `--listen` address
+  (json: `{"type": "gps", "timestamp": <epoch>, "latitude": ..., "longitude":
+  ...}`).
+
+The join follows the same rules as `mobile.join_air_gps`: a fix is matched with
+the nearest reading (the earlier one if both are equally far), and removed if
+they are `--time-diff-thr` seconds apart or more. A fix is emitted as soon as a
+reading at or after its time has arrived (or when no reading arrived for
+`max_lag` seconds of GPS time). Buffers are bounded (readings of the last ten
+minutes, for GPS fixes that arrive late).
+
+The geotagged readings are also sent as `geotagged` notifications (and pushed to
+live stream clients by the server).
+
+Only uses the standard library, so that it can run next to the measurement on
+the Raspberry Pi.
+
+"""
+
+import argparse
+import bisect
+import csv
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from py_air_quality.internal.acquisition_settings import get_settings
+from py_air_quality.internal.notify import (
+    Notifier,
+    geotagged_message,
+    parse_addresses,
+)
+
+# Columns of the geotagged csv file (as the output of `mobile.process_session`):
+columns = ("timestamp_gps", "latitude", "longitude", "timestamp_air", "pm25", "pm10")
+
+
+def parse_gps_time(datetime_string: str) -> int:
+    """
+    Epoch timestamp (rounded to seconds) of a GPS Logger datetime string, as
+    `mobile.parse_gps_timestamps` (UTC). Raises a `ValueError` if the string
+    cannot be parsed.
+    """
+    datetime_utc = datetime.fromisoformat(datetime_string.strip()).replace(
+        tzinfo=timezone.utc
+    )
+    return round(datetime_utc.timestamp())
+
+
+def _parse_value(value: str):
+    """Value of a measurement csv file ('None' for failed readings)."""
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+# ------------------------------------------------------------------------------
+# *** Streaming join
+
+
+class StreamingJoin:
+    """
+    As-of join of GPS fixes with the nearest reading, for inputs that arrive
+    over time (each input in chronological order).
+
+    `add_reading` and `add_fix` return the geotagged readings that are complete
+    (as list of dictionaries, see `columns`). Buffers are bounded: readings are
+    kept for `buffer_seconds` (for fixes that arrive late, e.g. when the GPS
+    file is written in batches), and at most `max_pending` fixes wait for a
+    reading.
+    """
+
+    def __init__(
+        self,
+        *,
+        time_diff_thr: float = 10.0,
+        max_lag: float = 60.0,
+        buffer_seconds: float = 600.0,
+        max_readings: int = 4096,
+        max_pending: int = 4096,
+    ):
+        self.time_diff_thr = time_diff_thr
+        self.max_lag = max_lag
+        self.buffer_seconds = buffer_seconds
+        # Recent readings (timestamps & values):
+        self.reading_times = deque(maxlen=max_readings)
+        self.readings = deque(maxlen=max_readings)
+        # Fixes waiting for a reading at or after their time:
+        self.pending = deque()
+        self.max_pending = max_pending
+        # Number of fixes without reading within `time_diff_thr`:
+        self.excluded = 0
+
+    def add_reading(self, timestamp: int, *, pm25=None, pm10=None):
+        """Add a reading; readings that are not newer than the last are ignored."""
+        if self.reading_times and (timestamp <= self.reading_times[-1]):
+            return []
+        previous = self.readings[-1] if self.readings else None
+        reading = (timestamp, {"pm25": pm25, "pm10": pm10})
+        self.reading_times.append(timestamp)
+        self.readings.append(reading)
+        while self.reading_times and (
+            self.reading_times[0] < timestamp - self.buffer_seconds
+        ):
+            self.reading_times.popleft()
+            self.readings.popleft()
+
+        joined = []
+        while self.pending and (self.pending[0][0] <= timestamp):
+            fix = self.pending.popleft()
+            backward = reading if fix[0] == timestamp else previous
+            joined += self._match(fix, backward, reading)
+        return joined
+
+    def add_fix(self, timestamp: int, latitude: float, longitude: float):
+        """Add a GPS fix."""
+        fix = (timestamp, latitude, longitude)
+        if self.reading_times and (timestamp <= self.reading_times[-1]):
+            # Readings after the fix are known already:
+            i = bisect.bisect_right(self.reading_times, timestamp)
+            backward = self.readings[i - 1] if 0 < i else None
+            forward = self.readings[i] if i < len(self.readings) else None
+            return self._match(fix, backward, forward)
+
+        self.pending.append(fix)
+        joined = []
+        # No reading for a while (e.g. sensor failure), or too many fixes
+        # waiting: emit the oldest fixes with the readings before them.
+        while self.pending and (
+            (self.pending[0][0] <= timestamp - self.max_lag)
+            or (self.max_pending < len(self.pending))
+        ):
+            joined += self._match(self.pending.popleft(), self._last_reading(), None)
+        return joined
+
+    def flush(self):
+        """Emit all waiting fixes (e.g. at the end of the session)."""
+        joined = []
+        while self.pending:
+            joined += self._match(self.pending.popleft(), self._last_reading(), None)
+        return joined
+
+    def _last_reading(self):
+        return self.readings[-1] if self.readings else None
+
+    def _match(self, fix, backward, forward):
+        """Geotagged reading of a fix (empty list if there is no reading)."""
+        timestamp, latitude, longitude = fix
+        candidates = [x for x in (backward, forward) if x is not None]
+        if not candidates:
+            self.excluded += 1
+            return []
+        # The earlier reading wins ties (as `merge_asof`):
+        reading = min(candidates, key=lambda x: abs(timestamp - x[0]))
+        if self.time_diff_thr <= abs(timestamp - reading[0]):
+            self.excluded += 1
+            return []
+        return [
+            {
+                "timestamp_gps": timestamp,
+                "latitude": latitude,
+                "longitude": longitude,
+                "timestamp_air": reading[0],
+                "pm25": reading[1]["pm25"],
+                "pm10": reading[1]["pm10"],
+            }
+        ]
+
+
+# ------------------------------------------------------------------------------
+# *** Inputs
+
+
+class FileTail:
+    """
+    New lines of a csv file that is being written. The first line is parsed as
+    header; `rows` returns the complete lines added since the last call, as
+    dictionaries. Starts again from the beginning if the file is replaced or
+    truncated.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+        self.inode = None
+        self.header = None
+        self.partial = ""
+
+    def _open(self):
+        try:
+            self.file = open(self.path, "r", newline="")
+        except FileNotFoundError:
+            return False
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        self.header = None
+        self.partial = ""
+        return True
+
+    def rows(self):
+        if self.file is None and not self._open():
+            return []
+        try:
+            stat = os.stat(self.path)
+            if (stat.st_ino != self.inode) or (stat.st_size < self.file.tell()):
+                self.close()
+                if not self._open():
+                    return []
+        except FileNotFoundError:
+            pass
+
+        text = self.partial + self.file.read()
+        lines = text.split("\n")
+        # The last line may not be complete yet:
+        self.partial = lines.pop()
+
+        rows = []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            values = next(csv.reader([line]))
+            if self.header is None:
+                self.header = [x.strip() for x in values]
+                continue
+            rows.append(dict(zip(self.header, values)))
+        return rows
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+# ------------------------------------------------------------------------------
+# *** Session
+
+
+class MobileSession:
+    """
+    Join GPS fixes & readings until stopped, and append the geotagged readings
+    to a csv file (see module docstring).
+    """
+
+    def __init__(
+        self,
+        *,
+        path_output: str,
+        path_gps=None,
+        path_air=None,
+        listen_address: str = "",
+        time_diff_thr: float = 10.0,
+        poll_seconds: float = 1.0,
+    ):
+        self.logger = self._init_logger()
+
+        # Enable graceful shutdown of the service:
+        signal.signal(signal.SIGTERM, self._handle_sigterm)
+        signal.signal(signal.SIGINT, self._handle_sigterm)
+
+        settings = get_settings()
+        self.experimental_condition = settings.EXPERIMENTAL_CONDITION
+        self.measurement_location = settings.MEASUREMENT_LOCATION
+
+        self.join = StreamingJoin(time_diff_thr=time_diff_thr)
+        self.poll_seconds = poll_seconds
+        self.continue_session = True
+
+        self.gps_tail = FileTail(path_gps) if path_gps is not None else None
+        self.air_tail = FileTail(path_air) if path_air is not None else None
+
+        # Socket for reading notifications & GPS messages (optional):
+        self.socket = None
+        addresses = parse_addresses(listen_address)
+        if addresses:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket.bind(addresses[0])
+            self.socket.setblocking(False)
+
+        self.path_output = path_output
+        if not os.path.isfile(path_output):
+            with open(path_output, mode="w") as csv_file:
+                csv.writer(csv_file, delimiter=",").writerow(columns)
+
+        self.notifier = Notifier(settings.NOTIFY_ADDRESSES)
+        self.n_geotagged = 0
+
+    def _init_logger(self):
+        logger = logging.getLogger(__name__)
+        logger.setLevel(logging.DEBUG)
+        stdout_handler = logging.StreamHandler()
+        stdout_handler.setLevel(logging.DEBUG)
+        stdout_handler.setFormatter(logging.Formatter("%(levelname)8s | %(message)s"))
+        logger.addHandler(stdout_handler)
+        return logger
+
+    def _receive(self, timeout: float):
+        """Wait for messages (at most `timeout` seconds), and join them."""
+        if self.socket is None:
+            time.sleep(timeout)
+            return []
+        readable, _, _ = select.select([self.socket], [], [], timeout)
+        joined = []
+        while readable:
+            try:
+                datagram = self.socket.recv(65536)
+            except BlockingIOError:
+                break
+            try:
+                message = json.loads(datagram)
+                if message.get("type") == "gps":
+                    joined += self.join.add_fix(
+                        int(message["timestamp"]),
+                        float(message["latitude"]),
+                        float(message["longitude"]),
+                    )
+                elif (
+                    (message.get("type") == "reading")
+                    and (
+                        message.get("experimental_condition")
+                        == self.experimental_condition
+                    )
+                    and (
+                        message.get("measurement_location") == self.measurement_location
+                    )
+                ):
+                    joined += self.join.add_reading(
+                        int(message["timestamp"]),
+                        pm25=message.get("pm25"),
+                        pm10=message.get("pm10"),
+                    )
+            except (ValueError, KeyError, TypeError, AttributeError):
+                continue
+        return joined
+
+    def poll(self):
+        """Join the rows appended to the csv files since the last poll."""
+        joined = []
+        if self.air_tail is not None:
+            for row in self.air_tail.rows():
+                try:
+                    timestamp = int(row["timestamp"])
+                except (KeyError, ValueError):
+                    continue
+                joined += self.join.add_reading(
+                    timestamp,
+                    pm25=_parse_value(row.get("pm25", "")),
+                    pm10=_parse_value(row.get("pm10", "")),
+                )
+        if self.gps_tail is not None:
+            for row in self.gps_tail.rows():
+                try:
+                    fix = (
+                        parse_gps_time(row["date time"]),
+                        float(row["latitude"]),
+                        float(row["longitude"]),
+                    )
+                except (KeyError, ValueError, TypeError):
+                    continue
+                joined += self.join.add_fix(*fix)
+        return joined
+
+    def write(self, joined):
+        """Append geotagged readings to the output file, and notify."""
+        if not joined:
+            return
+        with open(self.path_output, "a") as csv_file:
+            for row in joined:
+                csv_file.write(",".join(str(row[x]) for x in columns) + "\n")
+        for row in joined:
+            self.notifier.send(
+                geotagged_message(
+                    experimental_condition=self.experimental_condition,
+                    measurement_location=self.measurement_location,
+                    **row,
+                )
+            )
+        self.n_geotagged += len(joined)
+
+    def start(self):
+        """Join inputs until stopped."""
+        self.logger.info("Mobile session started.")
+        next_poll = time.monotonic()
+        while self.continue_session:
+            now = time.monotonic()
+            if next_poll <= now:
+                self.write(self.poll())
+                next_poll = now + self.poll_seconds
+            self.write(self._receive(max(0.0, min(1.0, next_poll - time.monotonic()))))
+
+        # Rows written before the stop, and fixes still waiting for a reading:
+        self.write(self.poll())
+        self.write(self.join.flush())
+        for tail in (self.gps_tail, self.air_tail):
+            if tail is not None:
+                tail.close()
+        if self.socket is not None:
+            self.socket.close()
+        self.notifier.close()
+        self.logger.info(
+            "Mobile session stopped: {} geotagged readings, {} GPS fixes without"
+            " reading.".format(self.n_geotagged, self.join.excluded)
+        )
+
+    def _handle_sigterm(self, sig, frame):
+        self.logger.info("Stop requested.")
+        self.continue_session = False
+
+
+def main(argv=None):
+    settings = get_settings()
+    parser = argparse.ArgumentParser(
+        description="Join GPS fixes with air pollution readings during a mobile"
+        " measurement."
+    )
+    parser.add_argument("--gps-file", help="GPS Logger csv file (being written).")
+    parser.add_argument(
+        "--air-file",
+        default=os.path.join(
+            settings.DATA_DIRECTORY,
+            "measurement_{}.csv".format(settings.EXPERIMENTAL_CONDITION),
+        ),
+        help="Measurement csv file (default: file of the continuous measurement).",
+    )
+    parser.add_argument(
+        "--listen",
+        default="",
+        help="Address ('host:port') for reading notifications & GPS messages.",
+    )
+    parser.add_argument(
+        "--output",
+        default=os.path.join(
+            settings.DATA_DIRECTORY,
+            "geotagged_{}.csv".format(settings.EXPERIMENTAL_CONDITION),
+        ),
+        help="Csv file where to append the geotagged readings.",
+    )
+    parser.add_argument("--time-diff-thr", type=float, default=10.0)
+    parser.add_argument("--poll-seconds", type=float, default=1.0)
+    args = parser.parse_args(argv)
+    if (args.gps_file is None) and (not args.listen):
+        parser.error("GPS fixes are needed (--gps-file or --listen).")
+
+    session = MobileSession(
+        path_output=args.output,
+        path_gps=args.gps_file,
+        path_air=args.air_file,
+        listen_address=args.listen,
+        time_diff_thr=args.time_diff_thr,
+        poll_seconds=args.poll_seconds,
+    )
+    session.start()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+Fan-out of live messages to many subscribers.
+
+Publishing never waits for subscribers: each subscriber has a bounded queue,
+and when a slow subscriber's queue is full, its oldest messages are dropped
+(coalesced), so that it always receives the most recent messages.
+
+"""
+
+import asyncio
+from collections import deque
+
+
+class Subscription:
+    """
+    Bounded message queue of one subscriber.
+    """
+
+    def __init__(self, topic, max_queue: int):
+        self.topic = topic
+        self.queue = deque(maxlen=max_queue)
+        self.event = asyncio.Event()
+        # Number of messages dropped because the subscriber was too slow:
+        self.dropped = 0
+
+    def put(self, message):
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(message)
+        self.event.set()
+
+    async def get_all(self):
+        """Wait for messages, and return all pending messages at once."""
+        while not self.queue:
+            self.event.clear()
+            await self.event.wait()
+        messages = list(self.queue)
+        self.queue.clear()
+        return messages
+
+
+class Broadcaster:
+    """
+    Publish messages to the subscribers of a topic.
+    """
+
+    def __init__(self, max_queue: int = 16):
+        self.max_queue = max_queue
+        self.subscriptions = {}
+
+    def subscribe(self, topic) -> Subscription:
+        subscription = Subscription(topic, self.max_queue)
+        self.subscriptions.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscriptions = self.subscriptions.get(subscription.topic, set())
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            self.subscriptions.pop(subscription.topic, None)
+
+    def publish(self, topic, message):
+        """Add message to the queue of every subscriber (never blocks)."""
+        for subscription in self.subscriptions.get(topic, ()):
+            subscription.put(message)
+
+    @property
+    def n_subscribers(self) -> int:
+        return sum(len(x) for x in self.subscriptions.values())
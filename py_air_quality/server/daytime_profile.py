@@ -0,0 +1,152 @@
+"""
+Binned daytime profile of air pollution measurements.
+
+Mean, standard deviation and number of measurements per daytime bin (e.g. per 5
+minutes), computed for several pollutants at once with `np.bincount`, and
+percentiles per daytime bin (e.g. median, 10th & 90th percentile), computed with
+quantile sketches (see `py_air_quality/internal/quantile_sketch.py`).
+
+Measurements can be weighted by their sampling interval (see
+`py_air_quality.crud.read_csv_data.interval_weights`), so that periods that
+were sampled more densely (adaptive sampling) do not dominate the profile.
+
+"""
+
+import numpy as np
+
+from py_air_quality.internal.quantile_sketch import (
+    SketchMapping,
+    dense_quantiles,
+    sparse_counts,
+)
+
+# Percentiles of the daytime profile plots (lower band, line, upper band):
+default_quantiles = (0.1, 0.5, 0.9)
+
+
+def daytime_bins(daytime: np.ndarray, bin_minutes: float):
+    """
+    Daytime bin of each measurement (`daytime` in hours, 0 to 24), and the
+    number of bins. Raises a `ValueError` if the bins do not divide the day
+    evenly.
+    """
+    if (1440.0 % bin_minutes) != 0.0:
+        msg = "Bin size has to divide the day evenly, got {} minutes."
+        raise ValueError(msg.format(bin_minutes))
+
+    n_bins = int(round(1440.0 / bin_minutes))
+
+    bin_idx = np.floor(
+        np.asarray(daytime, dtype=np.float64) * (60.0 / bin_minutes)
+    ).astype(np.int64)
+    np.clip(bin_idx, 0, (n_bins - 1), out=bin_idx)
+    return bin_idx, n_bins
+
+
+def daytime_profile(
+    *,
+    daytime: np.ndarray,
+    values: np.ndarray,
+    bin_minutes: float = 5.0,
+    weights=None,
+):
+    """
+    Calculate mean, standard deviation and count per daytime bin.
+
+    `daytime` is the local time of day in hours (0 to 24), one entry per
+    measurement. `values` has shape (n_series, n_measurements), e.g. one row for
+    pm10 and one row for pm25. Missing values (nan) are ignored. Optional
+    `weights` (one per measurement) weight the mean & standard deviation.
+
+    Returns the bin centres (in hours), and mean, standard deviation (ddof=0),
+    count and sum of weights (equal to the count without `weights`) per bin,
+    each with shape (n_series, n_bins). Mean and standard deviation are nan for
+    empty bins.
+
+    """
+    bin_idx, n_bins = daytime_bins(daytime, bin_minutes)
+
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    n_series = values.shape[0]
+
+    # Offset the bin index of each series, so that all series can be counted
+    # with a single `bincount` call:
+    flat_idx = np.add(
+        bin_idx[np.newaxis, :], (np.arange(n_series) * n_bins)[:, np.newaxis]
+    ).ravel()
+    flat_values = values.ravel()
+    if weights is None:
+        flat_weights = np.ones(flat_values.shape)
+    else:
+        flat_weights = np.tile(np.asarray(weights, dtype=np.float64), n_series)
+
+    valid = np.logical_not(np.isnan(flat_values))
+    flat_idx = flat_idx[valid]
+    flat_values = flat_values[valid]
+    flat_weights = flat_weights[valid]
+
+    size = n_series * n_bins
+    count = np.bincount(flat_idx, minlength=size)
+    weight = np.bincount(flat_idx, weights=flat_weights, minlength=size)
+    total = np.bincount(flat_idx, weights=(flat_values * flat_weights), minlength=size)
+    total_squared = np.bincount(
+        flat_idx, weights=(np.square(flat_values) * flat_weights), minlength=size
+    )
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.divide(total, weight)
+        variance = np.subtract(np.divide(total_squared, weight), np.square(mean))
+
+    # Rounding errors can lead to slightly negative variance for constant data:
+    sd = np.sqrt(np.maximum(variance, 0.0))
+
+    bin_centres = (np.arange(n_bins) + 0.5) * (bin_minutes / 60.0)
+
+    return (
+        bin_centres,
+        mean.reshape(n_series, n_bins),
+        sd.reshape(n_series, n_bins),
+        count.reshape(n_series, n_bins),
+        weight.reshape(n_series, n_bins),
+    )
+
+
+def daytime_quantiles(
+    *,
+    daytime: np.ndarray,
+    values: np.ndarray,
+    bin_minutes: float = 5.0,
+    q=default_quantiles,
+    mapping: SketchMapping = None,
+    weights=None,
+):
+    """
+    Calculate quantiles per daytime bin (arguments as for `daytime_profile`;
+    `weights` have to be integers, e.g. from `interval_weights`).
+
+    Quantiles are computed with quantile sketches, so they are within the
+    relative accuracy of the sketch mapping (default 1%) of the exact quantile.
+    Returns an array of shape (len(q), n_series, n_bins), nan for empty bins.
+
+    """
+    if mapping is None:
+        mapping = SketchMapping()
+
+    bin_idx, n_bins = daytime_bins(daytime, bin_minutes)
+
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    n_series = values.shape[0]
+
+    # One sketch per series and bin:
+    group = np.add(
+        bin_idx[np.newaxis, :], (np.arange(n_series) * n_bins)[:, np.newaxis]
+    ).ravel()
+    if weights is not None:
+        weights = np.tile(np.asarray(weights, dtype=np.int64), n_series)
+    quantiles = dense_quantiles(
+        *sparse_counts(group, values.ravel(), mapping, weights),
+        q,
+        mapping,
+        n_groups=(n_series * n_bins),
+    )
+    return quantiles.reshape(len(quantiles), n_series, n_bins)
@@ -0,0 +1,177 @@
+"""
+Daytime profiles over many days, from quantile sketches per day.
+
+For each local calendar day, the readings are summarised per series (e.g. pm10
+& pm25) and daytime bin: number of readings, their sum (for the mean), and a
+quantile sketch (see `py_air_quality/internal/quantile_sketch.py`; at most a few
+hundred bins per sketch, and at most one bin per reading). Readings are added
+incrementally (only the sketches of the current day change), and the profile of
+e.g. the last 30 days or the last year is a merge of the sketches of these days,
+without reading the raw data again.
+
+Quantiles are within the relative accuracy of the sketch mapping (default 1%)
+of the exact quantile of the readings of the selected days. Readings can be
+weighted by their sampling interval (see `daytime_profile`).
+
+"""
+
+import numpy as np
+
+from py_air_quality.crud.time_features import time_features
+from py_air_quality.internal.quantile_sketch import (
+    SketchMapping,
+    dense_quantiles,
+    merge_sparse,
+    sparse_counts,
+)
+from py_air_quality.server.daytime_profile import daytime_bins, default_quantiles
+
+
+class DaytimeSketches:
+    """
+    Count, sum and quantile sketch per day, series and daytime bin.
+
+    Readings are expected in chronological order (as in the measurement csv
+    files); readings that are not newer than the last added reading are
+    ignored.
+    """
+
+    def __init__(
+        self,
+        *,
+        n_series: int = 2,
+        bin_minutes: float = 5.0,
+        local_time_zone=None,
+        mapping: SketchMapping = None,
+    ):
+        self.n_series = n_series
+        self.bin_minutes = bin_minutes
+        _, self.n_bins = daytime_bins(np.zeros(0), bin_minutes)
+        self.local_time_zone = local_time_zone
+        self.mapping = mapping if mapping is not None else SketchMapping()
+        # By day (days since 1970-01-01, local): count, sum of weights &
+        # weighted sum (arrays of shape (n_series, n_bins)), and sparse
+        # sketches (group, bin, count), where the group is `series * n_bins +
+        # daytime bin`.
+        self.count = {}
+        self.weight = {}
+        self.total = {}
+        self.sketches = {}
+        self.last_timestamp = None
+
+    def add(self, timestamp: np.ndarray, values: np.ndarray, weights=None):
+        """
+        Add readings (`values` with shape (n_series, n_readings), missing
+        values are nan), optionally with integer weights (one per reading).
+        """
+        timestamp = np.asarray(timestamp, dtype=np.int64)
+        values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+        if weights is None:
+            weights = np.ones(len(timestamp), dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.int64)
+        if self.last_timestamp is not None:
+            new = self.last_timestamp < timestamp
+            timestamp = timestamp[new]
+            values = values[:, new]
+            weights = weights[new]
+        if len(timestamp) == 0:
+            return
+        self.last_timestamp = int(timestamp[-1])
+
+        features = time_features(timestamp, self.local_time_zone)
+        bin_idx, _ = daytime_bins(features["daytime"], self.bin_minutes)
+        day = features["day"]
+
+        # Readings are in chronological order, so days are contiguous:
+        starts = np.flatnonzero(np.concatenate(([True], day[1:] != day[:-1])))
+        ends = np.append(starts[1:], len(day))
+        n_groups = self.n_series * self.n_bins
+        for start, end in zip(starts, ends):
+            key = int(day[start])
+            group = np.add(
+                bin_idx[np.newaxis, start:end],
+                (np.arange(self.n_series) * self.n_bins)[:, np.newaxis],
+            ).ravel()
+            flat_values = values[:, start:end].ravel()
+            flat_weights = np.tile(weights[start:end], self.n_series)
+            valid = ~np.isnan(flat_values)
+            shape = (self.n_series, self.n_bins)
+            count = np.bincount(group[valid], minlength=n_groups).reshape(shape)
+            weight = np.bincount(
+                group[valid], weights=flat_weights[valid], minlength=n_groups
+            ).reshape(shape)
+            total = np.bincount(
+                group[valid],
+                weights=(flat_values[valid] * flat_weights[valid]),
+                minlength=n_groups,
+            ).reshape(shape)
+            sketch = sparse_counts(group, flat_values, self.mapping, flat_weights)
+            if key in self.sketches:
+                self.count[key] += count
+                self.weight[key] += weight
+                self.total[key] += total
+                self.sketches[key] = merge_sparse(self.sketches[key], sketch)
+            else:
+                self.count[key] = count
+                self.weight[key] = weight
+                self.total[key] = total
+                self.sketches[key] = sketch
+
+    def days(self, *, start_day=None, end_day=None, weekend=None):
+        """
+        Days with data, with `start_day <= day < end_day`, optionally only
+        weekend days (True) or weekdays (False).
+        """
+        days = np.array(sorted(self.sketches), dtype=np.int64)
+        if start_day is not None:
+            days = days[start_day <= days]
+        if end_day is not None:
+            days = days[days < end_day]
+        if weekend is not None:
+            # 1970-01-01 was a Thursday (see `time_features`):
+            is_weekend = 5 <= np.mod(days + 3, 7)
+            days = days[is_weekend == weekend]
+        return days
+
+    def profile(
+        self, *, start_day=None, end_day=None, weekend=None, q=default_quantiles
+    ):
+        """
+        Daytime profile of the selected days (see `days`): mean, count, sum of
+        weights and quantiles per series and bin. Returns a dictionary with
+        `mean`, `count` & `weight` (shape (n_series, n_bins)), and `quantiles`
+        (shape (len(q), n_series, n_bins)); nan for empty bins.
+        """
+        days = self.days(start_day=start_day, end_day=end_day, weekend=weekend)
+        shape = (self.n_series, self.n_bins)
+        count = np.zeros(shape, dtype=np.int64)
+        weight = np.zeros(shape)
+        total = np.zeros(shape)
+        for day in days.tolist():
+            count += self.count[day]
+            weight += self.weight[day]
+            total += self.total[day]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = np.divide(total, weight)
+
+        if len(days):
+            group, index, counts = (
+                np.concatenate([self.sketches[x][i] for x in days.tolist()])
+                for i in range(3)
+            )
+        else:
+            group = index = counts = np.zeros(0, dtype=np.int64)
+        quantiles = dense_quantiles(
+            group,
+            index,
+            counts,
+            q,
+            self.mapping,
+            n_groups=(self.n_series * self.n_bins),
+        )
+        return {
+            "mean": mean,
+            "count": count,
+            "weight": weight,
+            "quantiles": quantiles.reshape((len(quantiles),) + shape),
+        }
@@ -0,0 +1,105 @@
+"""
+Downsample time series for display.
+
+Two decimation methods are available:
+- `minmax`: split the series into equal-time buckets, and keep the minimum and
+  the maximum of each bucket (peaks are always preserved).
+- `lttb`: Largest-Triangle-Three-Buckets (Steinarsson, 2013), which keeps the
+  visually most significant point of each bucket.
+
+Both return at most `n_points` points, in temporal order. Missing values (nan)
+are removed before downsampling.
+
+"""
+
+import numpy as np
+
+
+def _remove_nan(x: np.ndarray, y: np.ndarray):
+    valid = np.logical_not(np.isnan(y))
+    return x[valid], y[valid]
+
+
+def minmax(x: np.ndarray, y: np.ndarray, n_points: int):
+    """Keep minimum & maximum per equal-time bucket (n_points / 2 buckets)."""
+    x, y = _remove_nan(np.asarray(x), np.asarray(y, dtype=np.float64))
+
+    if len(x) <= n_points:
+        return x, y
+
+    n_buckets = max(n_points // 2, 1)
+
+    # Equal-time buckets (x is sorted):
+    x_float = x.astype(np.float64)
+    bucket = np.floor(
+        (x_float - x_float[0]) / (x_float[-1] - x_float[0]) * n_buckets
+    ).astype(np.int64)
+    np.clip(bucket, 0, (n_buckets - 1), out=bucket)
+
+    # Start index of each non-empty bucket:
+    starts = np.flatnonzero(np.diff(bucket, prepend=-1))
+    bucket_min = np.minimum.reduceat(y, starts)
+    bucket_max = np.maximum.reduceat(y, starts)
+
+    # Position of each point's bucket among the non-empty buckets:
+    bucket_rank = np.cumsum(np.diff(bucket, prepend=-1) != 0) - 1
+
+    # First occurrence of minimum and maximum within each bucket:
+    idx = np.arange(len(y))
+    is_min = y == bucket_min[bucket_rank]
+    is_max = y == bucket_max[bucket_rank]
+    _, first_min = np.unique(bucket_rank[is_min], return_index=True)
+    _, first_max = np.unique(bucket_rank[is_max], return_index=True)
+
+    selected = np.union1d(idx[is_min][first_min], idx[is_max][first_max])
+
+    return x[selected], y[selected]
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_points: int):
+    """Largest-Triangle-Three-Buckets downsampling."""
+    x, y = _remove_nan(np.asarray(x), np.asarray(y, dtype=np.float64))
+
+    n = len(x)
+    if (n <= n_points) or (n_points < 3):
+        return x, y
+
+    x_float = x.astype(np.float64)
+
+    # The first and last point are always kept; the points in between are
+    # split into (n_points - 2) buckets of equal size.
+    edges = np.linspace(1, (n - 1), (n_points - 1)).astype(np.int64)
+
+    # Mean of each bucket (needed as third triangle vertex):
+    sums_x = np.add.reduceat(x_float[1:-1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:-1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    mean_x = np.append(sums_x / counts, x_float[-1])
+    mean_y = np.append(sums_y / counts, y[-1])
+
+    selected = np.empty(n_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    idx_previous = 0
+    for idx_bucket in range(n_points - 2):
+        start = edges[idx_bucket]
+        end = edges[idx_bucket + 1]
+        # Twice the area of the triangle formed by the previously selected
+        # point, each point in the bucket, and the mean of the next bucket:
+        area = np.abs(
+            (x_float[idx_previous] - mean_x[idx_bucket + 1])
+            * (y[start:end] - y[idx_previous])
+            - (x_float[idx_previous] - x_float[start:end])
+            * (mean_y[idx_bucket + 1] - y[idx_previous])
+        )
+        idx_previous = start + int(np.argmax(area))
+        selected[idx_bucket + 1] = idx_previous
+
+    return x[selected], y[selected]
+
+
+methods = {
+    "minmax": minmax,
+    "lttb": lttb,
+}
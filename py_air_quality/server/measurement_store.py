@@ -0,0 +1,185 @@
+"""
+In-memory copy of a measurement csv file, kept up to date incrementally.
+
+The csv files written by `py_air_quality/measurement/` are append-only, so
+after the first load only the bytes appended since the previous access are
+parsed. Time windows are selected by binary search on the timestamps.
+
+Quality flags (see `py_air_quality/crud/data_quality.py`) are computed for new
+readings as they are parsed, and kept next to the readings; flagged readings
+can be left out of a time window (`exclude`). The sampling interval of each
+reading is read from the `interval` column if the file has one (see
+`py_air_quality/measurement/adaptive_sampling.py`), and is nan otherwise.
+
+A store can be used from several threads (e.g. the server parses csv files in
+a thread, so that its event loop is not blocked).
+
+"""
+
+import io
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from py_air_quality.crud.data_quality import QualityChecker
+
+
+class MeasurementStore:
+    """
+    Measurement data (timestamp, pm25, pm10) from one csv file as numpy arrays.
+    """
+
+    def __init__(self, path_csv: str, *, quality_parameters=None):
+        self.path_csv = path_csv
+        # Parameters of the quality checks (see `QualityChecker`):
+        self.quality_parameters = (
+            quality_parameters if quality_parameters is not None else {}
+        )
+        # Parsing & window selection are done by one thread at a time:
+        self.lock = threading.RLock()
+        self._reset()
+        # Number of bytes of the csv file that have been parsed, and identity of
+        # the file (to detect when it is replaced):
+        self.offset = 0
+        self.inode = None
+
+    def refresh(self):
+        """Parse data appended to the csv file since the last call."""
+        with self.lock:
+            self._refresh()
+
+    def _refresh(self):
+        stat = os.stat(self.path_csv)
+
+        if (stat.st_ino != self.inode) or (stat.st_size < self.offset):
+            # New or replaced file, read from the beginning:
+            self._reset()
+            self.inode = stat.st_ino
+
+        if stat.st_size == self.offset:
+            return
+
+        with open(self.path_csv, "rb") as csv_file:
+            csv_file.seek(self.offset)
+            content = csv_file.read(stat.st_size - self.offset)
+
+        # Only parse complete lines; a line that is currently being written
+        # will be parsed on the next call.
+        end = content.rfind(b"\n") + 1
+        if end == 0:
+            return
+        content = content[:end]
+
+        if self.offset == 0:
+            header = content[: content.find(b"\n")].decode().strip().split(",")
+            self.has_interval = "interval" in [x.strip() for x in header]
+        names = ["timestamp", "pm25", "pm10"]
+        if self.has_interval:
+            names.append("interval")
+
+        df = pd.read_csv(
+            io.BytesIO(content),
+            header=(0 if self.offset == 0 else None),
+            names=names,
+            usecols=list(range(len(names))),
+            na_values=["None"],
+        )
+        self.offset += end
+
+        timestamp = df["timestamp"].to_numpy(dtype=np.int64)
+        pm25 = df["pm25"].to_numpy(dtype=np.float64)
+        pm10 = df["pm10"].to_numpy(dtype=np.float64)
+        if self.has_interval:
+            interval = df["interval"].to_numpy(dtype=np.float64)
+        else:
+            interval = np.full(len(df), np.nan)
+
+        self.timestamp = np.concatenate([self.timestamp, timestamp])
+        self.pm25 = np.concatenate([self.pm25, pm25])
+        self.pm10 = np.concatenate([self.pm10, pm10])
+        self.interval = np.concatenate([self.interval, interval])
+
+        # Timestamps should be increasing, but system clock adjustments could
+        # lead to unordered rows (then the quality flags of all readings are
+        # computed again):
+        n_previous = len(self.timestamp) - len(timestamp)
+        if np.any(np.diff(self.timestamp[max(n_previous - 1, 0) :]) < 0):
+            order = np.argsort(self.timestamp, kind="stable")
+            self.timestamp = self.timestamp[order]
+            self.pm25 = self.pm25[order]
+            self.pm10 = self.pm10[order]
+            self.interval = self.interval[order]
+            self.checker = QualityChecker(**self.quality_parameters)
+            self.quality = np.zeros((2, 0), dtype=np.uint8)
+            timestamp = self.timestamp
+            pm25 = self.pm25
+            pm10 = self.pm10
+
+        # The flags of the previous newest reading are returned again:
+        flags = self.checker.update(timestamp, np.stack([pm25, pm10]))
+        n_revised = flags.shape[1] - len(timestamp)
+        self.quality = np.concatenate(
+            [self.quality[:, : self.quality.shape[1] - n_revised], flags], axis=1
+        )
+
+    def _reset(self):
+        """Remove all data (e.g. before reading a replaced file)."""
+        self.timestamp = np.zeros(0, dtype=np.int64)
+        self.pm25 = np.zeros(0, dtype=np.float64)
+        self.pm10 = np.zeros(0, dtype=np.float64)
+        self.interval = np.zeros(0, dtype=np.float64)
+        self.has_interval = False
+        # Quality flags of pm25 & pm10 (rows), see `QualityChecker`:
+        self.quality = np.zeros((2, 0), dtype=np.uint8)
+        self.checker = QualityChecker(**self.quality_parameters)
+
+    def _indices(self, start_epoch: int, end_epoch=None):
+        """First & last index (exclusive) of a time window."""
+        self.refresh()
+        idx_start = np.searchsorted(self.timestamp, start_epoch, side="left")
+        if end_epoch is None:
+            idx_end = len(self.timestamp)
+        else:
+            idx_end = np.searchsorted(self.timestamp, end_epoch, side="left")
+        return idx_start, idx_end
+
+    def window(self, start_epoch: int, end_epoch=None, *, exclude: int = 0):
+        """
+        Select measurements with `start_epoch <= timestamp < end_epoch`.
+        Readings with any of the quality flags in `exclude` are nan (e.g.
+        `data_quality.exclude_default`).
+
+        Returns timestamp, pm25 and pm10 arrays (views if nothing is excluded,
+        do not modify).
+        """
+        with self.lock:
+            idx_start, idx_end = self._indices(start_epoch, end_epoch)
+            timestamp = self.timestamp[idx_start:idx_end]
+            pm25 = self.pm25[idx_start:idx_end]
+            pm10 = self.pm10[idx_start:idx_end]
+            quality = self.quality[:, idx_start:idx_end]
+        if exclude:
+            flagged = (quality & exclude) != 0
+            pm25 = np.where(flagged[0], np.nan, pm25)
+            pm10 = np.where(flagged[1], np.nan, pm10)
+        return timestamp, pm25, pm10
+
+    def window_quality(self, start_epoch: int, end_epoch=None):
+        """
+        Quality flags of the measurements in a time window (see `window`), with
+        shape (2, n) for pm25 & pm10 (view, do not modify).
+        """
+        with self.lock:
+            idx_start, idx_end = self._indices(start_epoch, end_epoch)
+            return self.quality[:, idx_start:idx_end]
+
+    def window_interval(self, start_epoch: int, end_epoch=None):
+        """
+        Sampling interval of the measurements in a time window (see `window`;
+        nan if the file has no `interval` column; view, do not modify).
+        """
+        with self.lock:
+            idx_start, idx_end = self._indices(start_epoch, end_epoch)
+            return self.interval[idx_start:idx_end]
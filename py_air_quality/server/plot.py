@@ -1,8 +1,234 @@
 from datetime import datetime, timedelta
+from typing import List, Optional
 
 import numpy as np
 import pandas as pd
-import seaborn as sns
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from py_air_quality.crud.read_csv_data import interval_weights
+from py_air_quality.server.daytime_profile import daytime_profile, daytime_quantiles
+
+colours = [
+    [float(x) / 255.0 for x in [68, 138, 255, 255]],
+    [float(x) / 255.0 for x in [255, 0, 102, 255]],
+]
+
+# One label per pollutant (in the same order as the colours):
+labels = ["$PM_{10}$", "$PM_{2.5}$"]
+
+# Pre-laid-out figures, reused across calls of `plot_pollution` with
+# `reuse_figures=True` (by bin size, resolution, and current time marker):
+_figure_templates = {}
+
+
+def _band_polygons(x: np.ndarray, lower: np.ndarray, upper: np.ndarray):
+    """Polygons of a band between two lines, one per run of finite values."""
+    finite = np.isfinite(lower) & np.isfinite(upper)
+    edges = np.diff(np.concatenate([[False], finite, [False]]).astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    polygons = []
+    for start, end in zip(starts, ends):
+        polygons.append(
+            np.concatenate(
+                [
+                    np.column_stack([x[start:end], lower[start:end]]),
+                    np.column_stack([x[start:end], upper[start:end]])[::-1],
+                ]
+            )
+        )
+    return polygons
+
+
+class ProfileFigure:
+    """
+    Daytime profile figure, laid out once and updated with new data.
+
+    Axes, ticks, labels and legend are created when the figure is initialised.
+    `update` only changes the data of the median lines, percentile bands (10th
+    to 90th percentile), horizontal lines (overall mean), the current time
+    marker, and the legend text. Not thread-safe.
+    """
+
+    def __init__(self, *, bin_minutes: float, dpi: float, now_marker: bool):
+        self.dpi = dpi
+        n_bins = int(round(1440.0 / bin_minutes))
+        self.bin_centres = (np.arange(n_bins) + 0.5) * (bin_minutes / 60.0)
+        empty = np.full(n_bins, np.nan)
+
+        self.figure = Figure()
+        FigureCanvasAgg(self.figure)
+        axes = self.figure.subplots()
+
+        self.lines = []
+        self.bands = []
+        self.mean_lines = []
+        for idx_series in range(len(labels)):
+            (line,) = axes.plot(
+                self.bin_centres,
+                empty,
+                color=colours[idx_series],
+                linewidth=1.5,
+                label=labels[idx_series],
+            )
+            self.lines.append(line)
+            self.bands.append(
+                axes.fill_between(
+                    self.bin_centres,
+                    empty,
+                    empty,
+                    color=colours[idx_series],
+                    alpha=0.05,
+                    linewidth=0.0,
+                )
+            )
+            self.mean_lines.append(
+                axes.hlines(
+                    y=[],
+                    xmin=0.0,
+                    xmax=24.0,
+                    color=colours[idx_series],
+                    linewidth=1.0,
+                    linestyles="dotted",
+                )
+            )
+
+        axes.set_xlim(-0.5, 24.5)
+        axes.set_ylim(0.0, 21.0)
+
+        # Axis layout:
+        axes.set_xlabel("Time [hour]", fontsize=14)
+        axes.set_ylabel("Pollutant concentration [μg/m3]", fontsize=14)
+        axes.set_xticks([0.0, 6.0, 12.0, 18.0, 24.0])
+        axes.set_yticks([0.0, 5.0, 10.0, 15.0, 20.0])
+        axes.tick_params(labelsize=14)
+        axes.spines["top"].set_visible(False)
+        axes.spines["right"].set_visible(False)
+
+        # Vertical line representing current time:
+        if now_marker:
+            self.now_line = axes.axvline(
+                x=0.0,
+                ymin=0,
+                ymax=1,
+                color=[0.75, 0.75, 0.75],
+                linewidth=0.75,
+            )
+        else:
+            self.now_line = None
+
+        # Adjust legend:
+        self.legend = axes.legend(loc="upper right", frameon=False)
+
+        # Bounding box of the saved figure, determined on first save (the
+        # layout does not depend on the data):
+        self.bbox_inches = None
+
+    def update(
+        self,
+        *,
+        mean: np.ndarray,
+        weight: np.ndarray,
+        quantiles: np.ndarray,
+        local_now_hour: Optional[float] = None,
+    ):
+        """
+        Update the artists with a new daytime profile: mean & sum of weights
+        per bin (see `daytime_profile`), and the 10th, 50th & 90th percentile
+        (see `daytime_quantiles`).
+        """
+        lower, median, upper = quantiles
+        for idx_series in range(len(labels)):
+
+            self.lines[idx_series].set_ydata(median[idx_series])
+            self.bands[idx_series].set_verts(
+                _band_polygons(
+                    self.bin_centres,
+                    lower[idx_series],
+                    upper[idx_series],
+                )
+            )
+
+            # Mean particulate concentration (across all bins). When starting a
+            # new measurement, there will initially be missing data (e.g. the
+            # mean for weekends can't be calculated yet it a measurement was
+            # just started on a weekday). The bins are weighted like the
+            # readings (e.g. by sampling interval):
+            weight_total = np.sum(weight[idx_series])
+            if 0 < weight_total:
+                pollution_mean = (
+                    np.nansum(mean[idx_series] * weight[idx_series]) / weight_total
+                )
+                self.mean_lines[idx_series].set_segments(
+                    [[(0.0, pollution_mean), (24.0, pollution_mean)]]
+                )
+                label = "{} mean = {}".format(
+                    labels[idx_series], np.around(pollution_mean, decimals=1)
+                )
+            else:
+                self.mean_lines[idx_series].set_segments([])
+                label = labels[idx_series]
+            self.legend.texts[idx_series].set_text(label)
+
+        if (self.now_line is not None) and (local_now_hour is not None):
+            self.now_line.set_xdata([local_now_hour, local_now_hour])
+
+    def save(self, output, width: Optional[int] = None):
+        """
+        Save figure as png (to a path or file object), with a width of `width`
+        pixels (default: at resolution `dpi`).
+        """
+        if self.bbox_inches is None:
+            renderer = self.figure.canvas.get_renderer()
+            self.bbox_inches = self.figure.get_tightbbox(renderer).padded(0.1)
+        # The saved image only covers the bounding box:
+        dpi = self.dpi if width is None else (width / self.bbox_inches.width)
+        self.figure.savefig(
+            output,
+            format="png",
+            dpi=dpi,
+            bbox_inches=self.bbox_inches,
+        )
+
+
+def plot_profile(
+    *,
+    profile: dict,
+    output,
+    bin_minutes: float = 5.0,
+    dpi: float = 160.0,
+    width: Optional[int] = None,
+    now_marker: bool = False,
+    local_now_hour: Optional[float] = None,
+    reuse_figures: bool = False,
+):
+    """
+    Plot a daytime profile (dictionary with `mean`, `weight` & `quantiles`, see
+    `ProfileFigure.update`), and save it as png (to a path or file object). The
+    image is `width` pixels wide if given, else its resolution is `dpi`.
+
+    With `reuse_figures=True`, the figures are kept after saving, and only their
+    data is updated on the next call (for long-running processes).
+
+    """
+    template_key = (bin_minutes, dpi, now_marker)
+    if reuse_figures and (template_key in _figure_templates):
+        profile_figure = _figure_templates[template_key]
+    else:
+        profile_figure = ProfileFigure(
+            bin_minutes=bin_minutes, dpi=dpi, now_marker=now_marker
+        )
+        if reuse_figures:
+            _figure_templates[template_key] = profile_figure
+
+    profile_figure.update(
+        mean=profile["mean"],
+        weight=profile["weight"],
+        quantiles=profile["quantiles"],
+        local_now_hour=local_now_hour,
+    )
+    profile_figure.save(output, width=width)
 
 
 def plot_pollution(
@@ -11,139 +237,97 @@ def plot_pollution(
     utc_now: datetime,
     local_now_hour: float,
     path_plot: str,
+    bin_minutes: float = 5.0,
+    views: Optional[List[str]] = None,
+    dpi: float = 160.0,
+    width: Optional[int] = None,
+    reuse_figures: bool = False,
 ):
     """
     Plot air polution measurement data.
 
-    Separate plots for last 24 hours, weekends, weekdays, combined.
+    Separate plots for last 24 hours, weekends, weekdays, combined. Median, 10th
+    and 90th percentile (and the mean) are calculated per daytime bin of
+    `bin_minutes` minutes.
+    If `views` is given, only the listed plots are created. Returns the paths of
+    the created plots, by plot name. `df` needs the `timestamp`, `pm25`, `pm10`,
+    `daytime` and `weekend` columns (see `add_time_columns`). If it has an
+    `interval` column, readings are weighted by their sampling interval (see
+    `interval_weights`). The plots are `width` pixels wide if given, else their
+    resolution is `dpi`.
+
+    With `reuse_figures=True`, the figures are kept after saving, and only their
+    data is updated on the next call (for long-running processes).
 
     """
 
     yesterday_epoch = int(round((utc_now - timedelta(hours=24.0)).timestamp()))
-    df["last_24_h"] = np.greater_equal(df["timestamp"].values, yesterday_epoch)
-
-    # Create a timestamp ranging between 0 and 24:
-    hour = [float(x.hour) for x in df["datetime"].tolist()]
-    minute = [float(x.minute) for x in df["datetime"].tolist()]
-    daytime = np.add(hour, np.divide(minute, 60.0))
-    daytime = np.around(daytime, decimals=2)
-    df["daytime"] = daytime
-
-    # Currently, there is one row per measurement, with separate columns for the
-    # two y variables. We need to change this to 'long format', with one row per
-    # datapoint.
-    df_pm25 = df[["daytime", "weekend", "last_24_h", "pm25"]]
-    df_pm10 = df[["daytime", "weekend", "last_24_h", "pm10"]]
-    df_pm25 = df_pm25.rename(columns={"pm25": "pollution"})
-    df_pm10 = df_pm10.rename(columns={"pm10": "pollution"})
-    df_pm25["type"] = "pm25"
-    df_pm10["type"] = "pm10"
-    df = pd.concat([df_pm10, df_pm25], axis=0, ignore_index=True)
+    last_24_h = np.greater_equal(df["timestamp"].values, yesterday_epoch)
+
+    # Local time of day, ranging between 0 and 24 (see `add_time_columns`):
+    daytime = df["daytime"].to_numpy(dtype=np.float64)
+
+    # One row per pollutant (in the same order as the colours and labels):
+    pollution = np.stack(
+        [
+            df["pm10"].to_numpy(dtype=np.float64),
+            df["pm25"].to_numpy(dtype=np.float64),
+        ]
+    )
+
+    if "interval" in df.columns:
+        weights = interval_weights(
+            df["interval"].to_numpy(dtype=np.float64),
+            df["timestamp"].to_numpy(dtype=np.int64),
+        )
+    else:
+        weights = np.ones(len(df), dtype=np.int64)
 
     # --------------------------------------------------------------------------
     # *** Create plots
 
-    # df_weekend = df.loc[df["weekend"] == True]
-    # df_weekday = df.loc[df["weekend"] == False]
-    df_last_24_h = df.loc[df["last_24_h"] == True]
+    weekend = df["weekend"].to_numpy(dtype=bool)
 
     dict_plot = {
-        "last_24_h": df_last_24_h,
-        "combined": df,
-        # "weekday": df_weekday,
-        # "weekend": df_weekend,
+        "last_24_h": last_24_h,
+        "combined": np.ones(len(df), dtype=bool),
+        "weekday": np.logical_not(weekend),
+        "weekend": weekend,
     }
 
-    colours = [
-        [float(x) / 255.0 for x in [68, 138, 255, 255]],
-        [float(x) / 255.0 for x in [255, 0, 102, 255]],
-    ]
+    if views is not None:
+        dict_plot = {x: y for x, y in dict_plot.items() if x in views}
+
+    paths_plot = {}
 
     # Create separate plots for weekdays (Monday to Friday) and weekend
     # (Saturday and Sunday), which will be saved in separate figures.
-    for plot_name, df_plot in dict_plot.items():
-
-        graph = sns.lineplot(
-            x="daytime",
-            y="pollution",
-            hue="type",
-            data=df_plot,
-            estimator="mean",
-            ci="sd",
-            palette=colours,
-            err_style="band",
-            err_kws={
-                "alpha": 0.05,
-                "linewidth": 0.0,
-            },
-        )
+    for plot_name, selection in dict_plot.items():
 
-        graph.axes.set_xlim(-0.5, 24.5)
-        graph.axes.set_ylim(0.0, 21.0)
-
-        # Axis layout:
-        graph.axes.set_xlabel("Time [hour]", fontsize=14)
-        graph.axes.set_ylabel("Pollutant concentration [μg/m3]", fontsize=14)
-        graph.axes.set_xticks([0.0, 6.0, 12.0, 18.0, 24.0])
-        graph.axes.set_yticks([0.0, 5.0, 10.0, 15.0, 20.0])
-        graph.axes.tick_params(labelsize=14)
-        graph.axes.spines["top"].set_visible(False)
-        graph.axes.spines["right"].set_visible(False)
-
-        # Vertical line representing current time:
-        if plot_name == "last_24_h":
-            graph.axvline(
-                x=local_now_hour,
-                ymin=0,
-                ymax=1,
-                color=[0.75, 0.75, 0.75],
-                linewidth=0.75,
-            )
-
-        # Calculate and plot mean particulate concentration.
-        try:
-
-            pollution_mean = df_plot[["pollution", "type"]].groupby(["type"]).mean()
-            pm10_mean = pollution_mean.loc["pm10"].values[0]
-            pm25_mean = pollution_mean.loc["pm25"].values[0]
-            graph.hlines(
-                y=[pm10_mean, pm25_mean],
-                xmin=0.0,
-                xmax=24.0,
-                color=colours,
-                linewidth=1.0,
-                linestyles="dotted",
-            )
-
-            # Adjust legend:
-            graph.legend_.set_title(None)
-            graph.legend_.set_frame_on(False)
-            for i in range(3):
-                legend_text = graph.legend_.texts[i].get_text()
-                if legend_text == "pm25":
-                    graph.legend_.texts[i].set_text(
-                        "$PM_{2.5}$ mean = " + str(np.around(pm25_mean, decimals=1))
-                    )
-                elif legend_text == "pm10":
-                    graph.legend_.texts[i].set_text(
-                        "$PM_{10}$ mean = " + str(np.around(pm10_mean, decimals=1))
-                    )
-                elif legend_text == "type":
-                    graph.legend_.texts[i].set_text(None)
-
-        except Exception:
-
-            # When starting a new measurement, there will initially be missing
-            # data (e.g. the mean for weekends can't be calculated yet it a
-            # measurement was just started on a weekday).
-            pass
+        _, mean, _, _, weight = daytime_profile(
+            daytime=daytime[selection],
+            values=pollution[:, selection],
+            bin_minutes=bin_minutes,
+            weights=weights[selection],
+        )
+        quantiles = daytime_quantiles(
+            daytime=daytime[selection],
+            values=pollution[:, selection],
+            bin_minutes=bin_minutes,
+            weights=weights[selection],
+        )
 
         # Save figure:
-        figure = graph.get_figure()
-        figure.savefig(
-            path_plot.format(plot_name),
-            dpi=160.0,
-            bbox_inches="tight",
+        paths_plot[plot_name] = path_plot.format(plot_name)
+        plot_profile(
+            profile={"mean": mean, "weight": weight, "quantiles": quantiles},
+            output=paths_plot[plot_name],
+            bin_minutes=bin_minutes,
+            dpi=dpi,
+            width=width,
+            now_marker=(plot_name == "last_24_h"),
+            local_now_hour=local_now_hour,
+            reuse_figures=reuse_figures,
         )
 
-        figure.clf()
+    return paths_plot
@@ -7,16 +7,33 @@ py-air-quality/py_air_quality/internal/.credentials
 Can be run as a cron job (e.g. on remote server):
 */5 * * * * /home/john/py_main/bin/python /home/john/air_quality/py-air-quality/py_air_quality/server/plot_pollution_from_db.py >> /home/john/air_quality/crontab_log_plot.txt 2>&1
 
+Plots are only rendered again if their inputs changed (see
+`py_air_quality.server.render_manifest`), so combinations without new data cost
+one aggregation query per run.
+
+To avoid the start-up cost of every cron run (imports, database connection),
+the same plots can be rendered by a long-lived process instead, see
+`py_air_quality.server.render_daemon`. It can also render the plots as soon as
+new data is committed to the database (instead of waiting 70 s for the
+measurement, and up to 5 min for the next run).
+
 """
 
+import os
+import time
 from datetime import datetime, timedelta, timezone
-from time import sleep
 
 import pandas as pd
 import pymongo
 from dateutil import tz
+from py_air_quality.crud.data_quality import exclude_flagged
+from py_air_quality.crud.read_csv_data import add_time_columns
+from py_air_quality.internal import profiling
+from py_air_quality.internal.content_hash import job_key
 from py_air_quality.internal.credentials import credentials
+from py_air_quality.internal.metrics import Registry, freshness_buckets
 from py_air_quality.server.plot import plot_pollution
+from py_air_quality.server.render_manifest import RenderManifest
 
 # ------------------------------------------------------------------------------
 # *** Define parameters
@@ -51,12 +68,57 @@ combinations = [
 # e.g. 'last_24h'):
 path_plot = "/home/john/website/site/air_quality_live_data/{}_{}_{}.png"
 
+# Manifest with hashes of the inputs & content of the plots (used to skip
+# rendering of plots whose inputs did not change):
+path_manifest = os.path.join(os.path.dirname(path_plot), "render_manifest.json")
+
 # When querying data for aggregate plots, include data from last x days:
 last_x_days = 30
 
+# Width of daytime bins in plots, in minutes. The marker for the current time is
+# rounded to the same resolution.
+bin_minutes = 5.0
+
 # Time zone used for plots:
 local_time_zone_name = "Europe/Berlin"
 
+# Metrics of each run, in the Prometheus text format (e.g. for the textfile
+# collector of the Prometheus node exporter; not in the public plot directory):
+path_metrics = "/home/john/air_quality/metrics/plot_pollution_from_db.prom"
+
+# Directory for profiling reports, if profiling is enabled (see
+# `py_air_quality.internal.profiling`):
+profile_directory = "/home/john/air_quality/"
+
+
+# ------------------------------------------------------------------------------
+# *** Metrics
+
+metrics = Registry(script="plot_pollution_from_db")
+
+rendered_plots = metrics.counter(
+    "rendered_plots_total", "Number of rendered plots.", ["view"]
+)
+skipped_plots = metrics.counter(
+    "skipped_plots_total", "Number of plots skipped (inputs unchanged)."
+)
+datapoints_last_24_h = metrics.gauge(
+    "datapoints_last_24_h",
+    "Number of datapoints in the database from the last 24 hours.",
+    ["location", "condition"],
+)
+newest_timestamp = metrics.gauge(
+    "newest_datapoint_timestamp_seconds",
+    "Timestamp of the newest datapoint in the database (epoch seconds).",
+    ["location", "condition"],
+)
+plot_freshness = metrics.histogram(
+    "plot_freshness_seconds",
+    "Age of the newest datapoint when its plots were rendered.",
+    ["location", "condition"],
+    buckets=freshness_buckets,
+)
+
 
 # ------------------------------------------------------------------------------
 # *** Load database credentials from .credentials file
@@ -68,86 +130,261 @@ mongodb_url = credentials.MONGODB_CONNECTION_URL
 mongodb_tsl_cert = credentials.PATH_MONGODB_TSL_CERTIFICATE
 
 
-# ------------------------------------------------------------------------------
-# *** Query data from mongodb
-
-# Wait for the measurement to finish (assuming that the measurement is done at
-# the same frequency, through cron tab).
-sleep(70)
+def query_high_water_mark(db_collection, dict_search: dict, yesterday_epoch: int):
+    """
+    Get number of datapoints, number of datapoints with quality flags (see
+    `py_air_quality.crud.data_quality`), and first & last timestamp in the plot
+    windows.
+
+    Computed by the database in a single round trip, without transferring the
+    measurement data. Returns a dictionary with the statistics for the full
+    window and for the last 24 hours.
+    """
+    in_last_24_h = {"$gte": ["$timestamp", yesterday_epoch]}
+    # Measurements without quality columns are not flagged:
+    is_flagged = {
+        "$or": [
+            {"$gt": [{"$ifNull": ["$quality_pm25", 0]}, 0]},
+            {"$gt": [{"$ifNull": ["$quality_pm10", 0]}, 0]},
+        ]
+    }
+    pipeline = [
+        {"$match": dict_search},
+        {
+            "$group": {
+                "_id": None,
+                "count": {"$sum": 1},
+                "first": {"$min": "$timestamp"},
+                "last": {"$max": "$timestamp"},
+                "count_last_24_h": {"$sum": {"$cond": [in_last_24_h, 1, 0]}},
+                "flagged": {"$sum": {"$cond": [is_flagged, 1, 0]}},
+                "flagged_last_24_h": {
+                    "$sum": {"$cond": [{"$and": [in_last_24_h, is_flagged]}, 1, 0]}
+                },
+                "first_last_24_h": {
+                    "$min": {"$cond": [in_last_24_h, "$timestamp", None]}
+                },
+            }
+        },
+    ]
+    results = list(db_collection.aggregate(pipeline))
+    if results:
+        results = results[0]
+        results.pop("_id")
+        return results
+    return {
+        "count": 0,
+        "first": None,
+        "last": None,
+        "count_last_24_h": 0,
+        "first_last_24_h": None,
+        "flagged": 0,
+        "flagged_last_24_h": 0,
+    }
+
+
+def query_measurements(db_collection, dict_search: dict, local_time_zone):
+    """
+    Query measurement data from database, and add time columns. Readings with
+    quality flags (see `py_air_quality.crud.data_quality`) are nan. The sampling
+    interval is nan for measurements without one.
+    """
+    columns = [
+        "timestamp",
+        "pm25",
+        "pm10",
+        "quality_pm25",
+        "quality_pm10",
+        "interval",
+    ]
+    with metrics.time_stage("db_query"):
+        search_results = db_collection.find(
+            dict_search,
+            projection={"_id": False, **{x: True for x in columns}},
+        )
 
-# Get current UTC with time zone info (so it can be transformed to local time).
-utc_now = datetime.now(timezone.utc)
+        data = [x for x in search_results]
 
-# Current, local time:
-local_time_zone = tz.gettz(local_time_zone_name)
-local_now = utc_now.astimezone(local_time_zone)
+    with metrics.time_stage("transform"):
+        # Measurements committed before quality flags were introduced have no
+        # flags (unless they were backfilled):
+        df = pd.DataFrame(data, columns=columns)
+        df = exclude_flagged(df).drop(columns=["quality_pm25", "quality_pm10"])
 
-local_now_hour = float(local_now.hour) + (float(local_now.minute) / 60.0)
+        # 'datetime' and 'timestamp' from database should match, but use epoch
+        # timestamp as single source of truth and apply time zone conversion.
+        df = add_time_columns(df, local_time_zone=local_time_zone)
+
+    return df
+
+
+def render_combination(
+    *,
+    db_collection,
+    combination: dict,
+    manifest: RenderManifest,
+    utc_now: datetime,
+    local_time_zone,
+    reuse_figures: bool = False,
+):
+    """
+    Create plots for one combination of location, condition & sensor type.
+
+    Plots whose job key (hash of the inputs) matches the manifest are skipped.
+    Returns the names of the plots that were rendered. Long-running processes
+    can reuse figures between calls (see `plot_pollution`).
+    """
+    measurement_location = combination["measurement_location"]
+    experimental_condition = combination["experimental_condition"]
+    sensor_type = combination["sensor_type"]
+
+    start_epoch = int(round((utc_now - timedelta(days=last_x_days)).timestamp()))
+    yesterday_epoch = int(round((utc_now - timedelta(hours=24.0)).timestamp()))
+
+    # Current, local time, rounded to the resolution of the plot:
+    local_now = utc_now.astimezone(local_time_zone)
+    local_now_hour = float(local_now.hour) + (float(local_now.minute) / 60.0)
+    bin_hours = bin_minutes / 60.0
+    local_now_hour = round(local_now_hour / bin_hours) * bin_hours
+
+    dict_search = {
+        "timestamp": {"$gt": start_epoch},
+        "experimental_condition": experimental_condition,
+        "measurement_location": measurement_location,
+        "sensor_type": sensor_type,
+    }
+
+    with metrics.time_stage("db_aggregate"):
+        high_water_mark = query_high_water_mark(
+            db_collection, dict_search, yesterday_epoch
+        )
 
-start_epoch = int(round((utc_now - timedelta(days=last_x_days)).timestamp()))
+    labels = {"location": measurement_location, "condition": experimental_condition}
+    datapoints_last_24_h.set(high_water_mark["count_last_24_h"], **labels)
+    if high_water_mark["last"] is not None:
+        newest_timestamp.set(high_water_mark["last"], **labels)
+
+    # Fill in measurement location and experimental condition into plot
+    # name, but leave name for time condition (e.g. 'last_24h') open.
+    path_tmp = path_plot.format(
+        measurement_location.replace(" ", "_").lower(), experimental_condition, "{}"
+    )
+
+    # Inputs of each plot. The window bounds are the first & last timestamp of
+    # the data within the window, so that the key only changes when data enters
+    # or leaves the window, or when readings are flagged (flagged readings are
+    # not plotted, see `query_measurements`).
+    job_keys = {
+        "last_24_h": job_key(
+            combination=combination,
+            view="last_24_h",
+            bin_minutes=bin_minutes,
+            count=high_water_mark["count_last_24_h"],
+            flagged=high_water_mark["flagged_last_24_h"],
+            first=high_water_mark["first_last_24_h"],
+            last=high_water_mark["last"],
+            local_now_hour=local_now_hour,
+        ),
+        "combined": job_key(
+            combination=combination,
+            view="combined",
+            bin_minutes=bin_minutes,
+            count=high_water_mark["count"],
+            flagged=high_water_mark["flagged"],
+            first=high_water_mark["first"],
+            last=high_water_mark["last"],
+        ),
+    }
+
+    views = [
+        view
+        for view, key in job_keys.items()
+        if not manifest.is_current(path_tmp.format(view), key)
+    ]
+
+    skipped_plots.inc(len(job_keys) - len(views))
+
+    if not views:
+        return views
+
+    # ----------------------------------------------------------------------
+    # *** Transform data
+
+    df = query_measurements(db_collection, dict_search, local_time_zone)
+
+    # Create plots:
+    with metrics.time_stage("render"):
+        paths_plot = plot_pollution(
+            df=df,
+            utc_now=utc_now,
+            local_now_hour=local_now_hour,
+            path_plot=path_tmp,
+            bin_minutes=bin_minutes,
+            views=views,
+            reuse_figures=reuse_figures,
+        )
 
-with pymongo.MongoClient(
-    mongodb_url,
-    username=mongodb_username,
-    authMechanism="MONGODB-X509",
-    tls=True,
-    tlsCertificateKeyFile=mongodb_tsl_cert,
-) as client:
+    for view, path_view in paths_plot.items():
+        manifest.record(path_view, job_keys[view])
+        rendered_plots.inc(view=view)
+    if high_water_mark["last"] is not None:
+        plot_freshness.observe(time.time() - high_water_mark["last"], **labels)
 
-    db = client.air_quality
+    return views
 
-    db_collection = db["air_quality"]
 
-    for combination in combinations:
+def main():
+    # Wait for the measurement to finish (assuming that the measurement is done
+    # at the same frequency, through cron tab).
+    time.sleep(70)
 
-        measurement_location = combination["measurement_location"]
-        experimental_condition = combination["experimental_condition"]
-        sensor_type = combination["sensor_type"]
+    profiling.start("plot_pollution_from_db", profile_directory)
 
-        dict_search = {
-            "timestamp": {"$gt": start_epoch},
-            "experimental_condition": experimental_condition,
-            "measurement_location": measurement_location,
-            "sensor_type": sensor_type,
-        }
+    # Get current UTC with time zone info (so it can be transformed to local
+    # time).
+    utc_now = datetime.now(timezone.utc)
 
-        search_results = db_collection.find(dict_search)
+    local_time_zone = tz.gettz(local_time_zone_name)
 
-        # ----------------------------------------------------------------------
-        # *** Transform data
+    manifest = RenderManifest(path_manifest)
 
-        data = [x for x in search_results]
+    try:
+        with pymongo.MongoClient(
+            mongodb_url,
+            username=mongodb_username,
+            authMechanism="MONGODB-X509",
+            tls=True,
+            tlsCertificateKeyFile=mongodb_tsl_cert,
+        ) as client:
 
-        df = pd.DataFrame(data)
+            db = client.air_quality
 
-        # 'datetime' and 'timestamp' from database should match, but use epoch
-        # timestamp as single source of truth and apply time zone conversion.
-        df = df[["timestamp", "pm25", "pm10"]]
+            db_collection = db["air_quality"]
 
-        df["datetime"] = [
-            datetime.fromtimestamp(x, tz=timezone.utc) for x in df["timestamp"].tolist()
-        ]
+            for combination in combinations:
 
-        # Convert datetime to local time:
-        df["datetime"] = [
-            x.astimezone(local_time_zone) for x in df["datetime"].tolist()
-        ]
+                views = render_combination(
+                    db_collection=db_collection,
+                    combination=combination,
+                    manifest=manifest,
+                    utc_now=utc_now,
+                    local_time_zone=local_time_zone,
+                )
 
-        # Add column for hour of the day:
+                msg = "{} / {}: rendered {}".format(
+                    combination["measurement_location"],
+                    combination["experimental_condition"],
+                    ", ".join(views) if views else "nothing (inputs unchanged)",
+                )
+                print(msg)
 
-        # Add column for weekday (where Monday is 0 and Sunday is 6):
-        df["weekday"] = [x.weekday() for x in df["datetime"].tolist()]
+        manifest.save()
+        metrics.mark_success()
 
-        # Add column for weekend (binary; 0 = weekday, 1 = weekend):
-        df["weekend"] = [(5 <= x) for x in df["weekday"].tolist()]
+    finally:
+        # Also written if the run fails, so that failed stages are recorded:
+        metrics.write_textfile(path_metrics)
 
-        # Fill in measurement location and experimental condition into plot
-        # name, but leave name for time condition (e.g. 'last_24h') open.
-        path_tmp = path_plot.format(
-            measurement_location.replace(" ", "_").lower(), experimental_condition, "{}"
-        )
 
-        # Create plots:
-        plot_pollution(
-            df=df, utc_now=utc_now, local_now_hour=local_now_hour, path_plot=path_tmp
-        )
+if __name__ == "__main__":
+    main()
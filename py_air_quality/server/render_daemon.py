@@ -0,0 +1,359 @@
+"""
+Render the plots of `plot_pollution_from_db.py` in a long-lived process.
+
+Instead of starting a new interpreter every 5 minutes (cron job), the render
+daemon imports pandas & matplotlib once, keeps one database connection open,
+and reuses the laid-out figures (and the fonts cached by matplotlib) between
+runs. Plots whose inputs did not change are skipped, as in the cron job.
+
+Three modes:
+- `schedule` (default): render every `--interval` seconds, `--offset` seconds
+  after the interval boundary (like the cron job, which waits 70 s for the
+  measurement to finish).
+- `poll`: check for new data every `--poll-seconds` seconds, and render as soon
+  as the data of a plot changed (one aggregation query per combination and
+  check).
+- `watch`: render the plots of a combination as soon as new data of the
+  combination is inserted into the database (e.g. by
+  `py_air_quality/crud/commit_daemon.py`), or quality flags are updated (see
+  `py_air_quality/crud/data_quality.py`), using a MongoDB change stream.
+  Nothing is queried or rendered while there is no new data. Change streams
+  require a replica set (e.g. MongoDB Atlas); if they are not available, the
+  daemon falls back to the `poll` mode.
+
+The age of the newest datapoint when its plots are rendered (i.e. the time from
+measurement to updated plot) is recorded in the metrics
+(`plot_freshness_seconds`).
+
+Start-up time (imports, connection, first render) and the duration of each run
+are logged, and written to the metrics file (`render_daemon.prom`, next to the
+metrics of the cron job).
+
+Can be run as a service, e.g. with a systemd unit file (see
+`py_air_quality/measurement/measurement_continuous.py` for how to set up a
+service):
+```
+[Unit]
+Description=Python Air Quality Render Daemon
+After=network-online.target
+
+[Service]
+User=john
+Type=simple
+Restart=always
+ExecStart=/home/john/py_main/bin/python /home/john/air_quality/py-air-quality/py_air_quality/server/render_daemon.py
+
+[Install]
+WantedBy=multi-user.target
+```
+
+Remove the cron job of `plot_pollution_from_db.py` when using the daemon.
+
+"""
+
+import time
+
+# Measure import time (the start-up cost that the daemon pays only once):
+_t_import = time.perf_counter()
+
+import argparse
+import logging
+import os
+import signal
+import sys
+from datetime import datetime, timezone
+
+import pymongo
+from dateutil import tz
+
+from py_air_quality.server import plot_pollution_from_db
+from py_air_quality.server.render_manifest import RenderManifest
+
+import_seconds = time.perf_counter() - _t_import
+
+# ------------------------------------------------------------------------------
+# *** Metrics
+
+metrics = plot_pollution_from_db.metrics
+
+path_metrics = os.path.join(
+    os.path.dirname(plot_pollution_from_db.path_metrics), "render_daemon.prom"
+)
+
+startup_seconds = metrics.gauge(
+    "startup_seconds",
+    "Start-up time of the render daemon, by phase.",
+    ["phase"],
+)
+run_seconds = metrics.histogram(
+    "render_run_seconds",
+    "Duration of one render run (all combinations).",
+    ["first"],
+)
+change_events = metrics.counter(
+    "change_events_total",
+    "Number of insertions & updates received from the change stream.",
+)
+
+# Fields that identify a combination (see `plot_pollution_from_db.combinations`):
+combination_fields = ("measurement_location", "experimental_condition", "sensor_type")
+
+# Maximum time that the change stream waits for new events before returning
+# control to the daemon, in milliseconds (insertions of the same commit that
+# arrive within this time are rendered together):
+watch_await_ms = 500
+
+
+class RenderDaemon:
+    """
+    Render plots from the database in a loop, with a persistent connection.
+    """
+
+    def __init__(
+        self,
+        *,
+        mode: str = "schedule",
+        interval: float = 300.0,
+        offset: float = 70.0,
+        poll_seconds: float = 30.0,
+    ):
+        self.logger = self._init_logger()
+
+        # Enable graceful shutdown of the service:
+        signal.signal(signal.SIGTERM, self._handle_sigterm)
+        signal.signal(signal.SIGINT, self._handle_sigterm)
+
+        self.mode = mode
+        self.interval = interval
+        self.offset = offset
+        self.poll_seconds = poll_seconds
+        self.continue_rendering = True
+        self.n_runs = 0
+
+        self.local_time_zone = tz.gettz(plot_pollution_from_db.local_time_zone_name)
+        self.manifest = RenderManifest(plot_pollution_from_db.path_manifest)
+
+        startup_seconds.set(import_seconds, phase="imports")
+        self.logger.info("Imports: {:.2f} s".format(import_seconds))
+
+        t1 = time.perf_counter()
+        self.client = self._connect()
+        self.db_collection = self.client.air_quality["air_quality"]
+        connect_seconds = time.perf_counter() - t1
+        startup_seconds.set(connect_seconds, phase="connect")
+        self.logger.info("Database connection: {:.2f} s".format(connect_seconds))
+
+    def _init_logger(self):
+        logger = logging.getLogger(__name__)
+        logger.setLevel(logging.DEBUG)
+        stdout_handler = logging.StreamHandler()
+        stdout_handler.setLevel(logging.DEBUG)
+        stdout_handler.setFormatter(logging.Formatter("%(levelname)8s | %(message)s"))
+        logger.addHandler(stdout_handler)
+        return logger
+
+    @staticmethod
+    def _connect():
+        """Open the database connection (and wait until it is established)."""
+        client = pymongo.MongoClient(
+            plot_pollution_from_db.mongodb_url,
+            username=plot_pollution_from_db.mongodb_username,
+            authMechanism="MONGODB-X509",
+            tls=True,
+            tlsCertificateKeyFile=plot_pollution_from_db.mongodb_tsl_cert,
+        )
+        client.admin.command("ping")
+        return client
+
+    def run_once(self, combinations=None):
+        """
+        Render the plots of all combinations (or of the given combinations)
+        whose inputs changed.
+        """
+        if combinations is None:
+            combinations = plot_pollution_from_db.combinations
+        utc_now = datetime.now(timezone.utc)
+        first = self.n_runs == 0
+        t1 = time.perf_counter()
+
+        rendered = []
+        for combination in combinations:
+            try:
+                views = plot_pollution_from_db.render_combination(
+                    db_collection=self.db_collection,
+                    combination=combination,
+                    manifest=self.manifest,
+                    utc_now=utc_now,
+                    local_time_zone=self.local_time_zone,
+                    reuse_figures=True,
+                )
+            except pymongo.errors.PyMongoError as error:
+                # The client reconnects by itself; try again on the next run.
+                self.logger.error("Database error: {}".format(error))
+                continue
+            rendered.extend(
+                "{} / {}: {}".format(
+                    combination["measurement_location"],
+                    combination["experimental_condition"],
+                    view,
+                )
+                for view in views
+            )
+
+        self.manifest.save()
+        metrics.mark_success()
+
+        duration = time.perf_counter() - t1
+        run_seconds.observe(duration, first=str(first).lower())
+        if first:
+            startup_seconds.set(duration, phase="first_render")
+        metrics.write_textfile(path_metrics)
+        self.n_runs += 1
+
+        msg = "Run {} ({:.2f} s): rendered {}".format(
+            self.n_runs,
+            duration,
+            ", ".join(rendered) if rendered else "nothing (inputs unchanged)",
+        )
+        self.logger.info(msg)
+        return rendered
+
+    def watch(self):
+        """
+        Render the plots of the combinations whose data is inserted into the
+        database (or whose quality flags are updated), until stopped. Raises
+        `OperationFailure` if change streams are not available.
+        """
+        # Only updates of the quality flags can change the plots. Update events
+        # do not contain the combination (a lookup per event would be slow,
+        # e.g. when the flags of the whole history are computed), so the plots
+        # of all combinations are checked after them (only those whose job key
+        # changed are rendered):
+        quality_update = {
+            "operationType": "update",
+            "$or": [
+                {"updateDescription.updatedFields." + x: {"$exists": True}}
+                for x in ("quality_pm25", "quality_pm10")
+            ],
+        }
+        pipeline = [
+            {"$match": {"$or": [{"operationType": "insert"}, quality_update]}},
+            {
+                "$project": {
+                    "operationType": True,
+                    **{"fullDocument." + x: True for x in combination_fields},
+                }
+            },
+        ]
+        with self.db_collection.watch(
+            pipeline, max_await_time_ms=watch_await_ms
+        ) as stream:
+            self.logger.info("Watching for new data.")
+            while self.continue_rendering:
+                # Collect the combinations of all changes that are available:
+                changed = set()
+                updated = False
+                change = stream.try_next()
+                while change is not None:
+                    change_events.inc()
+                    if change.get("operationType") == "update":
+                        updated = True
+                    else:
+                        document = change.get("fullDocument", {})
+                        changed.add(tuple(document.get(x) for x in combination_fields))
+                    change = stream.try_next()
+                if updated:
+                    changed = {
+                        tuple(x[y] for y in combination_fields)
+                        for x in plot_pollution_from_db.combinations
+                    }
+                combinations = [
+                    x
+                    for x in plot_pollution_from_db.combinations
+                    if tuple(x[y] for y in combination_fields) in changed
+                ]
+                if combinations:
+                    self.run_once(combinations)
+
+    def _seconds_until_next_run(self):
+        if self.mode == "poll":
+            return self.poll_seconds
+        now = time.time()
+        next_run = (now - self.offset) // self.interval * self.interval
+        next_run += self.interval + self.offset
+        return next_run - now
+
+    def _sleep(self, seconds: float):
+        """Sleep in short steps, so that a stop request is handled quickly."""
+        wake_up = time.monotonic() + seconds
+        while self.continue_rendering and (time.monotonic() < wake_up):
+            time.sleep(min(1.0, max(0.0, wake_up - time.monotonic())))
+
+    def start(self):
+        """Render in a loop until stopped."""
+        self.logger.info("Render daemon started (mode: {}).".format(self.mode))
+        self.run_once()
+        while self.continue_rendering:
+            if self.mode == "watch":
+                try:
+                    self.watch()
+                except pymongo.errors.OperationFailure as error:
+                    # E.g. standalone server (change streams need a replica
+                    # set), or missing permissions.
+                    msg = "Change stream not available ({}), switching to poll mode."
+                    self.logger.warning(msg.format(error))
+                    self.mode = "poll"
+                except pymongo.errors.PyMongoError as error:
+                    # Insertions during the interruption are picked up by
+                    # rendering all combinations whose inputs changed:
+                    self.logger.error("Database error: {}".format(error))
+                    self._sleep(self.poll_seconds)
+                    self.run_once()
+                continue
+            self._sleep(self._seconds_until_next_run())
+            if self.continue_rendering:
+                self.run_once()
+        self.client.close()
+        self.logger.info("Render daemon stopped.")
+
+    def _handle_sigterm(self, sig, frame):
+        self.logger.info("Stop requested, finishing current run.")
+        self.continue_rendering = False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Render the plots from the database in a long-lived process."
+    )
+    parser.add_argument(
+        "--mode", choices=["schedule", "poll", "watch"], default="schedule"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=300.0, help="Seconds between runs."
+    )
+    parser.add_argument(
+        "--offset",
+        type=float,
+        default=70.0,
+        help="Seconds after the interval boundary (schedule mode).",
+    )
+    parser.add_argument(
+        "--poll-seconds",
+        type=float,
+        default=30.0,
+        help="Seconds between checks for new data (poll mode, and fallback).",
+    )
+    args = parser.parse_args(argv)
+
+    daemon = RenderDaemon(
+        mode=args.mode,
+        interval=args.interval,
+        offset=args.offset,
+        poll_seconds=args.poll_seconds,
+    )
+    daemon.start()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
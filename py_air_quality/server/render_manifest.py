@@ -0,0 +1,62 @@
+"""
+Content-addressed bookkeeping of rendered plots.
+
+Each render job is identified by a hash of its inputs (e.g. data high-water
+mark, window bounds, view; see `py_air_quality.internal.content_hash`). The
+manifest, a json file next to the plots, maps
+each artifact to the key of the job that produced it and to the hash of the
+artifact itself, so unchanged jobs can be skipped, and the artifact hash can be
+used as a strong ETag.
+
+"""
+
+import json
+import os
+
+from py_air_quality.internal.content_hash import file_hash
+
+
+class RenderManifest:
+    """
+    Job keys and artifact hashes of rendered plots, persisted as json file.
+    """
+
+    def __init__(self, path_manifest: str):
+        self.path_manifest = path_manifest
+        self.entries = {}
+        if os.path.isfile(path_manifest):
+            try:
+                with open(path_manifest, "r") as json_file:
+                    self.entries = json.load(json_file)
+            except ValueError:
+                # A corrupt manifest only means that everything is rendered
+                # again.
+                self.entries = {}
+
+    def is_current(self, path_artifact: str, key: str) -> bool:
+        """Whether the artifact exists and was produced by the same job."""
+        entry = self.entries.get(path_artifact)
+        if entry is None:
+            return False
+        return (entry["job_key"] == key) and os.path.isfile(path_artifact)
+
+    def record(self, path_artifact: str, key: str):
+        """Store job key and artifact hash after rendering the artifact."""
+        self.entries[path_artifact] = {
+            "job_key": key,
+            "etag": file_hash(path_artifact),
+        }
+
+    def etag(self, path_artifact: str):
+        """Hash of the artifact content (None if unknown)."""
+        entry = self.entries.get(path_artifact)
+        if entry is None:
+            return None
+        return entry["etag"]
+
+    def save(self):
+        """Write manifest to disk (atomically, the server may read it)."""
+        path_tmp = self.path_manifest + ".tmp"
+        with open(path_tmp, "w") as json_file:
+            json.dump(self.entries, json_file, indent=1, sort_keys=True)
+        os.replace(path_tmp, self.path_manifest)
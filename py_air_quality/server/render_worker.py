@@ -0,0 +1,72 @@
+"""
+Render a single plot in a worker process.
+
+Used by `server.py` to render plots on demand in a process pool, so that
+rendering does not block the event loop of the server. Worker processes are
+long-lived, so figures are reused between render jobs. Plots over many days are
+rendered from a daytime profile computed by the server (see
+`py_air_quality.server.daytime_sketches`), so only the profile is sent to the
+worker, not the readings.
+
+"""
+
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from py_air_quality.crud.read_csv_data import add_time_columns
+from py_air_quality.server.plot import plot_pollution, plot_profile
+
+
+def render_view(
+    *,
+    timestamp: np.ndarray,
+    pm25: np.ndarray,
+    pm10: np.ndarray,
+    view: str,
+    utc_now_epoch: float,
+    local_now_hour: float,
+    width: int,
+    bin_minutes: float,
+    path_png: str,
+    interval=None,
+):
+    """
+    Render one view of the daytime profile plot into a png file (`interval`:
+    sampling interval of the readings, if known).
+    """
+    df = pd.DataFrame({"timestamp": timestamp, "pm25": pm25, "pm10": pm10})
+    if interval is not None:
+        df["interval"] = interval
+    df = add_time_columns(df)
+
+    plot_pollution(
+        df=df,
+        utc_now=datetime.fromtimestamp(utc_now_epoch, tz=timezone.utc),
+        local_now_hour=local_now_hour,
+        path_plot=path_png.replace("{", "{{").replace("}", "}}"),
+        bin_minutes=bin_minutes,
+        views=[view],
+        width=width,
+        reuse_figures=True,
+    )
+
+
+def render_profile_view(
+    *,
+    profile: dict,
+    local_now_hour: float,
+    width: int,
+    bin_minutes: float,
+    path_png: str,
+):
+    """Render a daytime profile (see `plot.plot_profile`) into a png file."""
+    plot_profile(
+        profile=profile,
+        output=path_png,
+        bin_minutes=bin_minutes,
+        width=width,
+        local_now_hour=local_now_hour,
+        reuse_figures=True,
+    )
@@ -3,15 +3,82 @@
 """
 Serve air polution plots via local network.
 
-Assumes that the respective image files are created by
-`py_air_quality/analysis/plot_pollution.py`
+Plots are rendered on demand from the measurement csv files in the data
+directory, e.g.:
+
+/plot/berlin_kreuzberg/baseline/combined?days=30&width=1024
+
+Rendering happens in a worker process pool on a cache miss; rendered plots are
+kept in a memory- and disk-bounded LRU cache. Responses carry a strong ETag, so
+that repeated requests with `If-None-Match` are answered with `304 Not
+Modified`.
+
+Measurement data can be requested as json or Arrow IPC stream (the latter
+requires `pip install pyarrow`), downsampled to a maximum number of points,
+e.g.:
+
+/data/berlin_kreuzberg/baseline?start=1618440344&end=1619624145&points=1000
+
+New readings are pushed as Server-Sent Events as soon as they are recorded (the
+measurement scripts notify the server via UDP, see `NOTIFY_ADDRESSES` and
+`NOTIFY_LISTEN_ADDRESS` in the `.env` file), e.g.:
+
+/stream/berlin_kreuzberg/baseline
+
+Rolling statistics of the live readings (e.g. 1-hour mean, see
+`py_air_quality/internal/rolling.py`) are updated with each notification, and
+available at `/statistics/berlin_kreuzberg/baseline`. Threshold alerts (see
+`ALERTS` in the `.env` file) are pushed to live stream clients as `alert`
+events.
+
+Plots over more than one day (`combined`, `weekday` and `weekend`) show the
+median and the 10th & 90th percentile per daytime bin of the last `days`
+calendar days (including today). They are computed from quantile sketches per
+day (see `py_air_quality/server/daytime_sketches.py`), which are updated with
+new readings, so a plot over a year does not need to scan a year of readings.
+
+Readings that are flagged as spikes, stuck or out of range (see
+`py_air_quality/crud/data_quality.py`) are left out of the plots.
+
+Request latencies, render durations, cache hits and live stream subscribers are
+exposed in the Prometheus text format at `/metrics`.
+
+The server keeps this state in memory, so run it with a single worker process.
 """
 
+import asyncio
+import json
 import os
-from fastapi import FastAPI
-from fastapi.responses import FileResponse
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from multiprocessing import get_context
+from typing import Optional
+
+import numpy as np
+from dateutil import tz
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import (
+    JSONResponse, PlainTextResponse, Response, StreamingResponse)
 
+from py_air_quality.crud.data_quality import exclude_default
+from py_air_quality.crud.read_csv_data import interval_weights
+from py_air_quality.crud.time_features import (
+    epoch_from_wall_clock, time_features)
+from py_air_quality.internal.artifact_cache import ArtifactCache
+from py_air_quality.internal.content_hash import job_key
+from py_air_quality.internal.metrics import Registry
+from py_air_quality.internal.notify import parse_addresses
+from py_air_quality.internal.rolling import RollingStatistics, parse_alerts
 from py_air_quality.internal.settings import settings
+from py_air_quality.server.broadcast import Broadcaster
+from py_air_quality.server.daytime_sketches import DaytimeSketches
+from py_air_quality.server.downsample import methods
+from py_air_quality.server.measurement_store import MeasurementStore
+from py_air_quality.server.render_worker import (
+    render_profile_view, render_view)
 
 
 # Load settings from .env file
@@ -19,47 +86,639 @@ from py_air_quality.internal.settings import settings
 # Experimental condition, e.g. 'baseline' or 'with_filter':
 experimental_condition = settings.EXPERIMENTAL_CONDITION
 
+# Measurement location, e.g. 'Berlin Kreuzberg' (in URLs: 'berlin_kreuzberg'):
+measurement_location = settings.MEASUREMENT_LOCATION.replace(' ', '_').lower()
+
 # Directory where to find data, and save plots (e.g. '/home/pi/air_quality/'):
 data_directory = settings.DATA_DIRECTORY
 
-img_path_last_24_h = os.path.join(
-    data_directory,
-    '{}_last_24_h.png'.format(experimental_condition)
-    )
+# Plots that can be requested:
+views = ['last_24_h', 'combined', 'weekday', 'weekend']
 
-img_path_combined = os.path.join(
-    data_directory,
-    '{}_combined.png'.format(experimental_condition)
-    )
+# Number of days included in the plots of the fixed URLs (e.g. '/combined'):
+legacy_days = 365
+
+# Width of daytime bins in plots, in minutes:
+bin_minutes = 5.0
+
+# Maximum time range of data requests, in days:
+max_data_days = 366
+
+# Send a comment to idle live streams every x seconds (keeps proxies from
+# closing the connection):
+keepalive_seconds = 15.0
 
-img_path_weekday = os.path.join(
-    data_directory,
-    '{}_weekday.png'.format(experimental_condition)
+# Clients may use a cached plot, but have to revalidate it (cheap, thanks to
+# the ETag):
+cache_control = 'public, max-age=0, must-revalidate'
+
+artifact_cache = ArtifactCache(
+    os.path.join(data_directory, 'plot_cache'),
+    max_memory_bytes=int(settings.PLOT_CACHE_MEMORY_MB * 1024**2),
+    max_disk_bytes=int(settings.PLOT_CACHE_DISK_MB * 1024**2),
     )
 
-img_path_weekend = os.path.join(
-    data_directory,
-    '{}_weekend.png'.format(experimental_condition)
+# One store per experimental condition (i.e. per csv file):
+measurement_stores = {}
+
+# Daytime sketches per day, by experimental condition (updated from the store
+# when a plot is requested, in a thread):
+daytime_sketches = {}
+sketches_lock = threading.Lock()
+
+# Render jobs in progress, by job key (concurrent requests for the same plot
+# wait for the same job):
+render_jobs = {}
+
+# The process pool is created on first use. Worker processes are spawned
+# (rather than forked from the running event loop).
+executor = None
+
+# Live readings, published by topic (location, condition). Up to 16 readings
+# are queued per client; slower clients only receive the most recent ones.
+broadcaster = Broadcaster(max_queue=16)
+
+# Rolling statistics of the live readings, by topic (location, condition), with
+# threshold alerts (parsed here, so that invalid settings fail at startup):
+rolling_statistics = {}
+parse_alerts(settings.ALERTS)
+
+# Statistics that are being initialised from the csv file (in a thread), and
+# the readings notified in the meantime, by topic:
+statistics_seeding = {}
+queued_readings = {}
+
+# Metrics, exposed at `/metrics`:
+metrics = Registry(script='server')
+request_seconds = metrics.histogram(
+    'http_request_seconds', 'Duration of HTTP requests.', ['route'])
+requests_total = metrics.counter(
+    'http_requests_total', 'Number of HTTP requests.', ['route', 'status'])
+plot_requests = metrics.counter(
+    'plot_requests_total',
+    'Number of plot requests, by cache result (hit, miss, not_modified).',
+    ['result'],
+    )
+notifications = metrics.counter(
+    'notifications_total', 'Number of received reading notifications.')
+newest_reading = metrics.gauge(
+    'newest_reading_timestamp_seconds',
+    'Timestamp of the newest notified reading (epoch seconds).',
+    ['location', 'condition'],
     )
+alert_events = metrics.counter(
+    'alert_events_total',
+    'Number of threshold alert events, by alert and state (alert, clear).',
+    ['alert', 'state'],
+    )
+stream_subscribers = metrics.gauge(
+    'stream_subscribers', 'Number of connected live stream clients.')
+plot_cache_bytes = metrics.gauge(
+    'plot_cache_bytes', 'Size of the plot cache.', ['tier'])
 
 app = FastAPI()
 
 
+@app.middleware('http')
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template (e.g. '/plot/{location}/{condition}/{view}'),
+    # not by path, to keep the number of label values small:
+    route = request.scope.get('route')
+    route = route.path if route is not None else 'unmatched'
+    request_seconds.observe(time.perf_counter() - start, route=route)
+    requests_total.inc(route=route, status=response.status_code)
+    return response
+
+
+def _seed_statistics(topic, end):
+    """
+    Rolling statistics of a topic, initialised with the readings of the longest
+    window before `end` from the csv file (if available), so that they are
+    complete after a restart of the server. Parses the csv file, i.e. runs in a
+    thread, not in the event loop.
+    """
+    statistics = RollingStatistics(alerts=parse_alerts(settings.ALERTS))
+
+    location, condition = topic
+    path_csv = os.path.join(
+        data_directory,
+        'measurement_{}.csv'.format(condition)
+        )
+    if (location == measurement_location) and os.path.isfile(path_csv):
+        store = measurement_stores.setdefault(
+            condition, MeasurementStore(path_csv))
+        longest = max(max(x) for x in statistics.windows.values())
+        timestamp, pm25, pm10 = store.window(end - longest, end)
+        interval = store.window_interval(end - longest, end)
+        for t, x, y, z in zip(
+                timestamp.tolist(), pm25.tolist(), pm10.tolist(),
+                interval.tolist()):
+            statistics.update(t, interval=z, pm25=x, pm10=y)
+    return statistics
+
+
+async def _seed(topic, end):
+    """Initialise the statistics of a topic, then add the queued readings."""
+    try:
+        statistics = await asyncio.to_thread(_seed_statistics, topic, end)
+        rolling_statistics[topic] = statistics
+        # Readings before `end` are already in the csv file:
+        for message in queued_readings[topic]:
+            if end <= message['timestamp']:
+                _update_statistics(topic, statistics, message)
+        return statistics
+    finally:
+        statistics_seeding.pop(topic, None)
+        queued_readings.pop(topic, None)
+
+
+def _start_seeding(topic, end=None):
+    """
+    Start to initialise the statistics of a topic with the readings before
+    `end` (default: now), unless already started. Returns the task.
+    """
+    if topic not in statistics_seeding:
+        if end is None:
+            end = int(time.time()) + 1
+        queued_readings[topic] = []
+        statistics_seeding[topic] = asyncio.ensure_future(_seed(topic, end))
+    return statistics_seeding[topic]
+
+
+async def _get_statistics(topic):
+    """Rolling statistics of a topic (initialised on first use)."""
+    if topic in rolling_statistics:
+        return rolling_statistics[topic]
+    return await asyncio.shield(_start_seeding(topic))
+
+
+def _update_statistics(topic, statistics, message):
+    """Add a notified reading to the statistics, and publish alert events."""
+    try:
+        events = statistics.update(
+            message['timestamp'],
+            interval=message.get('interval'),
+            pm25=message.get('pm25'),
+            pm10=message.get('pm10'),
+            )
+    except (KeyError, TypeError):
+        return
+    for event in events:
+        alert_events.inc(alert=event['alert'], state=event['state'])
+        event['measurement_location'] = message['measurement_location']
+        event['experimental_condition'] = topic[1]
+        broadcaster.publish(topic, event)
+
+
+class _ReadingProtocol(asyncio.DatagramProtocol):
+    """Receive reading notifications from the measurement scripts."""
+
+    def datagram_received(self, data, addr):
+        try:
+            message = json.loads(data)
+            topic = (
+                message['measurement_location'].replace(' ', '_').lower(),
+                message['experimental_condition'],
+                )
+        except (ValueError, KeyError, AttributeError):
+            return
+        if message.get('type') == 'reading':
+            notifications.inc()
+            try:
+                newest_reading.set(
+                    message['timestamp'], location=topic[0],
+                    condition=topic[1])
+            except (KeyError, TypeError, ValueError):
+                pass
+            broadcaster.publish(topic, message)
+            statistics = rolling_statistics.get(topic)
+            if statistics is not None:
+                _update_statistics(topic, statistics, message)
+                return
+            # Readings that arrive while the statistics are initialised are
+            # added afterwards (the notified reading is already in the csv
+            # file):
+            try:
+                _start_seeding(topic, end=int(message['timestamp']))
+            except (KeyError, TypeError, ValueError):
+                return
+            queued_readings[topic].append(message)
+        elif message.get('type') == 'geotagged':
+            # Reading joined with a GPS fix (`mobile_session.py`):
+            broadcaster.publish(topic, message)
+
+
+@app.on_event('startup')
+async def start_notification_listener():
+    addresses = parse_addresses(settings.NOTIFY_LISTEN_ADDRESS)
+    if not addresses:
+        return
+    loop = asyncio.get_running_loop()
+    await loop.create_datagram_endpoint(
+        _ReadingProtocol,
+        local_addr=addresses[0],
+        )
+
+
+def _get_store(condition):
+    """Measurement data for an experimental condition."""
+    path_csv = os.path.join(
+        data_directory,
+        'measurement_{}.csv'.format(condition)
+        )
+    if not os.path.isfile(path_csv):
+        raise HTTPException(status_code=404, detail='Unknown condition.')
+    if condition not in measurement_stores:
+        measurement_stores[condition] = MeasurementStore(path_csv)
+    return measurement_stores[condition]
+
+
+def _etag_matches(if_none_match, etag):
+    """Whether the `If-None-Match` request header matches the ETag."""
+    if if_none_match is None:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate in ('*', '"{}"'.format(etag)):
+            return True
+    return False
+
+
+def _get_sketches(condition, store):
+    """
+    Daytime sketches of an experimental condition, with the newest data (the
+    caller holds `sketches_lock`).
+    """
+    if condition not in daytime_sketches:
+        daytime_sketches[condition] = DaytimeSketches(bin_minutes=bin_minutes)
+    sketches = daytime_sketches[condition]
+    # The newest reading that was already added is read again, as previous
+    # reading for the weights of readings without interval:
+    if sketches.last_timestamp is None:
+        start = np.iinfo(np.int64).min
+    else:
+        start = sketches.last_timestamp
+    timestamp, pm25, pm10 = store.window(start, exclude=exclude_default)
+    end = (int(timestamp[-1]) + 1) if len(timestamp) else start
+    weights = interval_weights(store.window_interval(start, end), timestamp)
+    # One row per pollutant, in the order of the plot labels (readings that
+    # were already added are skipped). The quality flags of the newest reading
+    # are not final (it is added with the next one):
+    sketches.add(
+        timestamp[:-1], np.stack([pm10[:-1], pm25[:-1]]), weights[:-1])
+    return sketches
+
+
+def _daytime_profile(condition, store, start_day, weekend):
+    """
+    Daytime profile of the selected days (parses the csv file & updates the
+    sketches, i.e. runs in a thread, not in the event loop).
+    """
+    with sketches_lock:
+        return _get_sketches(condition, store).profile(
+            start_day=start_day, weekend=weekend)
+
+
+async def _render(key, job, function=render_view):
+    """Render a plot in the process pool and add it to the cache."""
+    global executor
+    if executor is None:
+        executor = ProcessPoolExecutor(
+            max_workers=settings.RENDER_WORKERS,
+            mp_context=get_context('spawn'),
+            )
+    loop = asyncio.get_running_loop()
+    path_png = artifact_cache.path_tmp(key)
+    with metrics.time_stage('render'):
+        await loop.run_in_executor(
+            executor,
+            partial(function, path_png=path_png, **job),
+            )
+    return artifact_cache.add(key)
+
+
+async def _render_last_24_h(
+    key, store, start_epoch, timestamp, pm25, pm10, **kwargs):
+    """Render the plot of the last 24 hours."""
+    # The same rows as the data (newer rows may have been added meanwhile):
+    end_epoch = (int(timestamp[-1]) + 1) if len(timestamp) else start_epoch
+    interval = await asyncio.to_thread(
+        store.window_interval, start_epoch, end_epoch)
+    job = {
+        'timestamp': timestamp.copy(),
+        'pm25': pm25.copy(),
+        'pm10': pm10.copy(),
+        'interval': interval.copy(),
+        'view': 'last_24_h',
+        'bin_minutes': bin_minutes,
+        **kwargs,
+        }
+    return await _render(key, job)
+
+
+async def _render_profile(key, condition, store, start_day, weekend, **kwargs):
+    """
+    Render a daytime profile view (the daytime sketches of the selected days
+    are merged, and only the profile is sent to the worker).
+    """
+    with metrics.time_stage('daytime_profile'):
+        profile = await asyncio.to_thread(
+            _daytime_profile, condition, store, start_day, weekend)
+    job = {'profile': profile, 'bin_minutes': bin_minutes, **kwargs}
+    return await _render(key, job, render_profile_view)
+
+
+async def plot_response(request, location, condition, view, days, width):
+    """Plot as png, rendered on demand or served from the cache."""
+    if location != measurement_location:
+        raise HTTPException(status_code=404, detail='Unknown location.')
+    if view not in views:
+        raise HTTPException(status_code=404, detail='Unknown view.')
+
+    store = _get_store(condition)
+
+    utc_now = datetime.now(timezone.utc)
+    if view == 'last_24_h':
+        start_epoch = int(round((utc_now - timedelta(days=1)).timestamp()))
+    else:
+        # The last `days` calendar days, including today:
+        start_day = int(time_features([int(utc_now.timestamp())])['day'][0])
+        start_day = start_day - days + 1
+        start_epoch = int(epoch_from_wall_clock(
+            np.array([start_day * 86400], dtype=np.int64))[0])
+    # Parsing the csv file would block the event loop (and the `/stream`
+    # clients), hence it runs in a thread:
+    with metrics.time_stage('data_window'):
+        timestamp, pm25, pm10 = await asyncio.to_thread(
+            store.window, start_epoch, exclude=exclude_default)
+
+    # Current, local time, rounded to the resolution of the plot:
+    local_now = utc_now.astimezone(tz.tzlocal())
+    local_now_hour = float(local_now.hour) + (float(local_now.minute) / 60.0)
+    bin_hours = bin_minutes / 60.0
+    local_now_hour = round(local_now_hour / bin_hours) * bin_hours
+
+    # The plot only depends on the data in the window (identified by count,
+    # first & last timestamp), the view, the size, and the current time marker.
+    key = job_key(
+        location=location,
+        condition=condition,
+        view=view,
+        width=width,
+        bin_minutes=bin_minutes,
+        count=len(timestamp),
+        first=(int(timestamp[0]) if len(timestamp) else None),
+        last=(int(timestamp[-1]) if len(timestamp) else None),
+        local_now_hour=(local_now_hour if view == 'last_24_h' else None),
+        )
+
+    headers = {'Cache-Control': cache_control}
+
+    etag = artifact_cache.etag(key)
+    if etag is None:
+        plot_requests.inc(result='miss')
+        if key not in render_jobs:
+            # The job is registered before its data is prepared (in a thread),
+            # so that concurrent requests wait for the same job:
+            if view == 'last_24_h':
+                render = _render_last_24_h(
+                    key, store, start_epoch, timestamp, pm25, pm10,
+                    utc_now_epoch=utc_now.timestamp(),
+                    local_now_hour=local_now_hour,
+                    width=width,
+                    )
+            else:
+                weekend = {
+                    'combined': None, 'weekday': False, 'weekend': True}[view]
+                render = _render_profile(
+                    key, condition, store, start_day, weekend,
+                    local_now_hour=local_now_hour,
+                    width=width,
+                    )
+            render_jobs[key] = asyncio.ensure_future(render)
+            render_jobs[key].add_done_callback(
+                lambda _: render_jobs.pop(key, None)
+                )
+        etag = await asyncio.shield(render_jobs[key])
+    else:
+        plot_requests.inc(result='hit')
+
+    headers['ETag'] = '"{}"'.format(etag)
+
+    if _etag_matches(request.headers.get('if-none-match'), etag):
+        plot_requests.inc(result='not_modified')
+        return Response(status_code=304, headers=headers)
+
+    content = artifact_cache.get(key)
+    if content is None:
+        # Evicted in the meantime:
+        raise HTTPException(status_code=503, detail='Please retry.')
+
+    return Response(content=content, media_type='image/png', headers=headers)
+
+
+@app.get('/plot/{location}/{condition}/{view}')
+async def plot(
+    request: Request,
+    location: str,
+    condition: str,
+    view: str,
+    days: int = Query(30, ge=1, le=365),
+    width: int = Query(1024, ge=256, le=4096),
+):
+    return await plot_response(request, location, condition, view, days, width)
+
+
 @app.get('/last_24_h')
-async def last_24_h():
-    return FileResponse(img_path_last_24_h)
+async def last_24_h(request: Request):
+    return await plot_response(
+        request, measurement_location, experimental_condition, 'last_24_h', 1,
+        1024)
 
 
 @app.get('/combined')
-async def combined():
-    return FileResponse(img_path_combined)
+async def combined(request: Request):
+    return await plot_response(
+        request, measurement_location, experimental_condition, 'combined',
+        legacy_days, 1024)
 
 
 @app.get('/weekday')
-async def weekday():
-    return FileResponse(img_path_weekday)
+async def weekday(request: Request):
+    return await plot_response(
+        request, measurement_location, experimental_condition, 'weekday',
+        legacy_days, 1024)
 
 
 @app.get('/weekend')
-async def weekend():
-    return FileResponse(img_path_weekend)
+async def weekend(request: Request):
+    return await plot_response(
+        request, measurement_location, experimental_condition, 'weekend',
+        legacy_days, 1024)
+
+
+def _downsample(timestamp, pm25, pm10, method, points):
+    """Downsample both pollutants (run in a thread for large time ranges)."""
+    series = {}
+    for name, values in (('pm25', pm25), ('pm10', pm10)):
+        series_timestamp, series_values = methods[method](
+            timestamp, values, points)
+        series[name] = (series_timestamp, series_values)
+    return series
+
+
+def _arrow_response(series):
+    """Downsampled data as Arrow IPC stream, in long format."""
+    import pyarrow as pa
+
+    names = []
+    for name, (series_timestamp, _) in series.items():
+        names.extend([name] * len(series_timestamp))
+    table = pa.table({
+        'series': pa.array(names).dictionary_encode(),
+        'timestamp': pa.concat_arrays(
+            [pa.array(x[0], type=pa.int64()) for x in series.values()]),
+        'value': pa.concat_arrays(
+            [pa.array(x[1], type=pa.float64()) for x in series.values()]),
+        })
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return Response(
+        content=sink.getvalue().to_pybytes(),
+        media_type='application/vnd.apache.arrow.stream',
+        )
+
+
+@app.get('/data/{location}/{condition}')
+async def data(
+    location: str,
+    condition: str,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    points: int = Query(1000, ge=10, le=10000),
+    method: str = 'lttb',
+    format: str = 'json',
+):
+    """
+    Measurement data between `start` and `end` (epoch timestamps, default: last
+    24 hours), downsampled to at most `points` points per pollutant.
+    """
+    if location != measurement_location:
+        raise HTTPException(status_code=404, detail='Unknown location.')
+    if method not in methods:
+        raise HTTPException(status_code=422, detail='Unknown method.')
+    if format not in ('json', 'arrow'):
+        raise HTTPException(status_code=422, detail='Unknown format.')
+
+    if end is None:
+        end = int(datetime.now(timezone.utc).timestamp()) + 1
+    if start is None:
+        start = end - 86400
+    if (end <= start) or (max_data_days * 86400 < (end - start)):
+        raise HTTPException(status_code=422, detail='Invalid time range.')
+
+    store = _get_store(condition)
+    with metrics.time_stage('data_window'):
+        timestamp, pm25, pm10 = await asyncio.to_thread(
+            store.window, start, end)
+
+    series = await asyncio.to_thread(
+        _downsample, timestamp.copy(), pm25.copy(), pm10.copy(), method,
+        points)
+
+    if format == 'arrow':
+        try:
+            return _arrow_response(series)
+        except ImportError:
+            raise HTTPException(
+                status_code=406,
+                detail='Arrow output is not available (pyarrow missing).',
+                )
+
+    return JSONResponse({
+        'location': location,
+        'condition': condition,
+        'start': start,
+        'end': end,
+        'method': method,
+        'n_measurements': len(timestamp),
+        'series': {
+            name: {
+                'timestamp': series_timestamp.tolist(),
+                # Missing values have already been removed:
+                'value': series_values.tolist(),
+                }
+            for name, (series_timestamp, series_values) in series.items()
+            },
+        })
+
+
+@app.get('/statistics/{location}/{condition}')
+async def statistics(location: str, condition: str):
+    """
+    Rolling statistics of the readings (by pollutant and window length in
+    seconds), and active threshold alerts.
+    """
+    if location != measurement_location:
+        raise HTTPException(status_code=404, detail='Unknown location.')
+    # Raises 404 for unknown conditions:
+    _get_store(condition)
+    statistics = await _get_statistics((location, condition))
+    return JSONResponse({
+        'location': location,
+        'condition': condition,
+        'timestamp': statistics.timestamp,
+        'statistics': statistics.snapshot(now=time.time()),
+        })
+
+
+@app.get('/stream/{location}/{condition}')
+async def stream(location: str, condition: str):
+    """New readings (and threshold alerts) as Server-Sent Events."""
+    if location != measurement_location:
+        raise HTTPException(status_code=404, detail='Unknown location.')
+
+    subscription = broadcaster.subscribe((location, condition))
+
+    async def events():
+        try:
+            # Reconnect after 5 seconds if the connection is lost:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    messages = await asyncio.wait_for(
+                        subscription.get_all(), timeout=keepalive_seconds)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                # Send all pending messages with a single write:
+                yield ''.join(
+                    'event: {}\ndata: {}\n\n'.format(
+                        x.get('type', 'reading'), json.dumps(x))
+                    for x in messages
+                    )
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        )
+
+
+@app.get('/metrics')
+async def metrics_route():
+    """Metrics in the Prometheus text format."""
+    stream_subscribers.set(broadcaster.n_subscribers)
+    plot_cache_bytes.set(artifact_cache.memory_bytes, tier='memory')
+    plot_cache_bytes.set(artifact_cache.disk_bytes, tier='disk')
+    return PlainTextResponse(
+        metrics.expose(),
+        media_type='text/plain; version=0.0.4',
+        )
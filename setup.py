@@ -6,13 +6,17 @@ For development installation:
 
 """
 
-from setuptools import setup, find_packages
+from setuptools import setup, find_namespace_packages
 
 setup(name='py_air_quality',
       version='0.0.1',
       description=('Measure and analyse air particulate concentration.'),
       url='https://github.com/ingo-m/py-air-quality',
       author='Ingo Marquardt',
-      packages=find_packages(),
+      # The sub-packages have no `__init__.py` (namespace packages):
+      packages=find_namespace_packages(include=['py_air_quality*']),
       include_package_data=True,
+      entry_points={
+          'console_scripts': ['py-air-quality=py_air_quality.cli:main'],
+          },
       )
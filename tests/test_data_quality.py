@@ -0,0 +1,44 @@
+import numpy as np
+
+from py_air_quality.crud.data_quality import QualityChecker, quality_flags
+
+parameters = {"gap_seconds": 30.0, "spike_delta": 5.0, "stuck_seconds": 60.0}
+
+
+def _random_readings(rng, n):
+    """Readings with gaps, failed reads, out of range values, spikes & runs."""
+    timestamp = np.cumsum(rng.choice([1, 5, 10, 40], size=n, p=[0.3, 0.4, 0.2, 0.1]))
+    values = rng.choice([0.0, 1.0, 2.0, 30.0], size=(2, n), p=[0.4, 0.3, 0.2, 0.1])
+    # Runs of identical values:
+    repeat = rng.random((2, n)) < 0.7
+    repeat[:, :1] = False
+    previous = np.maximum.accumulate(np.where(repeat, 0, np.arange(n)), axis=1)
+    values = np.take_along_axis(values, previous, axis=1)
+    values[rng.random((2, n)) < 0.05] = np.nan
+    values[rng.random((2, n)) < 0.02] = 1000.0
+    values[rng.random((2, n)) < 0.02] = -1.0
+    return timestamp, values
+
+
+def test_incremental_flags_equal_batch_flags():
+    rng = np.random.default_rng(0)
+    for _ in range(300):
+        n = int(rng.integers(0, 60))
+        timestamp, values = _random_readings(rng, n)
+        expected = quality_flags(timestamp, values, **parameters)
+
+        # Add the readings in chunks of random size (including empty ones), and
+        # replace the revised flags of the previous newest reading:
+        checker = QualityChecker(**parameters)
+        flags = np.zeros((2, 0), dtype=np.uint8)
+        bounds = np.sort(rng.integers(0, n + 1, size=int(rng.integers(0, 8))))
+        for start, end in zip(
+            np.concatenate([[0], bounds]), np.concatenate([bounds, [n]])
+        ):
+            new = checker.update(timestamp[start:end], values[:, start:end])
+            n_revised = new.shape[1] - (end - start)
+            flags = np.concatenate(
+                [flags[:, : flags.shape[1] - n_revised], new], axis=1
+            )
+
+        np.testing.assert_array_equal(flags, expected)
@@ -0,0 +1,43 @@
+import numpy as np
+
+from py_air_quality.crud.read_csv_data import interval_weights
+
+
+def test_recorded_intervals():
+    weights = interval_weights([5.0, 14.6, 60.0], [0, 15, 75])
+    np.testing.assert_array_equal(weights, [5, 15, 60])
+
+
+def test_missing_intervals_from_timestamps():
+    # Fixed interval of 5 seconds, the first reading is weighted by the time
+    # until the second one:
+    weights = interval_weights([np.nan] * 4, [100, 105, 110, 115])
+    np.testing.assert_array_equal(weights, [5, 5, 5, 5])
+
+
+def test_mixed_intervals():
+    # Older readings at a fixed interval of 5 seconds without interval,
+    # followed by readings with recorded (adaptive) intervals:
+    timestamp = np.array([0, 5, 10, 15, 20, 50, 110, 170])
+    interval = np.array([np.nan] * 5 + [30.0, 60.0, 60.0])
+    weights = interval_weights(interval, timestamp)
+    np.testing.assert_array_equal(weights, [5, 5, 5, 5, 5, 30, 60, 60])
+    # Equal concentrations per unit of time give the same weight to both parts
+    # as their duration:
+    assert weights[:5].sum() == 25
+    assert weights[5:].sum() == 150
+
+
+def test_missing_intervals_capped_after_gap():
+    weights = interval_weights([np.nan] * 3, [0, 60, 3660], max_seconds=60.0)
+    np.testing.assert_array_equal(weights, [60, 60, 60])
+
+
+def test_unordered_timestamps():
+    weights = interval_weights([np.nan] * 3, [10, 0, 5])
+    np.testing.assert_array_equal(weights, [5, 5, 5])
+
+
+def test_single_and_no_reading():
+    assert interval_weights([np.nan], [0]).tolist() == [60]
+    assert len(interval_weights([], [])) == 0
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+from py_air_quality.analysis.mobile import join_air_gps
+from py_air_quality.measurement.mobile_session import StreamingJoin, columns
+
+
+def _random_session(rng):
+    """Readings & GPS fixes (unique timestamps), with gaps in both."""
+    span = int(rng.integers(10, 400))
+    time_air = np.sort(
+        rng.choice(span, size=int(rng.integers(0, span // 2)), replace=False)
+    )
+    time_gps = np.sort(
+        rng.choice(span, size=int(rng.integers(1, span // 2)), replace=False)
+    )
+    pm25 = rng.random(len(time_air)) * 50.0
+    pm25[rng.random(len(time_air)) < 0.1] = np.nan
+    return time_air, pm25, time_gps
+
+
+def test_streaming_join_equals_batch_join():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        time_air, pm25, time_gps = _random_session(rng)
+        latitude = 52.5 + rng.random(len(time_gps))
+        longitude = 13.4 + rng.random(len(time_gps))
+
+        df_expected, n_expected = join_air_gps(
+            df_air=pd.DataFrame({"timestamp_air": time_air, "pm25": pm25}),
+            df_gps=pd.DataFrame(
+                {
+                    "timestamp_gps": time_gps,
+                    "latitude": latitude,
+                    "longitude": longitude,
+                }
+            ),
+        )
+
+        # Readings arrive at their time, GPS fixes with a random delay (e.g.
+        # when the GPS file is written in batches), in random order at the same
+        # time:
+        arrivals = [(t, rng.random(), "air", i) for i, t in enumerate(time_air)]
+        arrivals += [
+            (t + int(rng.integers(0, 30)), rng.random(), "gps", i)
+            for i, t in enumerate(time_gps)
+        ]
+        join = StreamingJoin()
+        joined = []
+        for _, _, kind, i in sorted(arrivals):
+            if kind == "air":
+                joined += join.add_reading(int(time_air[i]), pm25=float(pm25[i]))
+            else:
+                joined += join.add_fix(int(time_gps[i]), latitude[i], longitude[i])
+        joined += join.flush()
+
+        df_streamed = pd.DataFrame(joined, columns=columns).sort_values("timestamp_gps")
+        assert join.excluded == n_expected
+        np.testing.assert_array_equal(
+            df_streamed[["timestamp_gps", "timestamp_air"]].to_numpy(dtype=np.int64),
+            df_expected[["timestamp_gps", "timestamp_air"]].to_numpy(dtype=np.int64),
+        )
+        np.testing.assert_array_equal(
+            df_streamed[["latitude", "longitude", "pm25"]].to_numpy(dtype=np.float64),
+            df_expected[["latitude", "longitude", "pm25"]].to_numpy(dtype=np.float64),
+        )